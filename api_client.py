@@ -1,16 +1,27 @@
 import io
+import json
 import logging
 import os
+import time
 from argparse import ArgumentParser, Namespace
 from enum import Enum
-from functools import lru_cache
-from typing import Any, Dict, Iterable, NoReturn, Tuple
+from functools import lru_cache, partial, wraps
+from typing import Any, Callable, Dict, Iterable, NoReturn, Tuple
 
-from flask import Flask, Response, jsonify, make_response, request
+from flask import (Flask, Response, jsonify, make_response, request,
+                   stream_with_context)
 from flask_sslify import SSLify
 
-from engine import BOARDS, FUNCTIONS, MIPS, Board
-from engine.exceptions import InvalidProjectName
+from engine import (BOARDS, FUNCTIONS, MANIFESTS, MIPS, Admission,
+                    ArchiveCache, ArtifactStore, Board, JobQueue, SingleFlight,
+                    generate_delta, get_fingerprint, load_or_generate)
+from engine.constants import DEFAULT_PROJECT_NAME, PATHS
+from engine.exceptions import (InvalidProjectName, Overloaded, QueueFull,
+                               UnknownDigest)
+from engine.utils import serialize
+from engine.utils.cache import get_engine_digest
+from engine.utils.prepare import get_digest
+from flask_hooks import init_metrics, init_profiling
 
 
 logging.basicConfig(
@@ -25,6 +36,44 @@ logging.basicConfig(
 class AppConfig(object):
     SECRET_KEY = os.environ.get("SECRET_KEY") or "no-one-knows"
     SSL_REDIRECT = True  # NOTE not working in debug mode
+    ARCHIVE_CACHE_SIZE = int(os.environ.get("ARCHIVE_CACHE_SIZE") or 64 << 20)
+    ARTIFACT_STORE_PATH = os.environ.get("ARTIFACT_STORE_PATH") or PATHS.STORE
+    ARTIFACT_STORE_SIZE = int(os.environ.get("ARTIFACT_STORE_SIZE") or 1 << 30)
+    ARTIFACT_STORE_TTL = float(os.environ.get("ARTIFACT_STORE_TTL") or 86400)
+    METADATA_CACHE_CONTROL = os.environ.get("METADATA_CACHE_CONTROL") or \
+        "public, max-age=3600"
+    ARCHIVE_CACHE_CONTROL = os.environ.get("ARCHIVE_CACHE_CONTROL") or \
+        "public, no-cache"
+    ARTIFACT_CACHE_CONTROL = os.environ.get("ARTIFACT_CACHE_CONTROL") or \
+        "public, max-age=31536000, immutable"
+    JOBS_PATH = os.environ.get("JOBS_PATH") or \
+        os.path.join(ARTIFACT_STORE_PATH, "jobs.sqlite")
+    JOBS_WORKERS = int(os.environ.get("JOBS_WORKERS") or 2)
+    JOBS_TTL = float(os.environ.get("JOBS_TTL") or 86400)
+    JOBS_MAX = int(os.environ.get("JOBS_MAX") or 1000)
+    JOBS_BATCH_SIZE = int(os.environ.get("JOBS_BATCH_SIZE") or 64)
+    # admission control per process: concurrent and queued requests
+    GENERATION_LIMIT = int(os.environ.get("GENERATION_LIMIT") or
+                           os.cpu_count() or 1)
+    GENERATION_QUEUE = int(os.environ.get("GENERATION_QUEUE") or
+                           2 * GENERATION_LIMIT)
+    GENERATION_QUEUE_TIMEOUT = float(
+        os.environ.get("GENERATION_QUEUE_TIMEOUT") or 10
+    )
+    METADATA_LIMIT = int(os.environ.get("METADATA_LIMIT") or 64)
+    METADATA_QUEUE = int(os.environ.get("METADATA_QUEUE") or 128)
+    METADATA_QUEUE_TIMEOUT = float(
+        os.environ.get("METADATA_QUEUE_TIMEOUT") or 1
+    )
+    # NOTE directory shared by workers, should be emptied before start
+    METRICS_PATH = os.environ.get("METRICS_PATH") or None
+    # on-demand profiling: requests with 'X-Profile: <token>' header and
+    # sampled generations, token also gives access to /profiles
+    PROFILE_PATH = os.environ.get("PROFILE_PATH") or PATHS.PROFILES
+    PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE") or 0)
+    PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL") or 0.002)
+    PROFILE_MAX = int(os.environ.get("PROFILE_MAX") or 100)
 
 
 def create_app(config: AppConfig, name: str = None) -> Flask:
@@ -38,6 +87,40 @@ def create_app(config: AppConfig, name: str = None) -> Flask:
 
 
 app = create_app(AppConfig, "api-client")
+archive_cache = ArchiveCache(app.config['ARCHIVE_CACHE_SIZE'])
+artifact_store = ArtifactStore(app.config['ARTIFACT_STORE_PATH'],
+                               max_bytes=app.config['ARTIFACT_STORE_SIZE'],
+                               ttl=app.config['ARTIFACT_STORE_TTL'])
+generation_flight = SingleFlight()
+generation_admission = Admission(
+    app.config['GENERATION_LIMIT'],
+    queue_size=app.config['GENERATION_QUEUE'],
+    timeout=app.config['GENERATION_QUEUE_TIMEOUT'],
+    name="generations"
+)
+metadata_admission = Admission(
+    app.config['METADATA_LIMIT'],
+    queue_size=app.config['METADATA_QUEUE'],
+    timeout=app.config['METADATA_QUEUE_TIMEOUT'],
+    name="metadata requests"
+)
+# metadata and generated projects are the same until engine is updated
+METADATA_ETAG = get_engine_digest()
+
+metrics = init_metrics(app, "api-client", generation_admission)
+archive_requests = metrics.counter(
+    "sysgen_archive_requests_total",
+    "Archive requests by cache status (X-Cache)", ("cache",)
+)
+error_responses = metrics.counter(
+    "sysgen_errors_total", "Error responses by error code", ("code",)
+)
+profiler = init_profiling(
+    app, "api-client", ("generate",),
+    # NOTE files (POST) are always generated
+    lambda response: response.status_code == 200 and
+    response.headers.get("X-Cache", "MISS") == "MISS"
+)
 
 
 class ErrorCode(Enum):
@@ -45,6 +128,11 @@ class ErrorCode(Enum):
     INVALID_CONFIG = 601
     INVALID_PROJECT_NAME = 602
     UNSUPPORTED_BOARD = 603
+    UNKNOWN_DIGEST = 604
+    UNKNOWN_JOB = 605
+    TOO_MANY_JOBS = 606
+    OVERLOADED = 607
+    UNSUPPORTED_FORMAT = 608
 
 
 class Config(object):
@@ -84,20 +172,192 @@ class Config(object):
 def create_error_response(code: ErrorCode,
                           description: str) -> Tuple[Response, int]:
     logging.error("%s (%s): '%s'", code.name, code.value, description)
+    error_responses.inc(code=code.name)
     return jsonify({
         'name': code.name,
         'info': description
     }), 405
 
 
+def create_overloaded_response(error: Overloaded) -> Tuple[Response, int]:
+    error_responses.inc(code=ErrorCode.OVERLOADED.name)
+    response = jsonify({
+        'name': ErrorCode.OVERLOADED.name,
+        'info': str(error)
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+
+def admitted(admission: Admission) -> Callable:
+    """ Route decorator for admission control """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Response:
+            with admission.admit():
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_setup_params(config: Config) -> dict:
+    return {
+        'project_name': config.project_name,
+        'mips_type': config.mips_type,
+        'flt': config.configs,
+        'conf': config.functions_params,
+        'func': config.functions
+    }
+
+
+def get_archive_etag(config: Config) -> Tuple[str, bool]:
+    """
+        Returns ETag of archive by canonical config digest and whether
+        it's weak: archives of the same config differ by generation dates
+        unless SOURCE_DATE_EPOCH is set
+    """
+    fingerprint = get_fingerprint(config.board, **get_setup_params(config))
+    return get_digest(f"{METADATA_ETAG}:{fingerprint}"), \
+        not os.environ.get("SOURCE_DATE_EPOCH")
+
+
+def make_conditional(response: Response,
+                     etag: str,
+                     cache_control: str,
+                     weak: bool = False) -> Response:
+    """ Sets ETag and Cache-Control, returns 304 if ETag matches """
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
+
+
+def is_not_modified(etag: str) -> bool:
+    """ Checks If-None-Match (weak comparison) before response is prepared """
+    return request.method in ("GET", "HEAD") and \
+        request.if_none_match.contains_weak(etag)
+
+
 def get_configured_board(config: Config) -> Board:
-    return Board(config.board).setup(
-        project_name=config.project_name,
-        mips_type=config.mips_type,
-        flt=config.configs,
-        conf=config.functions_params,
-        func=config.functions
-    ).generate()
+    return Board(config.board).setup(**get_setup_params(config)).generate()
+
+
+def load_or_generate_archive(config: Config,
+                             fingerprint: str,
+                             progress: Callable[[str], Any] = None
+                             ) -> Tuple[dict, str]:
+    """ Loads archive from artifact store or generates it, caches it """
+    archive, status = load_or_generate(artifact_store, fingerprint,
+                                       config.board, get_setup_params(config),
+                                       progress)
+    archive_cache.put(fingerprint, archive, size=len(archive['content']))
+    return archive, status
+
+
+def admit_generation(func: Callable, *args) -> Any:
+    """ Calls func if generation is admitted (raises Overloaded) """
+    with generation_admission.admit():
+        return func(*args)
+
+
+def get_configured_archive(config: Config,
+                           progress: Callable[[str], Any] = None
+                           ) -> Tuple[dict, str]:
+    """
+        Returns generated archive ('filename', 'content', project 'digest',
+        'artifact' digest) and where it was found: 'HIT' (memory cache),
+        'STORE' (artifact store), 'SHARED' (concurrent request result)
+        or 'MISS' (generated)
+
+        :param progress: called with stages of generation (if project
+            is generated by this call)
+    """
+    fingerprint = get_fingerprint(config.board, **get_setup_params(config))
+    archive = archive_cache.get(fingerprint)
+    if archive is not None:
+        return archive, "HIT"
+
+    (archive, status), shared = generation_flight.do(
+        fingerprint, admit_generation, load_or_generate_archive,
+        config, fingerprint, progress
+    )
+    return archive, ("SHARED" if shared else status)
+
+
+def run_job(params: list, progress: Callable) -> list:
+    """
+        Generates archives for list of configs (job handler), reports
+        'load', 'render' and 'archive' stages of every generated item.
+        Generation is shared with requests and waits for admission.
+
+        :return archives info ('filename', project 'digest', 'artifact'
+            digest and its 'url')
+    """
+    results = []
+    for item, data in enumerate(params):
+        config = Config(data)
+        while True:
+            try:
+                archive, _ = get_configured_archive(
+                    config, partial(progress, item=item)
+                )
+                break
+            except Overloaded as e:
+                time.sleep(e.retry_after)
+        results.append({
+            'filename': archive['filename'],
+            'digest': archive['digest'],
+            'artifact': archive['artifact'],
+            'url': f"/artifact/{archive['artifact']}"
+        })
+    return results
+
+
+job_queue = JobQueue(app.config['JOBS_PATH'], run_job,
+                     workers=app.config['JOBS_WORKERS'],
+                     ttl=app.config['JOBS_TTL'],
+                     max_jobs=app.config['JOBS_MAX'])
+
+
+@app.before_request
+def start_job_queue() -> NoReturn:
+    # NOTE queue is started by the first request instead of import,
+    # so threads aren't started by importing module (before fork)
+    job_queue.start()
+
+
+def validate_job(data: Any) -> str or None:
+    if not isinstance(data, list):
+        data = [data]
+    if not data or len(data) > app.config['JOBS_BATCH_SIZE']:
+        return f"Expected from 1 to {app.config['JOBS_BATCH_SIZE']} configs"
+    for item in data:
+        if not isinstance(item, dict):
+            return f"Invalid config type '{type(item)}'"
+        validation_result = Config.validate_config(item)
+        if validation_result is not None:
+            return validation_result
+
+
+def format_event(event: dict) -> str:
+    """ Returns job event as server-sent event """
+    return f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+
+
+def send_files(files: dict, media_type: str, digest: str) -> Response:
+    """ Streams serialized (and compressed if accepted) files """
+    encoding = serialize.get_encoding(request.headers.get("Accept-Encoding"))
+    response = Response(
+        stream_with_context(
+            serialize.compress(serialize.serialize(files, media_type),
+                               encoding)
+        ),
+        mimetype=media_type
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = "Accept, Accept-Encoding"
+    response.headers['X-Project-Digest'] = digest
+    return response
 
 
 def send_archive(content: io.BytesIO, filename: str) -> Response:
@@ -117,6 +377,10 @@ def generate() -> Response:
         Returns generated files as internal representation (json object)
             for POST requests.
 
+        POST responses format is negotiated by 'Accept' header: json
+            (default), NDJSON (streamed line per file) or MessagePack,
+            and compressed according to 'Accept-Encoding' (gzip or br).
+
         Required
         --------
         * board: str - one of supported boards model
@@ -128,8 +392,11 @@ def generate() -> Response:
         * conf: List[str] - board configuration
         * func: List[str] - functions to include
         * params: Dict[str, int] - functions configurations
+        * fields: str - comma separated names or patterns of files
+            to return (POST only)
     """
-    params = request.args
+    params = request.args.to_dict()
+    fields = params.pop("fields", None) if request.method == "POST" else None
 
     validation_result = Config.validate_config(params)
     if validation_result is not None:
@@ -138,42 +405,222 @@ def generate() -> Response:
             description=validation_result
         )
 
+    config = Config(params)
+    if request.method == "POST":
+        media_type = serialize.best_match(request.headers.get("Accept"),
+                                          serialize.get_formats())
+        if media_type is None:
+            return create_error_response(
+                ErrorCode.UNSUPPORTED_FORMAT,
+                description=f"Supported formats: {serialize.get_formats()}"
+            )
+    else:
+        etag, weak = get_archive_etag(config)
+        if is_not_modified(etag):
+            return make_conditional(make_response("", 304), etag,
+                                    app.config['ARCHIVE_CACHE_CONTROL'], weak)
     try:
-        board = get_configured_board(Config(params))
+        if request.method == "POST":
+            board = admit_generation(get_configured_board, config)
+            MANIFESTS.add(board.digests)
+        else:
+            archive, status = get_configured_archive(config)
     except InvalidProjectName as e:
         return create_error_response(ErrorCode.INVALID_PROJECT_NAME, str(e))
+    except Overloaded as e:
+        return create_overloaded_response(e)
     except BaseException as e:
         return create_error_response(ErrorCode.UNKNOWN_ERROR, str(e))
 
     if request.method == "POST":
-        return jsonify(board.configs)
-    return send_archive(board.as_archive, f"{board.project_name}.tar")
+        return send_files(serialize.select_files(board.configs, fields),
+                          media_type, board.digest)
+
+    response = send_archive(io.BytesIO(archive['content']),
+                            archive['filename'])
+    response.headers['X-Project-Digest'] = archive['digest']
+    response.headers['X-Artifact-Digest'] = archive['artifact']
+    response.headers['X-Cache'] = status
+    archive_requests.inc(cache=status)
+    return make_conditional(response, etag,
+                            app.config['ARCHIVE_CACHE_CONTROL'], weak)
+
+
+@app.route("/artifact/<digest>")
+@admitted(metadata_admission)
+def artifact(digest: str) -> Response:
+    """ Returns archive generated earlier by its 'X-Artifact-Digest' """
+    if is_not_modified(digest) and artifact_store.meta(digest) is not None:
+        return make_conditional(make_response("", 304), digest,
+                                app.config['ARTIFACT_CACHE_CONTROL'])
+    content, meta = artifact_store.get_with_meta(digest)
+    if content is None:
+        return create_error_response(
+            ErrorCode.UNKNOWN_DIGEST,
+            description=f"There is no artifact '{digest}'"
+        )
+    response = send_archive(io.BytesIO(content),
+                            meta.get("filename") or f"{digest}.tar")
+    return make_conditional(response, digest,
+                            app.config['ARTIFACT_CACHE_CONTROL'])
+
+
+@app.route("/delta", methods=["POST"])
+def delta() -> Response:
+    """
+        API
+        ===
+
+        Returns archive with files added or changed since previous
+            project and 'DELTA.json' manifest (with removed files list).
+
+        Parameters are the same as for '/generate' (json object)
+            with additional required 'previous'.
+
+        Required
+        --------
+        * previous: str or dict - digest of previous project (from
+            'X-Project-Digest' header or 'DELTA.json') or its parameters
+    """
+    params = dict(request.get_json(silent=True) or {})
+    previous = params.pop("previous", None)
+
+    validation_result = Config.validate_config(params)
+    if validation_result is None and not isinstance(previous, (str, dict)):
+        validation_result = "Missing required parameter 'previous'"
+    if validation_result is None and isinstance(previous, dict):
+        previous = dict(previous, board=params['board'])
+        validation_result = Config.validate_config(previous)
+    if validation_result is not None:
+        return create_error_response(
+            ErrorCode.INVALID_CONFIG,
+            description=validation_result
+        )
+
+    config = Config(params)
+    if isinstance(previous, dict):
+        previous = get_setup_params(Config(previous))
+    try:
+        archive = admit_generation(generate_delta, config.board,
+                                   get_setup_params(config), previous)
+    except InvalidProjectName as e:
+        return create_error_response(ErrorCode.INVALID_PROJECT_NAME, str(e))
+    except Overloaded as e:
+        return create_overloaded_response(e)
+    except UnknownDigest as e:
+        return create_error_response(ErrorCode.UNKNOWN_DIGEST, e.args[0])
+    except BaseException as e:
+        return create_error_response(ErrorCode.UNKNOWN_ERROR, str(e))
+
+    name = config.project_name or DEFAULT_PROJECT_NAME
+    return send_archive(archive, f"{name}.delta.tar")
+
+
+@app.route("/jobs", methods=["POST"])
+def jobs() -> Tuple[Response, int]:
+    """
+        API
+        ===
+
+        Queues generation of config (json object with '/generate'
+            parameters) or list of configs, returns job 'id'.
+    """
+    data = request.get_json(silent=True)
+    validation_result = validate_job(data)
+    if validation_result is not None:
+        return create_error_response(
+            ErrorCode.INVALID_CONFIG,
+            description=validation_result
+        )
+    try:
+        job = job_queue.submit(data if isinstance(data, list) else [data])
+    except QueueFull as e:
+        return create_error_response(ErrorCode.TOO_MANY_JOBS, str(e))
+
+    response = jsonify({
+        'id': job,
+        'url': f"/jobs/{job}",
+        'events': f"/jobs/{job}/events"
+    })
+    response.headers['Location'] = f"/jobs/{job}"
+    return response, 202
+
+
+@app.route("/jobs/<job>")
+@admitted(metadata_admission)
+def job_status(job: str) -> Response:
+    """ Returns job state, last stage and result (list of archives) """
+    info = job_queue.get(job)
+    if info is None:
+        return create_error_response(ErrorCode.UNKNOWN_JOB,
+                                     description=f"There is no job '{job}'")
+    return jsonify(info)
+
+
+@app.route("/jobs/<job>/events")
+def job_events(job: str) -> Response:
+    """ Streams job stages as server-sent events until it's finished """
+    if job_queue.get(job) is None:
+        return create_error_response(ErrorCode.UNKNOWN_JOB,
+                                     description=f"There is no job '{job}'")
+    response = Response(
+        stream_with_context(map(format_event, job_queue.events(job))),
+        mimetype="text/event-stream"
+    )
+    response.headers['Cache-Control'] = "no-cache"
+    return response
+
+
+@app.route("/cache")
+@admitted(metadata_admission)
+def cache() -> Response:
+    return jsonify(dict(archive_cache.stats,
+                        shared=generation_flight.shared,
+                        store=artifact_store.stats,
+                        jobs=job_queue.stats,
+                        admission={
+                            'generation': generation_admission.stats,
+                            'metadata': metadata_admission.stats
+                        }))
+
+
+def send_metadata(data: dict) -> Response:
+    return make_conditional(jsonify(data), METADATA_ETAG,
+                            app.config['METADATA_CACHE_CONTROL'])
+
+
+@lru_cache()
+def get_board_params(board: str) -> dict:
+    return Board(board).params
 
 
 @app.route("/boards")
+@admitted(metadata_admission)
 def boards() -> Response:
-    return jsonify({'supported boards': BOARDS})
+    return send_metadata({'supported boards': BOARDS})
 
 
 @app.route("/board/<board>")
-@lru_cache()
+@admitted(metadata_admission)
 def board(board: str) -> Response:
     if board not in BOARDS:
         return create_error_response(
             ErrorCode.UNSUPPORTED_BOARD,
             description=f"There is no '{board}' in supported list: {BOARDS}"
         )
-    return jsonify({'board': board, 'params': Board(board).params})
+    return send_metadata({'board': board, 'params': get_board_params(board)})
 
 
 @app.route("/mips")
+@admitted(metadata_admission)
 def mips() -> Response:
-    return jsonify({'supported mips types': MIPS.VERSIONS})
+    return send_metadata({'supported mips types': MIPS.VERSIONS})
 
 
 @app.route("/functions")
+@admitted(metadata_admission)
 def functions() -> Response:
-    return jsonify({
+    return send_metadata({
         'supported functions': FUNCTIONS.ITEMS,
         'configurations': FUNCTIONS.PARAMS
     })
@@ -186,6 +633,11 @@ def get_response_from_error(error: Exception) -> Tuple[Response, int]:
     }), error.code
 
 
+@app.errorhandler(Overloaded)
+def overloaded(error: Overloaded) -> Tuple[Response, int]:
+    return create_overloaded_response(error)
+
+
 @app.errorhandler(401)
 def unauthorized(error: Exception) -> Tuple[Response, int]:
     return get_response_from_error(error)
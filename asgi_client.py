@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import os
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from contextlib import asynccontextmanager
+from functools import wraps
+from http import HTTPStatus
+from typing import Any, AsyncGenerator, Callable, Dict, NoReturn, Tuple
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import api_client
+from api_client import (METADATA_ETAG, Config, ErrorCode, archive_cache,
+                        artifact_store, format_event, get_archive_etag,
+                        get_board_params, get_configured_board,
+                        get_setup_params, job_queue, load_or_generate_archive,
+                        validate_job)
+from engine import (BOARDS, FUNCTIONS, MANIFESTS, MIPS, Admission, Board,
+                    get_fingerprint)
+from engine.constants import DEFAULT_PROJECT_NAME
+from engine.delta import delta_archive, get_delta_date
+from engine.exceptions import (InvalidProjectName, Overloaded, QueueFull,
+                               UnknownDigest)
+from engine.utils import serialize
+
+
+class AppConfig(api_client.AppConfig):
+    # 'process' for CPU-bound generations or 'thread'
+    GENERATION_EXECUTOR = os.environ.get("GENERATION_EXECUTOR") or "thread"
+    GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS") or
+                             os.cpu_count() or 1)
+    STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE") or 64 << 10)
+
+
+class AsyncFlight(object):
+    """ Coalesces identical concurrent awaitables in event loop """
+
+    def __init__(self) -> NoReturn:
+        self._calls = {}
+        self.shared = 0
+
+    async def do(self, key: str, func: Callable, *args) -> Tuple[Any, bool]:
+        """ :return result of func coroutine and whether it was shared """
+        if key in self._calls:
+            self.shared += 1
+            return await asyncio.shield(self._calls[key]), True
+
+        future = self._calls[key] = asyncio.ensure_future(func(*args))
+        try:
+            return await asyncio.shield(future), False
+        finally:
+            if future.done():
+                del self._calls[key]
+            else:  # leader is cancelled (client is gone)
+                future.add_done_callback(
+                    lambda _: self._calls.pop(key, None)
+                )
+
+
+generation_flight = AsyncFlight()
+
+
+def create_executor(config: AppConfig) -> Executor:
+    if config.GENERATION_EXECUTOR == "process":
+        executor = ProcessPoolExecutor(max_workers=config.GENERATION_WORKERS)
+        # NOTE workers are forked at once by the first task, so they're
+        # started here, before threads of server (job queue, thread pool)
+        executor.submit(int).result()
+        return executor
+    return ThreadPoolExecutor(max_workers=config.GENERATION_WORKERS,
+                              thread_name_prefix="generation")
+
+
+# NOTE functions below are executed in workers, so they should be
+# top level and return only picklable objects
+
+
+def get_configured_files(config: Config,
+                         fields: str = None) -> Tuple[dict, Dict[str, str]]:
+    """ :return generated files (selected by fields) and their digests """
+    board = get_configured_board(config)
+    return serialize.select_files(board.configs, fields), board.digests
+
+
+def get_delta(config: Config,
+              previous: Config or Dict[str, str]) -> Tuple[bytes, dict]:
+    """
+        :param previous: config or files' digests of previous project
+        :return delta archive content and files' digests of new project
+    """
+    date_t = get_delta_date()
+    if isinstance(previous, Config):
+        previous = Board(config.board).setup(
+            **get_setup_params(previous)
+        ).generate(date_t=date_t).digests
+    board = Board(config.board).setup(**get_setup_params(config)).generate(
+        date_t=date_t
+    )
+    return delta_archive(board, previous).getvalue(), board.digests
+
+
+async def run_generation(request: Request, func: Callable, *args) -> Any:
+    """ Runs func in executor if generation is admitted """
+    executor = request.app.state.executor
+    async with request.app.state.generation_admission.admit_async():
+        return await asyncio.get_running_loop().run_in_executor(executor,
+                                                                func, *args)
+
+
+def admitted(func: Callable) -> Callable:
+    """ Route decorator for admission control of metadata requests """
+    @wraps(func)
+    async def wrapper(request: Request) -> Response:
+        async with request.app.state.metadata_admission.admit_async():
+            return await func(request)
+    return wrapper
+
+
+def create_error_response(code: ErrorCode, description: str) -> JSONResponse:
+    logging.error("%s (%s): '%s'", code.name, code.value, description)
+    return JSONResponse({'name': code.name, 'info': description},
+                        status_code=405)
+
+
+def create_overloaded_response(error: Overloaded) -> JSONResponse:
+    return JSONResponse({
+        'name': ErrorCode.OVERLOADED.name,
+        'info': str(error)
+    }, status_code=503, headers={'Retry-After': str(error.retry_after)})
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """ Checks If-None-Match (weak comparison) before response is prepared """
+    if request.method not in ("GET", "HEAD"):
+        return False
+    tags = request.headers.get("if-none-match", "")
+    return any(tag.strip() in ("*", f'"{etag}"', f'W/"{etag}"')
+               for tag in tags.split(","))
+
+
+def make_conditional(request: Request,
+                     response: Response,
+                     etag: str,
+                     cache_control: str,
+                     weak: bool = False) -> Response:
+    """ Sets ETag and Cache-Control, returns 304 if ETag matches """
+    headers = {'ETag': f'{"W/" if weak else ""}"{etag}"',
+               'Cache-Control': cache_control}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
+
+
+async def iter_chunks(content: bytes,
+                      chunk_size: int) -> AsyncGenerator[bytes, None]:
+    view = memoryview(content)
+    for offset in range(0, len(content), chunk_size):
+        yield bytes(view[offset:offset + chunk_size])
+        await asyncio.sleep(0)  # let other requests be served
+
+
+def send_archive(request: Request,
+                 content: bytes,
+                 filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        iter_chunks(content, request.app.state.config.STREAM_CHUNK_SIZE),
+        media_type="application/octet-stream",
+        headers={
+            'Content-Disposition': f"attachment; filename={filename}",
+            'Content-Length': str(len(content))
+        }
+    )
+
+
+def send_files(request: Request,
+               files: dict,
+               media_type: str,
+               digest: str) -> StreamingResponse:
+    """ See api_client.send_files """
+    encoding = serialize.get_encoding(request.headers.get("accept-encoding"))
+    headers = {
+        'Vary': "Accept, Accept-Encoding",
+        'X-Project-Digest': digest
+    }
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    # NOTE blocking iterator is run in thread pool by starlette
+    return StreamingResponse(
+        serialize.compress(serialize.serialize(files, media_type), encoding),
+        media_type=media_type,
+        headers=headers
+    )
+
+
+async def get_archive(request: Request, config: Config) -> Tuple[dict, str]:
+    """ Async variant of api_client.get_configured_archive """
+    fingerprint = get_fingerprint(config.board, **get_setup_params(config))
+    archive = archive_cache.get(fingerprint)
+    if archive is not None:
+        return archive, "HIT"
+
+    (archive, status), shared = await generation_flight.do(
+        fingerprint, run_generation, request,
+        load_or_generate_archive, config, fingerprint
+    )
+    # NOTE archives generated by worker processes are cached and their
+    # files are registered (for delta archives) only there
+    archive_cache.put(fingerprint, archive, size=len(archive['content']))
+    MANIFESTS.add(archive['files'])
+    return archive, ("SHARED" if shared else status)
+
+
+async def generate(request: Request) -> Response:
+    """ See api_client.generate """
+    params = dict(request.query_params)
+    fields = params.pop("fields", None) if request.method == "POST" else None
+
+    validation_result = Config.validate_config(params)
+    if validation_result is not None:
+        return create_error_response(
+            ErrorCode.INVALID_CONFIG,
+            description=validation_result
+        )
+
+    settings = request.app.state.config
+    config = Config(params)
+    if request.method == "POST":
+        media_type = serialize.best_match(request.headers.get("accept"),
+                                          serialize.get_formats())
+        if media_type is None:
+            return create_error_response(
+                ErrorCode.UNSUPPORTED_FORMAT,
+                description=f"Supported formats: {serialize.get_formats()}"
+            )
+    else:
+        etag, weak = get_archive_etag(config)
+        if is_not_modified(request, etag):
+            return make_conditional(request, Response(), etag,
+                                    settings.ARCHIVE_CACHE_CONTROL, weak)
+    try:
+        if request.method == "POST":
+            files, digests = await run_generation(
+                request, get_configured_files, config, fields
+            )
+            digest = MANIFESTS.add(digests)
+        else:
+            archive, status = await get_archive(request, config)
+    except InvalidProjectName as e:
+        return create_error_response(ErrorCode.INVALID_PROJECT_NAME, str(e))
+    except Overloaded as e:
+        return create_overloaded_response(e)
+    except BaseException as e:
+        return create_error_response(ErrorCode.UNKNOWN_ERROR, str(e))
+
+    if request.method == "POST":
+        return send_files(request, files, media_type, digest)
+
+    response = send_archive(request, archive['content'], archive['filename'])
+    response.headers.update({
+        'X-Project-Digest': archive['digest'],
+        'X-Artifact-Digest': archive['artifact'],
+        'X-Cache': status
+    })
+    return make_conditional(request, response, etag,
+                            settings.ARCHIVE_CACHE_CONTROL, weak)
+
+
+@admitted
+async def artifact(request: Request) -> Response:
+    """ See api_client.artifact """
+    digest = request.path_params['digest']
+    cache_control = request.app.state.config.ARTIFACT_CACHE_CONTROL
+    if is_not_modified(request, digest) and await run_in_threadpool(
+            artifact_store.meta, digest) is not None:
+        return make_conditional(request, Response(), digest, cache_control)
+    content, meta = await run_in_threadpool(artifact_store.get_with_meta,
+                                            digest)
+    if content is None:
+        return create_error_response(
+            ErrorCode.UNKNOWN_DIGEST,
+            description=f"There is no artifact '{digest}'"
+        )
+    response = send_archive(request, content,
+                            meta.get("filename") or f"{digest}.tar")
+    return make_conditional(request, response, digest, cache_control)
+
+
+async def delta(request: Request) -> Response:
+    """ See api_client.delta """
+    try:
+        params = await request.json()
+    except ValueError:
+        params = None
+    params = dict(params) if isinstance(params, dict) else {}
+    previous = params.pop("previous", None)
+
+    validation_result = Config.validate_config(params)
+    if validation_result is None and not isinstance(previous, (str, dict)):
+        validation_result = "Missing required parameter 'previous'"
+    if validation_result is None and isinstance(previous, dict):
+        previous = dict(previous, board=params['board'])
+        validation_result = Config.validate_config(previous)
+    if validation_result is not None:
+        return create_error_response(
+            ErrorCode.INVALID_CONFIG,
+            description=validation_result
+        )
+
+    config = Config(params)
+    try:
+        # digests are registered in this process only
+        previous = MANIFESTS.get(previous) if isinstance(previous, str) \
+            else Config(previous)
+        content, digests = await run_generation(request, get_delta,
+                                                config, previous)
+        MANIFESTS.add(digests)
+    except InvalidProjectName as e:
+        return create_error_response(ErrorCode.INVALID_PROJECT_NAME, str(e))
+    except Overloaded as e:
+        return create_overloaded_response(e)
+    except UnknownDigest as e:
+        return create_error_response(ErrorCode.UNKNOWN_DIGEST, e.args[0])
+    except BaseException as e:
+        return create_error_response(ErrorCode.UNKNOWN_ERROR, str(e))
+
+    name = config.project_name or DEFAULT_PROJECT_NAME
+    return send_archive(request, content, f"{name}.delta.tar")
+
+
+async def jobs(request: Request) -> Response:
+    """ See api_client.jobs """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    validation_result = validate_job(data)
+    if validation_result is not None:
+        return create_error_response(
+            ErrorCode.INVALID_CONFIG,
+            description=validation_result
+        )
+    try:
+        job = await run_in_threadpool(
+            job_queue.submit, data if isinstance(data, list) else [data]
+        )
+    except QueueFull as e:
+        return create_error_response(ErrorCode.TOO_MANY_JOBS, str(e))
+
+    return JSONResponse({
+        'id': job,
+        'url': f"/jobs/{job}",
+        'events': f"/jobs/{job}/events"
+    }, status_code=202, headers={'Location': f"/jobs/{job}"})
+
+
+@admitted
+async def job_status(request: Request) -> Response:
+    """ See api_client.job_status """
+    job = request.path_params['job']
+    info = await run_in_threadpool(job_queue.get, job)
+    if info is None:
+        return create_error_response(ErrorCode.UNKNOWN_JOB,
+                                     description=f"There is no job '{job}'")
+    return JSONResponse(info)
+
+
+async def job_events(request: Request) -> Response:
+    """ See api_client.job_events """
+    job = request.path_params['job']
+    if await run_in_threadpool(job_queue.get, job) is None:
+        return create_error_response(ErrorCode.UNKNOWN_JOB,
+                                     description=f"There is no job '{job}'")
+    # NOTE blocking iterator is run in thread pool by starlette
+    return StreamingResponse(map(format_event, job_queue.events(job)),
+                             media_type="text/event-stream",
+                             headers={'Cache-Control': "no-cache"})
+
+
+@admitted
+async def cache(request: Request) -> Response:
+    admission = {
+        'generation': request.app.state.generation_admission.stats,
+        'metadata': request.app.state.metadata_admission.stats
+    }
+    store = await run_in_threadpool(lambda: artifact_store.stats)
+    jobs = await run_in_threadpool(lambda: job_queue.stats)
+    return JSONResponse(dict(archive_cache.stats,
+                             shared=generation_flight.shared,
+                             store=store,
+                             jobs=jobs,
+                             admission=admission))
+
+
+def send_metadata(request: Request, data: dict) -> Response:
+    return make_conditional(request, JSONResponse(data), METADATA_ETAG,
+                            request.app.state.config.METADATA_CACHE_CONTROL)
+
+
+@admitted
+async def boards(request: Request) -> Response:
+    return send_metadata(request, {'supported boards': BOARDS})
+
+
+@admitted
+async def board(request: Request) -> Response:
+    board = request.path_params['board']
+    if board not in BOARDS:
+        return create_error_response(
+            ErrorCode.UNSUPPORTED_BOARD,
+            description=f"There is no '{board}' in supported list: {BOARDS}"
+        )
+    params = await run_in_threadpool(get_board_params, board)
+    return send_metadata(request, {'board': board, 'params': params})
+
+
+@admitted
+async def mips(request: Request) -> Response:
+    return send_metadata(request, {'supported mips types': MIPS.VERSIONS})
+
+
+@admitted
+async def functions(request: Request) -> Response:
+    return send_metadata(request, {
+        'supported functions': FUNCTIONS.ITEMS,
+        'configurations': FUNCTIONS.PARAMS
+    })
+
+
+async def overloaded(request: Request, error: Overloaded) -> Response:
+    return create_overloaded_response(error)
+
+
+async def http_error(request: Request, error: HTTPException) -> Response:
+    return JSONResponse({
+        'name': HTTPStatus(error.status_code).phrase,
+        'info': error.detail
+    }, status_code=error.status_code, headers=error.headers)
+
+
+def create_app(config: AppConfig) -> Starlette:
+    @asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncGenerator[None, None]:
+        app.state.executor = create_executor(config)
+        # NOTE after workers of executor are forked
+        job_queue.start()
+        try:
+            yield
+        finally:
+            app.state.executor.shutdown(wait=False)
+
+    app = Starlette(
+        routes=[
+            Route("/generate", generate, methods=["GET", "POST"]),
+            Route("/artifact/{digest}", artifact),
+            Route("/delta", delta, methods=["POST"]),
+            Route("/jobs", jobs, methods=["POST"]),
+            Route("/jobs/{job}", job_status),
+            Route("/jobs/{job}/events", job_events),
+            Route("/cache", cache),
+            Route("/boards", boards),
+            Route("/board/{board}", board),
+            Route("/mips", mips),
+            Route("/functions", functions)
+        ],
+        exception_handlers={HTTPException: http_error,
+                            Overloaded: overloaded},
+        lifespan=lifespan
+    )
+    app.state.config = config
+    app.state.generation_admission = Admission(
+        config.GENERATION_LIMIT,
+        queue_size=config.GENERATION_QUEUE,
+        timeout=config.GENERATION_QUEUE_TIMEOUT,
+        name="generations"
+    )
+    app.state.metadata_admission = Admission(
+        config.METADATA_LIMIT,
+        queue_size=config.METADATA_QUEUE,
+        timeout=config.METADATA_QUEUE_TIMEOUT,
+        name="metadata requests"
+    )
+    return app
+
+
+app = create_app(AppConfig)
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Starter for asynchronous API client")
+    parser.add_argument('host', type=str, default="127.0.0.1", nargs="?")
+    parser.add_argument('--port', '-p', type=int, default=8000)
+    parser.add_argument('--debug', '-d', action="store_true")
+    return parser.parse_args()
+
+
+def main() -> int:
+    import uvicorn
+
+    args = parse_argv()
+
+    uvicorn.run(app, host=args.host, port=args.port,
+                log_level="debug" if args.debug else "info")
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
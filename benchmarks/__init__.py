@@ -0,0 +1,20 @@
+""" Performance benchmarks for engine and clients. """
+
+import os
+import sys
+import time
+from typing import Callable, List
+
+
+# to run benchmarks as scripts from project root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(func: Callable, repeat: int = 5) -> List[float]:
+    """ :return sorted durations (seconds) of repeated calls """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return sorted(durations)
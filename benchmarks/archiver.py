@@ -0,0 +1,83 @@
+"""
+    Benchmark of Archiver on trees of generated projects.
+
+    Usage: python -m benchmarks.archiver [--files N] [--size BYTES]
+"""
+
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import zipfile
+from argparse import ArgumentParser, Namespace
+from typing import NoReturn
+
+from benchmarks import measure
+from engine.utils.prepare import Archiver
+
+
+def make_tree(root: str, files: int, size: int, per_dir: int = 50) -> str:
+    """ Create tree of projects-like folders with files of specified size """
+    content = os.urandom(size // 2).hex().encode()
+    for i in range(files):
+        dirname = os.path.join(root, f"project_{i // per_dir}", "mips")
+        os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, f"file_{i}.v"), "wb") as fout:
+            fout.write(content)
+    return root
+
+
+def sequential_tar(path: str, *files: str) -> NoReturn:
+    with tarfile.open(path, "w") as tar_fout:
+        for filename in files:
+            tar_fout.add(filename)
+
+
+def sequential_zip(path: str, *files: str) -> NoReturn:
+    with zipfile.ZipFile(path, "w") as zf_out:
+        for filename in files:
+            for dirname, _, filenames in os.walk(filename):
+                zf_out.write(dirname)
+                for name in filenames:
+                    zf_out.write(os.path.join(dirname, name))
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Archiver benchmark")
+    parser.add_argument('--files', '-f', type=int, default=5000)
+    parser.add_argument('--size', '-s', type=int, default=4096)
+    parser.add_argument('--repeat', '-r', type=int, default=3)
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    tmp_dir = tempfile.mkdtemp(prefix="bench-archiver-")
+    try:
+        tree = make_tree(os.path.join(tmp_dir, "tree"), args.files, args.size)
+        dest = os.path.join(tmp_dir, "out")
+        cases = [
+            ("tarfile.add (sequential)", lambda: sequential_tar(dest, tree)),
+            ("zipfile os.walk (sequential)",
+             lambda: sequential_zip(dest, tree))
+        ]
+        for workers in (1, 4, 8):
+            cases.append((f"Archiver._to_tar workers={workers}",
+                          lambda w=workers: Archiver._to_tar(dest, tree,
+                                                             workers=w)))
+            cases.append((f"Archiver._to_zip workers={workers}",
+                          lambda w=workers: Archiver._to_zip(dest, tree,
+                                                             workers=w)))
+
+        print(f"{args.files} files x {args.size} bytes")
+        for name, case in cases:
+            durations = measure(case, args.repeat)
+            print(f"{name:<40}{durations[0]:>10.4f} s (best)"
+                  f"{durations[len(durations) // 2]:>10.4f} s (median)")
+    finally:
+        shutil.rmtree(tmp_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
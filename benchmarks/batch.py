@@ -0,0 +1,64 @@
+"""
+    Scaling of batch generation (engine.generate_many) with number of
+    worker processes compared to sequential loop of generations.
+
+    Usage: python -m benchmarks.batch [--configs N] [--workers 1 2 4]
+"""
+
+import io
+import os
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Dict, List
+
+import benchmarks  # noqa: F401 (adds project root to path)
+from engine import BOARDS, MIPS, Board, generate_many
+from engine.batch import get_setup_params, warm_up
+
+
+def get_configs(count: int) -> List[Dict[str, str]]:
+    """ Configs of a class: all boards and mips versions in turn """
+    return [{'board': BOARDS[i % len(BOARDS)], 'name': f"student_{i}",
+             'mips': MIPS.VERSIONS[i % len(MIPS.VERSIONS)]}
+            for i in range(count)]
+
+
+def parse_argv() -> Namespace:
+    cpu_count = os.cpu_count() or 1
+    parser = ArgumentParser(description="Batch generation benchmark")
+    parser.add_argument('--configs', '-n', type=int, default=200)
+    parser.add_argument('--workers', '-w', type=int, nargs="+",
+                        default=sorted({1, 2, 4, cpu_count} - {0}))
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    configs = get_configs(args.configs)
+    print(f"{len(configs)} projects, {os.cpu_count()} CPUs")
+
+    warm_up()  # NOTE as pool does, so loading of configs isn't measured
+    start = time.perf_counter()
+    for config in configs:  # previous approach
+        Board(config['board']).setup(
+            **get_setup_params(config)
+        ).generate().as_archive.getvalue()
+    baseline = time.perf_counter() - start
+    print(f"{'loop':<14}{baseline:>8.2f} s{len(configs) / baseline:>10.1f}"
+          f" projects/s")
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        errors = sum(result.error is not None for result in generate_many(
+            configs, workers=workers, ordered=False, archive=io.BytesIO()
+        ))
+        duration = time.perf_counter() - start
+        print(f"{f'workers={workers}':<14}{duration:>8.2f} s"
+              f"{len(configs) / duration:>10.1f} projects/s"
+              f"{baseline / duration:>8.2f}x"
+              f"{f'   {errors} errors' if errors else ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
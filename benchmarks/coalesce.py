@@ -0,0 +1,114 @@
+"""
+    Load test of identical concurrent generations with and without
+    coalescing (single-flight in process and artifact store lock
+    between processes).
+
+    Usage: python -m benchmarks.coalesce [--clients N] [--board BOARD]
+"""
+
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, NoReturn, Tuple
+
+import benchmarks  # noqa: F401 (adds project root to path)
+from engine import (BOARDS, MIPS, ArtifactStore, Board, SingleFlight,
+                    get_fingerprint)
+
+
+def generate(board: str, mips: str) -> bytes:
+    return Board(board).setup(mips_type=mips).generate().as_archive.getvalue()
+
+
+def run_threads(args: Namespace, coalesce: bool) -> Tuple[float, float, int]:
+    """ :return wall time, process CPU time and number of generations """
+    flight = SingleFlight()
+    key = get_fingerprint(args.board, mips_type=args.mips)
+    counter = []
+
+    def request() -> bytes:
+        def work() -> bytes:
+            counter.append(1)
+            return generate(args.board, args.mips)
+        if coalesce:
+            return flight.do(key, work)[0]
+        return work()
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        for future in [executor.submit(request) for _ in range(args.clients)]:
+            future.result()
+    return (time.perf_counter() - start, time.process_time() - cpu_start,
+            len(counter))
+
+
+def store_request(root: str, board: str, mips: str, coalesce: bool) -> bool:
+    """ :return whether project was generated by this process """
+    store = ArtifactStore(root)
+    key = get_fingerprint(board, mips_type=mips)
+    if not coalesce:
+        store.put(generate(board, mips), key=key)
+        return True
+    with store.lock(key):
+        if store.get_by_key(key) is not None:
+            return False
+        store.put(generate(board, mips), key=key)
+        return True
+
+
+def run_processes(args: Namespace,
+                  coalesce: bool) -> Tuple[float, float, int]:
+    """ :return wall time, children CPU time and number of generations """
+    root = tempfile.mkdtemp(prefix="bench-store-")
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.processes) as executor:
+            generated = sum(executor.map(
+                store_request,
+                *zip(*((root, args.board, args.mips, coalesce)
+                       for _ in range(args.clients)))
+            ))
+    finally:
+        shutil.rmtree(root)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (time.perf_counter() - start,
+            usage.ru_utime + usage.ru_stime - cpu_start, generated)
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Coalescing load test")
+    parser.add_argument('--clients', '-c', type=int, default=32,
+                        help="number of identical concurrent requests")
+    parser.add_argument('--processes', '-p', type=int, default=4,
+                        help="number of worker processes")
+    parser.add_argument('--board', '-b', type=str, default=BOARDS[-1],
+                        choices=BOARDS)
+    parser.add_argument('--mips', '-m', type=str, default=MIPS.VERSIONS[-1],
+                        choices=MIPS.VERSIONS)
+    return parser.parse_args()
+
+
+def report(name: str, run: Callable, args: Namespace) -> NoReturn:
+    for coalesce in (False, True):
+        wall, cpu, generated = run(args, coalesce)
+        print(f"{name:<10}coalesce={coalesce!s:<6}"
+              f"{wall:>8.3f} s wall{cpu:>8.3f} s CPU"
+              f"{generated:>5} generations")
+
+
+def main(args: Namespace) -> int:
+    print(f"{args.clients} identical requests for "
+          f"{args.board} ({args.mips})")
+    report("threads", run_threads, args)
+    report("processes", run_processes, args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
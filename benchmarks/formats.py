@@ -0,0 +1,58 @@
+"""
+    Benchmark of POST /generate response formats: payload size and
+    serialization time of generated files.
+
+    Usage: python -m benchmarks.formats [--board BOARD] [--mips MIPS]
+"""
+
+import json
+import sys
+from argparse import ArgumentParser, Namespace
+
+from benchmarks import measure
+from engine import BOARDS, FUNCTIONS, MIPS, Board
+from engine.utils import serialize
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Response formats benchmark")
+    parser.add_argument('--board', '-b', type=str, default="de1soc",
+                        choices=BOARDS)
+    parser.add_argument('--mips', '-m', type=str, default=MIPS.VERSIONS[-1],
+                        choices=MIPS.VERSIONS)
+    parser.add_argument('--repeat', '-r', type=int, default=5)
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    board = Board(args.board).setup(
+        mips_type=args.mips,
+        func={name: True for name in FUNCTIONS.ITEMS}
+    ).generate()
+    files = board.configs
+    print(f"{len(files)} files of {args.board} ({args.mips})")
+
+    def jsonify() -> bytes:  # previous implementation
+        return json.dumps(files, sort_keys=True).encode()
+
+    cases = [("jsonify (before)", jsonify)]
+    for media_type in serialize.get_formats():
+        for encoding in [None] + serialize.get_encodings():
+            cases.append((
+                f"{media_type} {encoding or ''}",
+                lambda media_type=media_type, encoding=encoding: b"".join(
+                    serialize.compress(
+                        serialize.serialize(files, media_type), encoding
+                    )
+                )
+            ))
+
+    for name, func in cases:
+        durations = measure(func, args.repeat)
+        print(f"{name:<32}{len(func()):>10} bytes"
+              f"{durations[len(durations) // 2] * 1000:>10.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
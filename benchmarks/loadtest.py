@@ -0,0 +1,366 @@
+"""
+    Load test of API and web clients: replays traffic mix of profile
+    (popular and cold configurations, metadata routes, web form with
+    CSRF token) at concurrency levels of its stages and reports requests
+    per second and p50/p95/p99 latency by kinds of requests.
+
+    Apps are called in current process (--server inprocess), served by
+    local threaded WSGI server (--server wsgi) or by running server
+    (--api-url, --web-url, e.g. gunicorn workers).
+
+    Usage:
+        python -m benchmarks.loadtest [--profile lab-spike] [--scale 0.1]
+        python -m benchmarks.loadtest --concurrency 1 8 32 --duration 10
+"""
+
+import http.client
+import http.cookies
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from argparse import ArgumentParser, Namespace
+from collections import Counter, OrderedDict, namedtuple
+from typing import Any, Callable, Dict, List, NoReturn, Tuple
+
+import benchmarks  # noqa: F401 (adds project root to path)
+from benchmarks.preview import percentile
+from benchmarks.suite import get_meta
+from engine import BOARDS
+
+
+PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "profiles")
+HEADERS = {'X-Forwarded-Proto': "https"}  # NOTE to avoid SSLify redirect
+CSRF_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+METADATA_PATHS = ("/boards", "/mips", "/functions") + \
+    tuple(f"/board/{board}" for board in BOARDS)
+KINDS = ("api_popular", "api_cold", "api_metadata", "web_popular",
+         "web_cold")
+
+# duration in seconds, status is None if request failed
+Result = namedtuple("Result", ("kind", "status", "duration"))
+
+
+class InProcessSession(object):
+    """ Requests to Flask app in current process (keeps cookies) """
+
+    def __init__(self, app: Any) -> NoReturn:
+        self.client = app.test_client()
+
+    def request(self,
+                method: str,
+                path: str,
+                data: dict = None) -> Tuple[int, bytes]:
+        response = self.client.open(path, method=method, data=data,
+                                    base_url="https://localhost")
+        return response.status_code, response.get_data()
+
+
+class HttpSession(object):
+    """ Requests over keep-alive HTTP connection (keeps cookies) """
+
+    def __init__(self, url: str) -> NoReturn:
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.prefix = parsed.path.rstrip("/")
+        self.connection = None
+        self.cookies = http.cookies.SimpleCookie()
+
+    def request(self,
+                method: str,
+                path: str,
+                data: dict = None) -> Tuple[int, bytes]:
+        headers = dict(HEADERS)
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data, doseq=True)
+            headers['Content-Type'] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers['Cookie'] = "; ".join(f"{name}={morsel.value}"
+                                          for name, morsel
+                                          in self.cookies.items())
+        for attempt in range(2):  # NOTE server may close idle connection
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=60
+                )
+            try:
+                self.connection.request(method, self.prefix + path, body,
+                                        headers)
+                response = self.connection.getresponse()
+                content = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        for header in response.headers.get_all("Set-Cookie") or ():
+            self.cookies.load(header)
+        return response.status, content
+
+
+class Traffic(object):
+    """ Requests of one virtual user (reproducible by seed) """
+
+    def __init__(self,
+                 profile: Dict[str, Any],
+                 sessions: Dict[str, Any],
+                 seed: str) -> NoReturn:
+        self.random = random.Random(seed)
+        self.seed = seed
+        self.popular = [{key: value for key, value in config.items()
+                         if key != "weight"} for config in profile['popular']]
+        self.weights = [config.get("weight", 1)
+                        for config in profile['popular']]
+        self.sessions = sessions
+        self.results = []
+        self._cold = 0
+
+    def _config(self, cold: bool) -> Dict[str, Any]:
+        config = dict(self.random.choices(self.popular, self.weights)[0])
+        if cold:  # NOTE unique project name isn't cached anywhere
+            self._cold += 1
+            config['name'] = f"student_{self.seed}_{self._cold}".replace(
+                ":", "_"
+            )
+        return config
+
+    def _request(self,
+                 kind: str,
+                 app: str,
+                 method: str,
+                 path: str,
+                 data: dict = None) -> bytes or None:
+        start = time.perf_counter()
+        try:
+            status, content = self.sessions[app].request(method, path, data)
+        except (http.client.HTTPException, OSError) as e:
+            logging.warning("%s %s failed: %s", method, path, e)
+            status, content = None, None
+        self.results.append(Result(kind, status,
+                                   time.perf_counter() - start))
+        return content if status == 200 else None
+
+    def api_popular(self, cold: bool = False) -> NoReturn:
+        config = self._config(cold)
+        query = urllib.parse.urlencode({key: config[key] for key in
+                                        ("board", "name", "mips")
+                                        if config.get(key)})
+        self._request("api_cold" if cold else "api_popular", "api", "GET",
+                      f"/generate?{query}")
+
+    def api_cold(self) -> NoReturn:
+        self.api_popular(cold=True)
+
+    def api_metadata(self) -> NoReturn:
+        self._request("api_metadata", "api", "GET",
+                      self.random.choice(METADATA_PATHS))
+
+    def web_popular(self, cold: bool = False) -> NoReturn:
+        """ Opens page of board and submits form (with CSRF token) """
+        config = self._config(cold)
+        path = f"/?board={config['board']}"
+        page = self._request("web_page", "web", "GET", path)
+        token = page and CSRF_PATTERN.search(page.decode("utf-8"))
+        if token is None:
+            return
+        self._request("web_cold" if cold else "web_popular", "web", "POST",
+                      path, {
+                          'csrf_token': token.group(1),
+                          'name': config['name'],
+                          'mips': config.get("mips") or "",
+                          'conf': config.get("conf") or [],
+                          'func': config.get("func") or [],
+                          'submit': "Generate"
+                      })
+
+    def web_cold(self) -> NoReturn:
+        self.web_popular(cold=True)
+
+
+def run_stage(stage: Dict[str, Any],
+              mix: Dict[str, float],
+              make_traffic: Callable[[int], Traffic]) -> Tuple[list, float]:
+    """ :return results of requests and duration of stage (seconds) """
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    traffics = [make_traffic(worker) for worker in range(stage['concurrency'])]
+    barrier = threading.Barrier(len(traffics) + 1)
+    stop = None
+
+    def work(traffic: Traffic) -> NoReturn:
+        barrier.wait()  # NOTE all users start at once
+        while time.perf_counter() < stop:
+            getattr(traffic, traffic.random.choices(kinds, weights)[0])()
+
+    threads = [threading.Thread(target=work, args=(traffic,), daemon=True)
+               for traffic in traffics]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    stop = start + stage['duration']
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    return [result for traffic in traffics
+            for result in traffic.results], duration
+
+
+def summarize(results: List[Result], duration: float) -> Dict[str, Any]:
+    """ :return rps, latency percentiles (ms) and statuses by kinds """
+    by_kind = OrderedDict()
+    for result in sorted(results, key=lambda result: result.kind):
+        by_kind.setdefault(result.kind, []).append(result)
+    summary = OrderedDict()
+    for kind, kind_results in list(by_kind.items()) + [("total", results)]:
+        durations = sorted(result.duration for result in kind_results)
+        if not durations:
+            continue
+        summary[kind] = {
+            'requests': len(kind_results),
+            'rps': len(kind_results) / duration,
+            'p50': percentile(durations, 0.5) * 1000,
+            'p95': percentile(durations, 0.95) * 1000,
+            'p99': percentile(durations, 0.99) * 1000,
+            'statuses': dict(Counter(str(result.status)
+                                     for result in kind_results))
+        }
+    return summary
+
+
+def load_profile(name: str) -> Dict[str, Any]:
+    path = name if os.path.exists(name) else \
+        os.path.join(PROFILES_PATH, f"{name}.json")
+    with open(path) as fin:
+        profile = json.load(fin)
+    for kind in list(profile['mix']) + [kind for stage in profile['stages']
+                                        for kind in stage.get("mix", ())]:
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind of requests '{kind}'")
+    return profile
+
+
+def start_server(app: Any) -> str:
+    """ Serves app by local threaded WSGI server, :return its url """
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def get_session_factories(args: Namespace,
+                          apps: List[str]) -> Dict[str, Callable]:
+    """ :return functions, which create session, by app ('api', 'web') """
+    urls = {'api': args.api_url, 'web': args.web_url}
+    factories = {}
+    for app in apps:
+        if urls[app] is None:
+            if app == "api":
+                import api_client as client
+            else:
+                import web_client as client
+            logging.disable(logging.WARNING)  # NOTE rejections are in report
+            if args.server == "inprocess":
+                factories[app] = lambda app=client.app: InProcessSession(app)
+                continue
+            urls[app] = start_server(client.app)
+        factories[app] = lambda url=urls[app]: HttpSession(url)
+    return factories
+
+
+def print_report(report: Dict[str, Any]) -> NoReturn:
+    for stage in report['stages']:
+        print(f"{stage['name']}: {stage['concurrency']} users, "
+              f"{stage['duration']:.1f} s")
+        for kind, stats in stage['summary'].items():
+            errors = {status: count for status, count
+                      in stats['statuses'].items() if status != "200"}
+            print(f"    {kind:<14}{stats['requests']:>7} req"
+                  f"{stats['rps']:>9.1f} rps"
+                  f"{stats['p50']:>9.1f} ms p50{stats['p95']:>9.1f} ms p95"
+                  f"{stats['p99']:>9.1f} ms p99"
+                  f"{f'   {errors}' if errors else ''}")
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Load test of API and web clients")
+    parser.add_argument('--profile', '-p', type=str, default="lab-spike",
+                        help="name of profile in benchmarks/profiles or path")
+    parser.add_argument('--server', '-s', type=str, default="inprocess",
+                        choices=("inprocess", "wsgi"))
+    parser.add_argument('--api-url', type=str, default=None,
+                        help="url of running API client")
+    parser.add_argument('--web-url', type=str, default=None,
+                        help="url of running web client")
+    parser.add_argument('--concurrency', '-c', type=int, nargs="+",
+                        help="replace stages of profile with these levels")
+    parser.add_argument('--duration', '-d', type=float, default=10,
+                        help="duration of --concurrency stages (seconds)")
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help="multiplier of stages' durations")
+    parser.add_argument('--output', '-o', type=str,
+                        default="loadtest-report.json")
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    profile = load_profile(args.profile)
+    stages = profile['stages']
+    if args.concurrency:
+        stages = [{'name': f"c{concurrency}", 'concurrency': concurrency,
+                   'duration': args.duration}
+                  for concurrency in args.concurrency]
+    apps = sorted({kind.split("_")[0] for stage in stages
+                   for kind in stage.get("mix") or profile['mix']})
+
+    # NOTE local apps use empty artifact store, so runs are comparable
+    store_path = tempfile.mkdtemp(prefix="loadtest-store-")
+    os.environ['ARTIFACT_STORE_PATH'] = store_path
+    try:
+        factories = get_session_factories(args, apps)
+        report = {'meta': dict(get_meta(), profile=profile['name'],
+                               server=args.server, api_url=args.api_url,
+                               web_url=args.web_url),
+                  'stages': []}
+        for stage in stages:
+            def make_traffic(worker: int, stage: dict = stage) -> Traffic:
+                return Traffic(
+                    profile, {app: factory()
+                              for app, factory in factories.items()},
+                    seed=f"{profile.get('seed')}:{stage['name']}:{worker}"
+                )
+
+            results, duration = run_stage(
+                dict(stage, duration=stage['duration'] * args.scale),
+                stage.get("mix") or profile['mix'], make_traffic
+            )
+            report['stages'].append({
+                'name': stage['name'],
+                'concurrency': stage['concurrency'],
+                'duration': duration,
+                'summary': summarize(results, duration)
+            })
+    finally:
+        shutil.rmtree(store_path, ignore_errors=True)
+
+    print_report(report)
+    with open(args.output, "w") as fout:
+        json.dump(report, fout, indent=1)
+    print(f"Report saved to '{args.output}'")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
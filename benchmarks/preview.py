@@ -0,0 +1,77 @@
+"""
+    Latency of web client single-file preview (GET /preview) in warm
+    worker: rendering of uncached files and cached ones. Exits with
+    non-zero status if p99 exceeds budget.
+
+    Usage: python -m benchmarks.preview [--board BOARD] [--budget MS]
+"""
+
+import logging
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Callable, List
+
+import benchmarks  # noqa: F401 (adds project root to path)
+from engine import BOARDS, MIPS
+
+
+def percentile(durations: List[float], value: float) -> float:
+    """ :param durations: sorted durations """
+    return durations[min(len(durations) - 1, int(len(durations) * value))]
+
+
+def run(request: Callable[[int], int], count: int) -> List[float]:
+    """ :return sorted durations (seconds) of requests """
+    durations = []
+    for i in range(count):
+        start = time.perf_counter()
+        status = request(i)
+        durations.append(time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f"Unexpected response status {status}")
+    return sorted(durations)
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Preview latency benchmark")
+    parser.add_argument('--board', '-b', type=str, default="de1soc",
+                        choices=BOARDS)
+    parser.add_argument('--mips', '-m', type=str, default=MIPS.VERSIONS[-1],
+                        choices=MIPS.VERSIONS)
+    parser.add_argument('--requests', '-n', type=int, default=500)
+    parser.add_argument('--budget', type=float, default=20,
+                        help="max p99 latency (ms)")
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    import web_client  # NOTE app configures logging on import
+    logging.disable(logging.INFO)
+
+    client = web_client.app.test_client()
+    files = ("qsf", "v", "sdc", "qpf")
+
+    def request(i: int, name: str = None) -> int:
+        return client.get(
+            "/preview", base_url="https://localhost", query_string={
+                'board': args.board, 'mips': args.mips,
+                'name': name or f"preview_{i}", 'file': files[i % len(files)]
+            }
+        ).status_code
+
+    run(request, 20)  # warm up worker
+    failed = False
+    for case, func in (("render", request),
+                       ("cached", lambda i: request(i, "preview"))):
+        durations = run(func, args.requests)
+        p50, p99 = (percentile(durations, value) * 1000
+                    for value in (0.5, 0.99))
+        failed |= p99 >= args.budget
+        print(f"{case:<10}p50 {p50:>8.2f} ms   p99 {p99:>8.2f} ms"
+              f"{'   OVER BUDGET' if p99 >= args.budget else ''}")
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
@@ -0,0 +1,240 @@
+"""
+    Benchmark suite of engine hot paths: loading of boards' configs,
+    Render.* methods, templates of functions, tar archiving and full
+    setup/generate/dump/archive flow for every board and SchoolMIPS
+    version. Results are saved as json, compare exits with non-zero
+    status if some case is slower than baseline above threshold.
+
+    Usage:
+        python -m benchmarks.suite run [-o results.json] [-k PATTERN]
+        python -m benchmarks.suite compare baseline.json results.json
+            [--threshold 0.1]
+"""
+
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict
+
+import benchmarks  # noqa: F401 (adds project root to path)
+from engine import BOARDS, FUNCTIONS, MIPS, Board, __version__
+from engine.utils.prepare import Archiver, Loader
+
+
+DATE = datetime(2000, 1, 1)  # NOTE date formatting doesn't vary between runs
+RENDERED = ("v", "qpf", "qsf", "sdc")  # Render.* methods by file extension
+
+
+def get_board(board: str, mips_type: str = None) -> Board:
+    return Board(board).setup(
+        project_name="bench",
+        mips_type=mips_type,
+        func={name: True for name in FUNCTIONS.ITEMS}
+    )
+
+
+def get_cases(tmp_dir: str) -> Dict[str, Callable[[], Any]]:
+    """ :return benchmarked functions by names of cases """
+    cases = OrderedDict()
+    for board in BOARDS:
+        cases[f"load/{board}"] = \
+            lambda path=Loader.get_static_path(board): Loader.load(path)
+
+    for board in BOARDS:
+        renderers = get_board(board)._renderers(DATE)
+        for ext in RENDERED:
+            cases[f"render/{ext}/{board}"] = renderers[f"bench.{ext}"]
+    board = get_board(BOARDS[0])
+    renderers = board._renderers(DATE)
+    for name in FUNCTIONS.ITEMS:
+        cases[f"render/functions/{name}"] = \
+            renderers[f"{board.func_path(name)}.v"]
+
+    for board in BOARDS:
+        configs = get_board(board, MIPS.VERSIONS[-1]).generate(
+            date_t=DATE
+        ).configs
+        cases[f"get_tar_io/{board}"] = \
+            lambda configs=configs: Archiver.get_tar_io(configs)
+
+    for board in BOARDS:
+        for mips_type in (None,) + MIPS.VERSIONS:
+            key = f"{board}/{mips_type or 'no-mips'}"
+            cases[f"generate/{key}"] = \
+                lambda b=board, m=mips_type: get_board(b, m).generate(
+                    date_t=DATE
+                )
+            generated = get_board(board, mips_type).generate(date_t=DATE)
+            path = os.path.join(tmp_dir, key.replace("/", "-"))
+            cases[f"dump/{key}"] = \
+                lambda g=generated, p=path: g.dump(p)
+            cases[f"archive/{key}"] = \
+                lambda g=generated, p=path: g.archive(p)
+    return cases
+
+
+def calibrate(func: Callable, min_time: float) -> int:
+    """ :return number of calls, which take at least min_time seconds """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return number
+        number *= 2
+
+
+def run_case(func: Callable, repeat: int, min_time: float) -> Dict[str, Any]:
+    """ :return statistics of durations (seconds) of single call """
+    func()  # NOTE warm up: templates are compiled, configs are cached
+    number = calibrate(func, min_time)
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        durations.append((time.perf_counter() - start) / number)
+    return {
+        'min': min(durations),
+        'median': statistics.median(durations),
+        'mean': statistics.mean(durations),
+        'number': number,
+        'repeat': repeat
+    }
+
+
+def get_meta() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'date': datetime.now().isoformat(timespec="seconds"),
+        'version': __version__,
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def run(args: Namespace) -> int:
+    tmp_dir = tempfile.mkdtemp(prefix="bench-suite-")
+    try:
+        cases = get_cases(tmp_dir)
+        if args.filter:
+            cases = OrderedDict(
+                (name, func) for name, func in cases.items()
+                if any(fnmatch.fnmatch(name, pattern)
+                       for pattern in args.filter)
+            )
+        results = OrderedDict()
+        for name, func in cases.items():
+            results[name] = run_case(func, args.repeat, args.min_time)
+            print(f"{name:<40}{results[name]['min'] * 1e6:>12.1f} us (min)"
+                  f"{results[name]['median'] * 1e6:>12.1f} us (median)")
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    with open(args.output, "w") as fout:
+        json.dump({'meta': get_meta(), 'results': results}, fout, indent=1)
+    print(f"{len(results)} cases saved to '{args.output}'")
+    return 0
+
+
+def compare_results(baseline: Dict[str, Any],
+                    current: Dict[str, Any],
+                    metric: str = "min") -> Dict[str, Any]:
+    """
+        :return relative changes of durations by cases (None for cases
+            missing in one of results)
+    """
+    changes = OrderedDict()
+    for name in list(baseline) + [name for name in current
+                                  if name not in baseline]:
+        if name not in baseline or name not in current:
+            changes[name] = None
+            continue
+        changes[name] = current[name][metric] / baseline[name][metric] - 1
+    return changes
+
+
+def compare(args: Namespace) -> int:
+    with open(args.baseline) as fin:
+        baseline = json.load(fin)
+    with open(args.current) as fin:
+        current = json.load(fin)
+    for key in ("commit", "python", "platform"):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"{key}: {baseline['meta'].get(key)} -> "
+                  f"{current['meta'].get(key)}")
+
+    regressions = 0
+    changes = compare_results(baseline['results'], current['results'],
+                              args.metric)
+    for name, change in changes.items():
+        if change is None:
+            status = "new" if name not in baseline['results'] else "missing"
+            print(f"{name:<40}{status:>24}")
+            continue
+        status = ""
+        if change > args.threshold:
+            status = "REGRESSION"
+            regressions += 1
+        elif change < -args.threshold:
+            status = "improved"
+        print(f"{name:<40}"
+              f"{baseline['results'][name][args.metric] * 1e6:>12.1f} us"
+              f"{current['results'][name][args.metric] * 1e6:>12.1f} us"
+              f"{change * 100:>+9.1f}%  {status}")
+    print(f"{regressions} regressions above {args.threshold * 100:.0f}%")
+    return int(regressions > 0)
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Benchmark suite of engine")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run benchmarks")
+    run_parser.add_argument('--output', '-o', type=str,
+                            default="benchmark-results.json")
+    run_parser.add_argument('--filter', '-k', type=str, nargs="+",
+                            help="patterns of cases, e.g. 'render/*'")
+    run_parser.add_argument('--repeat', '-r', type=int, default=5)
+    run_parser.add_argument('--min-time', type=float, default=0.02,
+                            help="min duration of sample (seconds)")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare results with baseline"
+    )
+    compare_parser.add_argument('baseline', type=str)
+    compare_parser.add_argument('current', type=str)
+    compare_parser.add_argument('--threshold', '-t', type=float, default=0.1,
+                                help="max relative slowdown")
+    compare_parser.add_argument('--metric', '-m', type=str, default="min",
+                                choices=("min", "median", "mean"))
+    compare_parser.set_defaults(func=compare)
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
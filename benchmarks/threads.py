@@ -0,0 +1,78 @@
+"""
+    Throughput of generation in pool of threads (one process, shared
+    caches) compared to pool of processes (engine.batch.run_pool).
+
+    Threads scale only on free-threaded Python (python3.13t and later),
+    with GIL they show overhead of switching.
+
+    Usage: python -m benchmarks.threads [--configs N] [--workers 1 2 4]
+"""
+
+import os
+import resource
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+import benchmarks  # noqa: F401 (adds project root to path)
+from benchmarks.batch import get_configs
+from engine.batch import generate, run_pool, warm_up
+
+
+def get_max_rss(who: int) -> float:
+    """ :return peak resident memory (MB) of process or its children """
+    return resource.getrusage(who).ru_maxrss / 1024  # NOTE KB on Linux
+
+
+def run_threads(configs: list, workers: int) -> int:
+    """ :return number of errors """
+    with ThreadPoolExecutor(workers) as executor:
+        return sum(result.error is not None for result in executor.map(
+            generate, range(len(configs)), configs
+        ))
+
+
+def run_processes(configs: list, workers: int) -> int:
+    """ :return number of errors """
+    return sum(result.error is not None
+               for result in run_pool(generate, configs, workers,
+                                      ordered=False))
+
+
+def parse_argv() -> Namespace:
+    cpu_count = os.cpu_count() or 1
+    parser = ArgumentParser(description="Threads vs processes benchmark")
+    parser.add_argument('--configs', '-n', type=int, default=200)
+    parser.add_argument('--workers', '-w', type=int, nargs="+",
+                        default=sorted({1, 2, 4, cpu_count} - {0}))
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    configs = get_configs(args.configs)
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"{len(configs)} projects, {os.cpu_count()} CPUs, "
+          f"GIL {'enabled' if is_gil_enabled else 'disabled'}")
+    warm_up()
+
+    # NOTE threads are measured first, peak memory of children is
+    # available only after process pools are finished
+    for name, run in (("threads", run_threads),
+                      ("processes", run_processes)):
+        for workers in args.workers:
+            start = time.perf_counter()
+            errors = run(configs, workers)
+            duration = time.perf_counter() - start
+            print(f"{f'{name}={workers}':<14}{duration:>8.2f} s"
+                  f"{len(configs) / duration:>10.1f} projects/s"
+                  f"{f'   {errors} errors' if errors else ''}")
+
+    print(f"peak memory: {get_max_rss(resource.RUSAGE_SELF):.1f} MB "
+          f"(main process), {get_max_rss(resource.RUSAGE_CHILDREN):.1f} MB "
+          f"(largest worker process)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_argv()))
@@ -1,11 +1,15 @@
 import json
 import logging
 import os
+import signal
+import sys
 from argparse import ArgumentParser, Namespace
 from enum import Enum
-from typing import Any, Dict, Iterable, NoReturn
+from typing import Any, Dict, Iterable, Iterator, NoReturn, TextIO, Tuple
 
-from engine import BOARDS, MIPS, Board
+import engine  # NOTE loaded lazily, isn't needed if daemon is running
+from engine.constants import BOARDS, MIPS, PATHS
+from engine.daemon import Daemon, request
 from engine.exceptions import InvalidProjectName
 
 
@@ -15,7 +19,7 @@ logging.basicConfig(level=logging.INFO,
 
 def parse_argv() -> Namespace:
     parser = ArgumentParser(description="")
-    parser.add_argument('board', type=str, choices=BOARDS,
+    parser.add_argument('board', type=str, choices=BOARDS, nargs="?",
                         metavar="BOARD NAME",
                         help=f"target board type, one of the following: "
                              f"{', '.join(BOARDS)}")
@@ -33,12 +37,34 @@ def parse_argv() -> Namespace:
                              f"{', '.join(MIPS.VERSIONS)}")
     parser.add_argument('--config', '-c', type=str, default=None,
                         help="path to json file with board config")
-    return parser.parse_args()
+    parser.add_argument('--batch', '-b', type=str, default=None,
+                        metavar="JSONL",
+                        help="path to file with board configs (json object "
+                             "per line) or '-' for stdin, projects are "
+                             "saved to PATH folder or to one archive")
+    parser.add_argument('--workers', '-w', type=int, default=None,
+                        help="number of processes for batch mode")
+    parser.add_argument('--status', type=str, default=None, metavar="FILE",
+                        help="file for json status of every line in batch "
+                             "mode (stderr by default, logs are disabled "
+                             "then)")
+    parser.add_argument('--daemon', '-d', action="store_true",
+                        help="run resident generator, which serves "
+                             "requests of other runs over SOCKET")
+    parser.add_argument('--socket', '-s', type=str, default=PATHS.SOCKET,
+                        help="unix socket of daemon")
+    parser.add_argument('--local', '-l', action="store_true",
+                        help="generate in process even if daemon is running")
+    args = parser.parse_args()
+    if args.board is None and args.batch is None and not args.daemon:
+        parser.error("BOARD NAME, --batch or --daemon is required")
+    return args
 
 
 class ReturnCode(Enum):
     OK = 0
     CONFIG_ERROR = 3
+    GENERATION_ERROR = 4
     INVALID_PROJECT_NAME = 5
     UNKNOWN_ERROR = 255
 
@@ -65,10 +91,24 @@ class Config(object):
             return
 
         with open(config) as fin:
-            data = json.load(fin)
-            self.configs = self._to_dict(data.get("conf", []))
-            self.functions = self._to_dict(data.get("func", []))
-            self.functions_params = data.get("params", {})
+            self.update(json.load(fin))
+
+    def update(self, data: dict) -> object:
+        """ Sets 'conf', 'func' and 'params' from config data """
+        self.configs = self._to_dict(data.get("conf", []))
+        self.functions = self._to_dict(data.get("func", []))
+        self.functions_params = data.get("params", {})
+        return self
+
+    def to_data(self) -> dict:
+        """ :return config data (as in config file) with name and mips """
+        return {
+            'name': self.project_name,
+            'mips': self.mips_type,
+            'conf': list(self.configs or ()),
+            'func': list(self.functions or ()),
+            'params': self.functions_params or {}
+        }
 
     @property
     def ok(self) -> bool:
@@ -83,8 +123,10 @@ class Config(object):
 def generate_board_and_save(board_name: str,
                             config: Config,
                             path_to_save: str = None,
-                            archive: bool = False) -> NoReturn:
-    board = Board(board_name).setup(
+                            archive: bool = False,
+                            cwd: str = None) -> NoReturn:
+    """ :param cwd: folder for relative path (current one if None) """
+    board = engine.Board(board_name).setup(
         project_name=config.project_name,
         mips_type=config.mips_type,
         flt=config.configs,
@@ -92,29 +134,217 @@ def generate_board_and_save(board_name: str,
         func=config.functions
     ).generate()
 
+    if cwd is not None:
+        path_to_save = os.path.join(cwd, path_to_save or board.project_name)
     if archive:
         _ = board.archive(path=path_to_save)
     else:
         _ = board.dump(path=path_to_save)
 
 
+def run_generation(board_name: str,
+                   config: Config,
+                   path_to_save: str = None,
+                   archive: bool = False,
+                   cwd: str = None) -> Tuple[ReturnCode, str or None]:
+    """ :return result code and error message """
+    try:
+        generate_board_and_save(board_name, config, path_to_save, archive,
+                                cwd)
+    except InvalidProjectName as e:
+        return ReturnCode.INVALID_PROJECT_NAME, str(e)
+    except BaseException as e:
+        return ReturnCode.UNKNOWN_ERROR, str(e) or type(e).__name__
+    return ReturnCode.OK, None
+
+
+def handle_request(data: dict) -> dict:
+    """ Generates project requested by other run (daemon handler) """
+    try:
+        config = Config(None, data.get("name"), data.get("mips")).update(data)
+        logging.info("Generate %s project '%s'",
+                     data.get("board"), config.project_name)
+        code, error = run_generation(data.get("board"), config,
+                                     data.get("path"), data.get("archive"),
+                                     data['cwd'])
+    except Exception as e:  # NOTE e.g. malformed request
+        code, error = ReturnCode.UNKNOWN_ERROR, \
+            f"Invalid request: {str(e) or type(e).__name__}"
+    if error is not None:
+        logging.error("%s", error)
+    return {'code': code.name, 'error': error}
+
+
+def forward_request(args: Namespace, config: Config) -> ReturnCode or None:
+    """
+        Sends generation request to daemon.
+
+        :return result code or None if daemon isn't running
+    """
+    try:
+        response = request(dict(config.to_data(),
+                                board=args.board,
+                                path=args.path,
+                                archive=args.archive,
+                                cwd=os.getcwd()), args.socket)
+    except OSError as e:
+        logging.warning("Daemon is unavailable: %s", e)
+        return None
+    if response is None:
+        return None
+    if response.get("error"):
+        logging.error("%s", response['error'])
+    return ReturnCode[response.get("code", ReturnCode.UNKNOWN_ERROR.name)]
+
+
+def run_daemon(args: Namespace) -> ReturnCode:
+    """ Serves requests of other runs until interrupted """
+    from engine.batch import warm_up  # NOTE heavy, so imported here
+    warm_up()
+    # NOTE socket is removed on exit
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with Daemon(handle_request, args.socket) as daemon:
+        logging.info("Daemon %d is listening on '%s'",
+                     os.getpid(), args.socket)
+        try:
+            daemon.serve_forever()
+        except (KeyboardInterrupt, SystemExit):
+            logging.info("Daemon is stopped")
+    return ReturnCode.OK
+
+
+BATCH_CONFIG_SHEMA = {
+    'board': str,
+    'name': str,
+    'mips': str,
+    'conf': list,
+    'func': list,
+    'params': dict
+}
+
+
+def validate_batch_config(data: Any) -> str or None:
+    if not isinstance(data, dict):
+        return f"Invalid config type '{type(data).__name__}'"
+    if data.get("board") not in BOARDS:
+        return f"Unsupported board '{data.get('board')}'"
+    for key, val in data.items():
+        if key not in BATCH_CONFIG_SHEMA:
+            return f"Invalid key '{key}'"
+        if not isinstance(val, BATCH_CONFIG_SHEMA[key]):
+            return f"Invalid value type '{type(val).__name__}' " \
+                   f"for key '{key}'"
+    if data.get("mips") and data['mips'] not in MIPS.VERSIONS:
+        return f"Unsupported mips type '{data['mips']}'"
+
+
+def read_batch(fin: TextIO, lines: list) -> Iterator[Any]:
+    """
+        Yields configs from json lines (lazily, input may be stream).
+
+        Numbers of lines of configs are appended to 'lines', failed
+        results are yielded instead of invalid configs (so they aren't
+        generated).
+    """
+    for number, line in enumerate(fin, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+            error = validate_batch_config(data)
+        except ValueError as e:
+            data, error = None, f"Invalid json: {e}"
+        lines.append(number)
+        if error is None:
+            yield data
+            continue
+        config = data if isinstance(data, dict) else {}
+        name = config.get("name")
+        yield engine.BatchResult(len(lines) - 1, config,
+                                 name if isinstance(name, str) else None,
+                                 None, None, error)
+
+
+def write_status(fout: TextIO, **status) -> NoReturn:
+    fout.write(json.dumps(status) + "\n")
+    fout.flush()
+
+
+def run_batch(args: Namespace) -> ReturnCode:
+    """
+        Generates projects for every line, writes their status to
+        args.status file or to stderr (logs are disabled then, so it
+        contains only json lines)
+    """
+    lines = []
+    output = args.path or ("projects.tar" if args.archive else ".")
+    fin = sys.stdin if args.batch == "-" else open(args.batch)
+    params = {'path': output}
+    if args.archive:
+        params = {'archive': sys.stdout.buffer if output == "-" else output}
+    if args.status is None:
+        status_out = sys.stderr
+        # NOTE before workers are forked, so they inherit it
+        logging.disable(logging.CRITICAL)
+    else:
+        status_out = open(args.status, "w")
+
+    failed = 0
+    try:
+        results = engine.generate_many(read_batch(fin, lines),
+                                       workers=args.workers, ordered=False,
+                                       **params)
+        for result in results:
+            failed += result.error is not None
+            write_status(status_out,
+                         line=lines[result.index],
+                         board=result.config.get("board"),
+                         name=result.project_name,
+                         status="failed" if result.error else "done",
+                         **({'error': result.error} if result.error else
+                            {'digest': result.digest}))
+        logging.info("%d of %d projects are generated",
+                     len(lines) - failed, len(lines))
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if status_out is not sys.stderr:
+            status_out.close()
+        logging.disable(logging.NOTSET)
+    return ReturnCode.GENERATION_ERROR if failed else ReturnCode.OK
+
+
 def main(args: Namespace) -> ReturnCode:
+    if args.daemon:
+        try:
+            return run_daemon(args)
+        except (OSError, RuntimeError) as e:
+            logging.error("%s", e)
+            return ReturnCode.UNKNOWN_ERROR
+
+    if args.batch is not None:
+        try:
+            return run_batch(args)
+        except OSError as e:
+            logging.error("%s", e)
+            return ReturnCode.CONFIG_ERROR
+
     config = Config(args.config, args.name, args.mips)
     if not config.ok:
         for error in config.errors:
             logging.error(error)
         return ReturnCode.CONFIG_ERROR
 
-    try:
-        generate_board_and_save(args.board, config, args.path, args.archive)
-    except InvalidProjectName as e:
-        logging.error("%s", e)
-        return ReturnCode.INVALID_PROJECT_NAME
-    except BaseException as e:
-        logging.error("%s", e)
-        return ReturnCode.UNKNOWN_ERROR
+    if not args.local:
+        result = forward_request(args, config)
+        if result is not None:
+            return result
 
-    return ReturnCode.OK
+    result, error = run_generation(args.board, config, args.path,
+                                   args.archive)
+    if error is not None:
+        logging.error("%s", error)
+    return result
 
 
 if __name__ == "__main__":
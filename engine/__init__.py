@@ -1,8 +1,43 @@
 """ Rendering engine. """
 
-# to simplify imports from top level module
-from engine.boards import BOARDS, Board, GenericBoard
-from engine.constants import FUNCTIONS, MIPS
+import importlib
+from typing import Any, List
+
 
+# to simplify imports from top level module
+# NOTE modules are imported on first access, so light clients (e.g. CLI
+# forwarding requests to daemon) don't load templates and yaml parser
+_EXPORTS = {
+    'BOARDS': "engine.boards",
+    'Board': "engine.boards",
+    'GenericBoard': "engine.boards",
+    'load_or_generate': "engine.artifacts",
+    'BatchResult': "engine.batch",
+    'generate_many': "engine.batch",
+    'FUNCTIONS': "engine.constants",
+    'MIPS': "engine.constants",
+    'MANIFESTS': "engine.delta",
+    'generate_delta': "engine.delta",
+    'Admission': "engine.utils.admission",
+    'ArchiveCache': "engine.utils.cache",
+    'get_fingerprint': "engine.utils.cache",
+    'SingleFlight': "engine.utils.coalesce",
+    'JobQueue': "engine.utils.jobs",
+    'ArtifactStore': "engine.utils.store"
+}
 
+__all__ = list(_EXPORTS)
 __author__ = ("Dmitriy Pchelkin", "Alexey Ivanov")
+__version__ = "1.1.0"
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'engine' has no attribute '{name}'")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()).union(_EXPORTS))
@@ -0,0 +1,56 @@
+""" Archives of configured projects shared through artifact store. """
+
+from typing import Any, Callable, Tuple
+
+from engine.boards import Board
+from engine.delta import MANIFESTS
+from engine.utils.store import ArtifactStore
+
+
+def load_or_generate(store: ArtifactStore,
+                     fingerprint: str,
+                     board: str,
+                     params: dict,
+                     progress: Callable[[str], Any] = None
+                     ) -> Tuple[dict, str]:
+    """
+        Loads archive of configured project from artifact store or
+        generates it and saves there. Digests of project files are
+        registered in MANIFESTS in both cases, so delta archives can be
+        built against the project in any process.
+
+        Holds inter-process lock, so the same project isn't generated
+        by several workers at once.
+
+        :param fingerprint: key of project in store (see get_fingerprint)
+        :param params: parameters of Board.setup
+        :param progress: called with 'load', 'render' and 'archive'
+            stages of generation
+        :return archive ('filename', project 'digest', 'files' digests,
+            'content' and 'artifact' digest) and where it was found:
+            'STORE' or 'MISS' (generated)
+    """
+    with store.lock(fingerprint):
+        found = store.get_by_key(fingerprint)
+        if found is not None:
+            artifact, content, meta = found
+            if meta.get("files"):
+                MANIFESTS.add(meta['files'])
+            return dict(meta, content=content, artifact=artifact), "STORE"
+
+        progress = progress or (lambda stage: None)
+        progress("load")
+        project = Board(board).setup(**params)
+        progress("render")
+        project.generate()
+        progress("archive")
+        meta = {
+            'filename': f"{project.project_name}.tar",
+            'digest': project.digest,
+            'files': project.digests
+        }
+        content = project.as_archive.getvalue()
+        artifact = store.put(content, key=fingerprint, meta=meta)
+
+    MANIFESTS.add(project.digests)
+    return dict(meta, content=content, artifact=artifact), "MISS"
@@ -0,0 +1,213 @@
+""" Batch generation of many projects in pool of warm processes. """
+
+import io
+import logging
+import os
+import tarfile
+from collections import deque, namedtuple
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from functools import partial
+from typing import (Any, BinaryIO, Callable, Dict, Iterable, Iterator,
+                    NoReturn)
+
+from engine.boards import Board
+from engine.constants import BOARDS, DEFAULT_PROJECT_NAME, FUNCTIONS, MIPS
+
+
+# result of generation of single config:
+#   index - number of config in input, config - config itself,
+#   project_name, digest - project digest, files - generated files
+#   (None if they are saved), error - error message (None if succeeded)
+BatchResult = namedtuple("BatchResult", ("index", "config", "project_name",
+                                         "digest", "files", "error"))
+
+
+def get_setup_params(config: Dict[str, Any]) -> dict:
+    """
+        Converts config in format of API clients (keys 'board', 'name',
+        'mips', 'conf', 'func' and 'params') to GenericBoard.setup params
+    """
+    return {
+        'project_name': config.get("name"),
+        'mips_type': config.get("mips"),
+        'flt': {key: True for key in config.get("conf") or ()},
+        'conf': config.get("params") or {},
+        'func': {key: True for key in config.get("func") or ()}
+    }
+
+
+def warm_up() -> NoReturn:
+    """
+        Loads (and caches) configs of all boards and templates, so
+        forked processes don't repeat this work.
+    """
+    for board in BOARDS:
+        Board(board).setup(mips_type=MIPS.VERSIONS[-1],
+                           func={name: True for name in FUNCTIONS.ITEMS}
+                           ).generate()
+
+
+def generate(index: int,
+             config: Dict[str, Any],
+             path: str = None) -> BatchResult:
+    """
+        Generates project (dumps it to path/<project name> if path is
+        set), errors are returned in result.
+    """
+    try:
+        board = Board(config['board']).setup(**get_setup_params(config))
+        board.generate()
+        if path is not None:
+            board.dump(os.path.join(path, board.project_name))
+        return BatchResult(index, config, board.project_name, board.digest,
+                           None if path is not None else board.configs, None)
+    except BaseException as e:
+        logging.error("Config #%d isn't generated: %s", index, e)
+        return BatchResult(index, config, config.get("name"), None, None,
+                           str(e) or type(e).__name__)
+
+
+class _InProcess(object):
+    """ Executor-like runner for single worker (without pool) """
+
+    def submit(self, func: Any, *args) -> Future:
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, *args) -> NoReturn:
+        pass
+
+
+def run_pool(func: Callable[[int, Any], Any],
+             configs: Iterable[Any],
+             workers: int = None,
+             ordered: bool = True,
+             reject: Callable[[int, Any], Any] = None) -> Iterator[Any]:
+    """
+        Calls func(index, config) for every config in pool of processes
+        warmed up with boards' configs and templates.
+
+        :param func: picklable function (e.g. defined in module)
+        :param workers: number of processes (number of CPUs if None),
+            func is called in current process if it's 1
+        :param ordered: yield results in order of configs or as soon
+            as they are ready
+        :param reject: called with index and config in current process
+            before config is submitted, its result (if it isn't None)
+            is yielded instead of result of func
+    """
+    workers = workers or os.cpu_count() or 1
+    warm_up()  # NOTE before fork, so caches are shared by workers
+    if workers > 1:
+        executor = ProcessPoolExecutor(workers, initializer=warm_up)
+    else:
+        executor = _InProcess()
+
+    with executor:
+        pending = deque()
+        # NOTE configs are read lazily (it may be stream)
+        for index, config in enumerate(configs):
+            rejected = reject and reject(index, config)
+            if rejected is not None:
+                future = Future()
+                future.set_result(rejected)
+            else:
+                future = executor.submit(func, index, config)
+            pending.append(future)
+            while len(pending) >= 2 * workers:
+                yield from _collect(pending, ordered)
+        while pending:
+            yield from _collect(pending, ordered)
+
+
+def _collect(pending: deque, ordered: bool) -> Iterator[BatchResult]:
+    """ Yields at least one result (the first one if ordered) """
+    if ordered:
+        yield pending.popleft().result()
+        while pending and pending[0].done():
+            yield pending.popleft().result()
+        return
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        pending.remove(future)
+        yield future.result()
+
+
+def _add_to_tar(tar_fout: tarfile.TarFile, result: BatchResult) -> NoReturn:
+    for filename, content in result.files.items():
+        content = content.encode("utf-8")
+        tarinfo = tarfile.TarInfo(f"{result.project_name}/{filename}")
+        tarinfo.size = len(content)
+        tar_fout.addfile(tarinfo, fileobj=io.BytesIO(content))
+
+
+def _get_reject(unique_names: bool
+                ) -> Callable[[int, Any], BatchResult or None]:
+    """
+        :return reject function, which passes failed results through
+            and rejects configs with used project names (if unique_names)
+    """
+    names = set()
+
+    def reject(index: int, config: Any) -> BatchResult or None:
+        if isinstance(config, BatchResult):  # NOTE failed before batch
+            return config._replace(index=index)
+        if not unique_names:
+            return None
+        name = config.get("name") or DEFAULT_PROJECT_NAME
+        if name not in names:
+            names.add(name)
+            return None
+        logging.error("Config #%d isn't generated: duplicate project name "
+                      "'%s'", index, name)
+        return BatchResult(index, config, name, None, None,
+                           f"Duplicate project name '{name}'")
+
+    return reject
+
+
+def generate_many(configs: Iterable[Dict[str, Any]],
+                  workers: int = None,
+                  ordered: bool = True,
+                  path: str = None,
+                  archive: str or BinaryIO = None) -> Iterator[BatchResult]:
+    """
+        Generates projects in pool of processes.
+
+        :param configs: configs in format of API clients, e.g.
+            {'board': "de1soc", 'name': "lab1", 'mips': "simple"}, or
+            failed results (e.g. of invalid input), which are yielded
+            as they are (with index of their position)
+        :param workers: number of processes (number of CPUs if None)
+        :param ordered: yield results in order of configs or as soon
+            as they are generated
+        :param path: save projects to path/<project name> folders
+        :param archive: save projects to one tar file (path or stream)
+            as '<project name>/...' members
+        :return iterator of results, configs with project name of
+            previous one are failed if projects are saved
+    """
+    if path is not None and archive is None:
+        os.makedirs(path, exist_ok=True)
+    saved = path is not None or archive is not None
+    results = run_pool(partial(generate, path=path if archive is None
+                               else None), configs, workers, ordered,
+                       reject=_get_reject(unique_names=saved))
+    if archive is None:
+        yield from results
+        return
+
+    if isinstance(archive, str):
+        tar_fout = tarfile.open(archive, mode="w")
+    else:
+        tar_fout = tarfile.open(fileobj=archive, mode="w|")
+    with tar_fout:
+        for result in results:
+            if result.error is None:
+                _add_to_tar(tar_fout, result)
+            yield result._replace(files=None)
@@ -1,15 +1,20 @@
 import io
 import logging
 import os
-from collections import namedtuple
-from functools import reduce
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from functools import partial, reduce
 from typing import Any, NoReturn, Tuple
 
 from engine.constants import (BOARDS, DEFAULT_PROJECT_NAME, DESTINATIONS,
                               FUNCTIONS, MIPS, PATHS)
 from engine.exceptions import InvalidProjectName
-from engine.utils.prepare import (Archiver, Loader, create_dirs,
-                                  validate_project_name)
+from engine.utils import trace
+from engine.utils.prepare import (Archiver, Loader, cache_static,
+                                  create_dirs, get_digest,
+                                  get_project_digest, is_file_actual,
+                                  link_file, load_manifest, save_manifest,
+                                  stat_record, validate_project_name)
 from engine.utils.render import Render
 
 
@@ -29,7 +34,9 @@ class GenericBoard(object):
         "_project_name",
         "_mips_v",
         "mips_configs",
-        "_functions"
+        "_functions",
+        "_statics",
+        "digests"
     )
 
     def __init__(self, config_path: str) -> NoReturn:
@@ -73,6 +80,11 @@ class GenericBoard(object):
         """ Configurable params """
         return self._qsf['user_assignments']
 
+    @property
+    def digest(self) -> str:
+        """ Digest of generated project (depends on files' digests only) """
+        return get_project_digest(self.digests)
+
     @property
     def as_archive(self) -> io.BytesIO:
         """ Returns generated configs as archive. """
@@ -87,26 +99,27 @@ class GenericBoard(object):
             :param mips_type: version of SchoolMIPS core.
                 Mips won't be added in project if None
         """
-        configs = Loader.load(path or self._static_path)
-
-        self._qpf = configs.get("qpf", {})
-        self._qsf = configs.get("qsf", {})
-        self._sdc = configs.get("sdc", {})
-        v = configs.get("v", {})
-        self._v = v.get("assignments", {})
-        self._func = v.get("func", {})
-        self._functions = tuple(self.func_path(f)
-                                for f in FUNCTIONS.ITEMS.keys())
-
-        self._reset_mips(Loader.get_static_path(MIPS.CONFIG), mips_type)
-
-        quartus_version = self._qpf['quartus_version']
-        if not self._qsf.get("original_quartus_version"):
-            self._qsf['original_quartus_version'] = quartus_version
-        if not self._qsf.get("last_quartus_version"):
-            self._qsf['last_quartus_version'] = quartus_version
-        if not self._qsf.get("project_output_directory"):
-            self._qsf['project_output_directory'] = DESTINATIONS.OUTPUT
+        with trace.span("reset", path=path or self._static_path):
+            configs = Loader.load_config(path or self._static_path)
+
+            self._qpf = configs.get("qpf", {})
+            self._qsf = configs.get("qsf", {})
+            self._sdc = configs.get("sdc", {})
+            v = configs.get("v", {})
+            self._v = v.get("assignments", {})
+            self._func = v.get("func", {})
+            self._functions = tuple(self.func_path(f)
+                                    for f in FUNCTIONS.ITEMS.keys())
+
+            self._reset_mips(Loader.get_static_path(MIPS.CONFIG), mips_type)
+
+            quartus_version = self._qpf['quartus_version']
+            if not self._qsf.get("original_quartus_version"):
+                self._qsf['original_quartus_version'] = quartus_version
+            if not self._qsf.get("last_quartus_version"):
+                self._qsf['last_quartus_version'] = quartus_version
+            if not self._qsf.get("project_output_directory"):
+                self._qsf['project_output_directory'] = DESTINATIONS.OUTPUT
         return self
 
     def _reset_mips(self, config_path: str, mips_type: str) -> NoReturn:
@@ -116,7 +129,7 @@ class GenericBoard(object):
             logging.error("Unsupportable mips type: %s", mips_type)
             mips_type = None
         if mips_type:
-            mips_configs = Loader.load(config_path)
+            mips_configs = Loader.load_config(config_path)
             self._mips_qsf = mips_configs.get("qsf", {})
             self._mips_v = mips_configs.get("v", {})
         self._mips_type = mips_type
@@ -145,60 +158,125 @@ class GenericBoard(object):
             self.reset(mips_type=mips_type)
 
         def _filter(params: dict) -> dict:
-            for key in set(params).copy():
-                if not flt.get(key) and not flt.get(key.lower()):
-                    del params[key]
-            return params
+            return {key: value for key, value in params.items()
+                    if flt.get(key) or flt.get(key.lower())}
 
+        # NOTE configs are replaced, not changed in place, so renderers
+        # created before (e.g. in other thread) aren't affected
         self.project_name = project_name
-        self._qsf['user_assignments'] = _filter(self._qsf['user_assignments'])
+        self._qsf = dict(
+            self._qsf,
+            user_assignments=_filter(self._qsf['user_assignments']),
+            project_output_directory=(project_output_directory or
+                                      self._qsf['project_output_directory'])
+        )
         self._v = _filter(self._v)
 
         self._functions = tuple(self.func_path(f)
                                 for f in FUNCTIONS.ITEMS.keys() if func.get(f))
-        self._func.update(conf or {})
-        self._qsf['project_output_directory'] = \
-            project_output_directory or self._qsf['project_output_directory']
+        self._func = {**self._func, **(conf or {})}
         return self
 
-    def generate(self, project_name: str = None, **kwargs) -> object:
-        """ Generates FPGA configs """
-        if project_name or kwargs:
-            self.setup(project_name=project_name, **kwargs)
+    def generate(self,
+                 project_name: str = None,
+                 date_t: datetime = None,
+                 **kwargs) -> object:
+        """
+            Generates FPGA configs
+
+            :param date_t: project creation date (current time if None)
+        """
+        with trace.span("generate") as span:
+            if project_name or kwargs:
+                self.setup(project_name=project_name, **kwargs)
+            if span:
+                span.set(project=self.project_name)
+
+            renderers = self._renderers(date_t)
+            configs = {filename: self._render(filename, render)
+                       for filename, render in renderers.items()}
+        statics = {filename for filename, render in renderers.items()
+                   if render.func is Loader.load_static}
+        digests = {filename: get_digest(content)
+                   for filename, content in configs.items()}
+        # NOTE results are assigned together after rendering, so readers
+        # don't see configs and digests of different generations
+        self.configs, self.digests, self._statics = configs, digests, statics
+        return self
+
+    @property
+    def filenames(self) -> Tuple[str, ...]:
+        """ Names of files to be generated with current setup """
+        return tuple(self._renderers())
+
+    def render_file(self, filename: str, date_t: datetime = None) -> str:
+        """
+            Generates single config file (other ones aren't rendered)
 
-        self.configs = {'LICENSE': Loader.load_static("LICENSE")}
+            :param filename: one of filenames
+            :param date_t: project creation date (current time if None)
+        """
+        renderers = self._renderers(date_t)
+        if filename not in renderers:
+            raise KeyError("Unknown file: {}".format(filename))
+        return self._render(filename, renderers[filename])
 
-        self.configs.update(dict(zip(
-            map(lambda x: f"{self.project_name}.{x}",
-                ("v", "qpf", "qsf", "sdc")),
-            (Render.v(self.project_name, assignments=self._v, **self._mips_v),
-             Render.qpf(self.project_name, **self._qpf),
-             Render.qsf(self.project_name, func=self._functions,
-                        mips=self._mips_qsf, **self._qsf),
-             Render.sdc(self.project_name, mips=self._mips_type, **self._sdc))
-        )))
+    @staticmethod
+    def _render(filename: str, render: partial) -> str:
+        with trace.span("file", file=filename) as span:
+            content = render()
+            if span:
+                span.set(bytes=len(content.encode("utf-8")),
+                         static=render.func is Loader.load_static)
+            return content
+
+    def _renderers(self, date_t: datetime = None) -> OrderedDict:
+        """ Lazy renderers of generated files by their names """
+        name = self.project_name
+        renderers = OrderedDict((
+            ('LICENSE', partial(Loader.load_static,
+                                os.path.join(PATHS.BASE, "LICENSE"))),
+            (f"{name}.v", partial(Render.v, name, assignments=self._v,
+                                  **self._mips_v)),
+            (f"{name}.qpf", partial(Render.qpf, name, date_t=date_t,
+                                    **self._qpf)),
+            (f"{name}.qsf", partial(Render.qsf, name, func=self._functions,
+                                    mips=self._mips_qsf, date_t=date_t,
+                                    **self._qsf)),
+            (f"{name}.sdc", partial(Render.sdc, name, mips=self._mips_type,
+                                    **self._sdc))
+        ))
 
         # NOTE additional modules are placed in separate folder 'functions'
-        self.configs.update(dict(zip(
-            map(lambda x: x + ".v", self._functions),  # file paths
-            map(lambda x: Render.functions(x, **self._func), self._functions)
-        )))
+        for path in self._functions:
+            renderers[path + ".v"] = partial(Render.functions, path,
+                                             **self._func)
 
         if self._mips_type:
-            # Generate additional configs for SchoolMIPS
-            program_hex = os.path.join(PATHS.MIPS, "program.hex")
-            self.configs['program.hex'] = Loader.load_static(program_hex)
+            # Additional configs for SchoolMIPS
+            renderers['program.hex'] = partial(
+                Loader.load_static, os.path.join(PATHS.MIPS, "program.hex")
+            )
             mips_path = os.path.join(PATHS.MIPS, self._mips_type)
-            files = os.listdir(mips_path)
-            self.configs.update(dict(zip(
-                map(lambda x: os.path.join(DESTINATIONS.MIPS, x), files),
-                map(lambda x: Loader.load_static(x, mips_path), files)
-            )))
-        return self
+            for filename in os.listdir(mips_path):
+                renderers[os.path.join(DESTINATIONS.MIPS, filename)] = \
+                    partial(Loader.load_static, filename, mips_path)
+        return renderers
+
+    def dump(self,
+             path: str = None,
+             incremental: bool = False,
+             hardlink: bool = False) -> object:
+        """
+            Save FPGA config files to separate folder
 
-    def dump(self, path: str = None) -> object:
-        """ Save FPGA config files to separate folder """
+            :param incremental: write only changed files to existing folder
+            :param hardlink: allow hard links to cached static files
+                (such files shouldn't be edited in place)
+        """
         path = path or self.project_name
+        if incremental:
+            return self._dump_incremental(path, hardlink)
         create_dirs(path, rewrite=False)
 
         if self._functions:
@@ -209,6 +287,8 @@ class GenericBoard(object):
         def save_to_file(filename: str, content: Any) -> NoReturn:
             logging.debug("Creating '%s'...", os.path.join(path, filename))
             try:
+                if os.path.lexists(os.path.join(path, filename)):
+                    os.remove(os.path.join(path, filename))  # may be linked
                 with open(os.path.join(path, filename), "w") as fout:
                     fout.write(content)
             except BaseException as exc:
@@ -225,6 +305,50 @@ class GenericBoard(object):
                             errors_count, path)
         return self
 
+    def _dump_incremental(self, path: str, hardlink: bool) -> object:
+        """ Compare content digests and write only changed files """
+        manifest_path = os.path.join(path, DESTINATIONS.MANIFEST)
+        manifest = load_manifest(manifest_path)
+        files = {}
+        written_count = errors_count = 0
+
+        for filename, content in self.configs.items():
+            target = os.path.join(path, filename)
+            data = content.encode("utf-8")
+            digest = self.digests[filename]
+            try:
+                if not is_file_actual(target, digest, manifest.get(filename)):
+                    logging.debug("Updating '%s'...", target)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    if filename in self._statics:
+                        link_file(cache_static(data, digest), target,
+                                  hardlink=hardlink)
+                    else:
+                        if os.path.lexists(target):
+                            os.remove(target)  # may be linked to cache
+                        with open(target, "wb") as fout:
+                            fout.write(data)
+                    written_count += 1
+                files[filename] = stat_record(target, digest)
+            except OSError as exc:
+                logging.info("Can't create '%s' due to:\n%s", filename, exc)
+                errors_count += 1
+
+        for filename in set(manifest).difference(self.configs):
+            target = os.path.join(path, filename)
+            if is_file_actual(target, manifest[filename]['digest'],
+                              manifest[filename]):
+                logging.debug("Remove outdated '%s'", target)
+                os.remove(target)
+
+        save_manifest(manifest_path, files)
+        logging.info("%d of %d files updated in '%s'",
+                     written_count, len(self.configs), path)
+        if errors_count:
+            logging.warning("%d errors count while dumping to '%s'",
+                            errors_count, path)
+        return self
+
     def archive(self, path: str = None) -> object:
         """ Generate tar file with FPGA config files for specific project """
         Archiver.to_tar_flow(self.configs, path=path or self.project_name)
@@ -1,5 +1,6 @@
 import os
 import re
+import tempfile
 
 
 class PATHS(object):
@@ -8,6 +9,22 @@ class PATHS(object):
     STATIC = os.path.join(ROOT, "static")
     TEMPL = os.path.join(ROOT, "templates")
     MIPS = os.path.join(STATIC, "school_mips")
+    # local content-addressed cache for static assets
+    CACHE = os.environ.get("SYSGEN_CACHE_DIR") or \
+        os.path.join(tempfile.gettempdir(), "sysgen-cache")
+    # artifact store shared between server processes
+    STORE = os.environ.get("SYSGEN_STORE_DIR") or \
+        os.path.join(tempfile.gettempdir(), "sysgen-store")
+    # fingerprinted and precompressed assets of web client
+    ASSETS = os.environ.get("SYSGEN_ASSETS_DIR") or \
+        os.path.join(tempfile.gettempdir(), "sysgen-assets")
+    # profiles of requests collected on demand
+    PROFILES = os.environ.get("SYSGEN_PROFILES_DIR") or \
+        os.path.join(tempfile.gettempdir(), "sysgen-profiles")
+    # unix socket of CLI daemon (one per user)
+    SOCKET = os.environ.get("SYSGEN_SOCKET") or os.path.join(
+        tempfile.gettempdir(), f"sysgen-{os.getuid()}.sock"
+    )
 
 
 # Configure output paths
@@ -15,6 +32,8 @@ class DESTINATIONS(object):
     OUTPUT = "output_files"
     FUNC = "functions"
     MIPS = "mips"
+    MANIFEST = ".manifest.json"
+    DELTA = "DELTA.json"
 
 
 class MIPS(object):
@@ -0,0 +1,88 @@
+""" Resident generator process serving requests over unix socket. """
+
+import json
+import logging
+import os
+import socket
+import socketserver
+from typing import Any, Callable, Dict, NoReturn
+
+from engine.constants import PATHS
+
+
+# NOTE the module doesn't import engine, so clients start fast
+
+class _Handler(socketserver.StreamRequestHandler):
+    """ Handles json line request, responds with json line """
+
+    def handle(self) -> NoReturn:
+        line = self.rfile.readline()
+        try:
+            data = json.loads(line)
+            if data.get("command") == "ping":
+                response = {'pid': os.getpid()}
+            else:
+                response = self.server.handler(data)
+        except BaseException as e:
+            logging.error("Request failed with exception: %s", e)
+            response = {'error': str(e) or type(e).__name__}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+        Server of requests over unix socket (json line per connection).
+
+        Handler is called with request data in thread of connection and
+        should return json serializable response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self,
+                 handler: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 path: str = PATHS.SOCKET) -> NoReturn:
+        if os.path.exists(path):
+            if ping(path):
+                raise RuntimeError(f"Daemon is already running on '{path}'")
+            logging.debug("Remove stale socket '%s'", path)
+            os.remove(path)
+        self.handler = handler
+        self.path = path
+        super(Daemon, self).__init__(path, _Handler)
+        os.chmod(path, 0o600)  # NOTE daemon writes files on behalf of user
+
+    def server_close(self) -> NoReturn:
+        super(Daemon, self).server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def request(data: Dict[str, Any],
+            path: str = PATHS.SOCKET,
+            timeout: float = None) -> Dict[str, Any] or None:
+    """
+        Sends request to daemon.
+
+        :return response or None if daemon isn't running
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps(data).encode() + b"\n")
+            with sock.makefile("rb") as fin:
+                line = fin.readline()
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    if not line:
+        raise ConnectionError(f"No response from daemon '{path}'")
+    return json.loads(line)
+
+
+def ping(path: str = PATHS.SOCKET) -> bool:
+    """ :return whether daemon is running """
+    try:
+        return request({'command': "ping"}, path, timeout=1) is not None
+    except OSError:
+        return False
@@ -0,0 +1,114 @@
+""" Delta archives between projects generated with different configs. """
+
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, NoReturn
+
+from engine.boards import Board, GenericBoard
+from engine.constants import DESTINATIONS
+from engine.exceptions import UnknownDigest
+from engine.utils.prepare import Archiver, get_project_digest
+
+
+class Manifests(object):
+    """ Bounded registry of files' digests of recently generated projects """
+
+    def __init__(self, max_items: int = 1024) -> NoReturn:
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, digests: Dict[str, str]) -> str:
+        """ :return project digest """
+        digest = get_project_digest(digests)
+        with self._lock:
+            self._items[digest] = dict(digests)
+            self._items.move_to_end(digest)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return digest
+
+    def get(self, digest: str) -> Dict[str, str]:
+        with self._lock:
+            if digest not in self._items:
+                raise UnknownDigest(digest)
+            self._items.move_to_end(digest)
+            return dict(self._items[digest])
+
+
+MANIFESTS = Manifests()
+
+
+def diff_digests(old: Dict[str, str],
+                 new: Dict[str, str]) -> Dict[str, List[str]]:
+    """ Compare files' digests of two projects """
+    return {
+        'added': sorted(set(new).difference(old)),
+        'changed': sorted(name for name in set(new).intersection(old)
+                          if new[name] != old[name]),
+        'removed': sorted(set(old).difference(new))
+    }
+
+
+def delta_archive(board: GenericBoard,
+                  previous: Dict[str, str]) -> io.BytesIO:
+    """
+        Returns tar I/O with added and changed files of generated board
+        and delta manifest (see DESTINATIONS.DELTA).
+
+        :param previous: files' digests of previous project
+    """
+    diff = diff_digests(previous, board.digests)
+    logging.debug("Delta: %d added, %d changed, %d removed",
+                  *map(len, diff.values()))
+    files = {name: board.configs[name]
+             for name in diff['added'] + diff['changed']}
+    manifest = dict(diff)
+    manifest.update({
+        'base': get_project_digest(previous),
+        'digest': board.digest,
+        'files': board.digests
+    })
+    files[DESTINATIONS.DELTA] = json.dumps(manifest, indent=1,
+                                           sort_keys=True)
+    return Archiver.get_tar_io(files)
+
+
+def get_delta_date(date_t: datetime = None) -> datetime or None:
+    """
+        Returns common creation date for both projects of delta: date_t,
+        None if SOURCE_DATE_EPOCH is set (see Render.format_date) or now.
+    """
+    if date_t is None and not os.environ.get("SOURCE_DATE_EPOCH"):
+        date_t = datetime.utcnow()
+    return date_t
+
+
+def generate_delta(board_name: str,
+                   config: dict,
+                   previous: dict or str,
+                   date_t: datetime = None) -> io.BytesIO:
+    """
+        Generates project and returns delta archive against previous one.
+
+        :param config: board setup parameters (see GenericBoard.setup)
+        :param previous: setup parameters of previous project
+            or its digest (should be registered in MANIFESTS)
+        :param date_t: creation date for both projects (see get_delta_date)
+    """
+    date_t = get_delta_date(date_t)
+    if isinstance(previous, str):
+        digests = MANIFESTS.get(previous)
+    else:
+        digests = Board(board_name).setup(**previous).generate(
+            date_t=date_t
+        ).digests
+
+    board = Board(board_name).setup(**config).generate(date_t=date_t)
+    MANIFESTS.add(board.digests)
+    return delta_archive(board, digests)
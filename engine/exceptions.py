@@ -6,3 +6,25 @@ class InvalidProjectName(Exception):
         msg = f"Invalid project name '{project_name}'"
         super(InvalidProjectName, self).__init__(msg, *args, **kwargs)
         self.project_name = project_name
+
+
+class UnknownDigest(KeyError):
+    def __init__(self, digest: str, *args, **kwargs) -> NoReturn:
+        msg = f"Unknown project digest '{digest}'"
+        super(UnknownDigest, self).__init__(msg, *args, **kwargs)
+        self.digest = digest
+
+
+class QueueFull(Exception):
+    def __init__(self, max_jobs: int, *args, **kwargs) -> NoReturn:
+        msg = f"Too many jobs (max {max_jobs}), try again later"
+        super(QueueFull, self).__init__(msg, *args, **kwargs)
+        self.max_jobs = max_jobs
+
+
+class Overloaded(Exception):
+    def __init__(self, name: str, retry_after: int,
+                 *args, **kwargs) -> NoReturn:
+        msg = f"Too many concurrent {name}, retry after {retry_after}s"
+        super(Overloaded, self).__init__(msg, *args, **kwargs)
+        self.retry_after = retry_after
@@ -0,0 +1,130 @@
+""" Admission control of concurrent requests. """
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncGenerator, Dict, Generator, NoReturn
+
+from engine.exceptions import Overloaded
+
+
+class Admission(object):
+    """
+        Bounds number of concurrent calls in process.
+
+        Up to 'limit' calls run at once, up to 'queue_size' calls wait
+        for 'timeout' seconds, the rest are rejected immediately with
+        Overloaded exception (with estimated retry delay).
+    """
+
+    def __init__(self,
+                 limit: int,
+                 queue_size: int = 0,
+                 timeout: float = 1.0,
+                 name: str = "calls") -> NoReturn:
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.name = name
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.duration = 0.0  # moving average of calls durations
+        self._lock = threading.Condition()
+
+    def _reject(self) -> Overloaded:
+        """ Counts rejected call, must be called under lock """
+        self.rejected += 1
+        # time to handle queued calls by all slots
+        retry_after = max(1, math.ceil(
+            self.duration * (self.waiting + 1) / max(self.limit, 1)
+        ))
+        logging.warning("Reject %s: %d active, %d waiting, retry after %ds",
+                        self.name, self.active, self.waiting, retry_after)
+        return Overloaded(self.name, retry_after)
+
+    def _enter(self) -> bool:
+        """ Takes free slot, must be called under lock """
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def _leave(self, started: float) -> NoReturn:
+        with self._lock:
+            self.active -= 1
+            self.duration += (time.monotonic() - started - self.duration) / 8
+            self._lock.notify()
+
+    @contextmanager
+    def admit(self) -> Generator:
+        """ Runs block if it's admitted, raises Overloaded otherwise """
+        with self._lock:
+            if not self._enter():
+                if self.waiting >= self.queue_size:
+                    raise self._reject()
+                self.waiting += 1
+                try:
+                    admitted = self._lock.wait_for(self._enter, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    raise self._reject()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._leave(started)
+
+    @asynccontextmanager
+    async def admit_async(self) -> AsyncGenerator[None, None]:
+        """
+            Variant of admit for event loop (waiting doesn't block loop).
+
+            NOTE slots freed by other threads are found by polling.
+        """
+        with self._lock:
+            admitted = self._enter()
+            if not admitted and self.waiting >= self.queue_size:
+                raise self._reject()
+            if not admitted:
+                self.waiting += 1
+
+        if not admitted:
+            deadline = time.monotonic() + self.timeout
+            try:
+                while not admitted and time.monotonic() < deadline:
+                    await asyncio.sleep(0.005)
+                    with self._lock:
+                        admitted = self._enter()
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not admitted:
+                with self._lock:
+                    raise self._reject()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._leave(started)
+
+    @property
+    def stats(self) -> Dict[str, int or float]:
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'duration': round(self.duration, 6)
+            }
@@ -0,0 +1,134 @@
+""" Build of static assets: fingerprinted and precompressed files. """
+
+import gzip
+import json
+import logging
+import os
+import posixpath
+import re
+import tempfile
+from typing import Dict, NoReturn, Tuple
+
+from engine.utils.prepare import get_digest
+from engine.utils.serialize import parse_accept
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+MANIFEST = "manifest.json"
+# precompressed variants by content encoding
+ENCODINGS = {'br': ".br", 'gzip': ".gz"}
+# NOTE fonts (woff, woff2) and images like png are compressed already
+COMPRESSIBLE = (".css", ".js", ".map", ".svg", ".eot", ".ttf", ".html",
+                ".json", ".txt")
+CSS_URL_PATTERN = re.compile(r"url\(\s*(['\"]?)([^'\")?#]+)([^'\")]*)\1\s*\)")
+
+
+def get_asset_name(name: str, digest: str) -> str:
+    """ Returns name with digest, e.g. 'css/main.<digest>.css' """
+    root, ext = posixpath.splitext(name)
+    return f"{root}.{digest[:16]}{ext}"
+
+
+def _write(path: str, content: bytes) -> NoReturn:
+    """ Writes file atomically (other processes may serve it) """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as fout:
+        fout.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def _compress(content: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, 9, mtime=0)  # reproducible
+
+
+def _rewrite_css(name: str, content: bytes, assets: Dict[str, str]) -> bytes:
+    """ Replaces relative urls of built assets with fingerprinted ones """
+    base = posixpath.dirname(name)
+
+    def replace(match: re.Match) -> str:
+        quote, url, suffix = match.groups()
+        target = posixpath.normpath(posixpath.join(base, url))
+        if "//" in url or target not in assets:
+            return match.group(0)
+        url = posixpath.relpath(assets[target], base or ".")
+        return f"url({quote}{url}{suffix}{quote})"
+
+    return CSS_URL_PATTERN.sub(replace, content.decode("utf-8")).encode()
+
+
+def build_assets(sources: Dict[str, str], destination: str) -> Dict[str, str]:
+    """
+        Copies assets to destination with content digest in their names
+        (so they may be cached forever) and adds precompressed variants
+        (.gz and .br) of compressible files. Urls in css files are
+        rewritten to fingerprinted ones. Existing files aren't rebuilt.
+
+        :param sources: paths of source files by asset names
+            (relative urls, e.g. 'css/bootstrap.min.css')
+        :return manifest: fingerprinted names by asset names
+    """
+    assets = {}
+    # NOTE css is built last, as it refers to other assets
+    for name in sorted(sources, key=lambda x: (x.endswith(".css"), x)):
+        with open(sources[name], "rb") as fin:
+            content = fin.read()
+        if name.endswith(".css"):
+            content = _rewrite_css(name, content, assets)
+        assets[name] = get_asset_name(name, get_digest(content))
+        path = os.path.join(destination, assets[name])
+        if os.path.exists(path):
+            continue
+
+        logging.debug("Build asset '%s'", assets[name])
+        if name.endswith(COMPRESSIBLE):
+            for encoding, ext in ENCODINGS.items():
+                if encoding == "br" and brotli is None:
+                    continue
+                compressed = _compress(content, encoding)
+                if len(compressed) < len(content):
+                    _write(path + ext, compressed)
+        _write(path, content)  # NOTE the last, it marks built asset
+
+    manifest = json.dumps(assets, indent=2, sort_keys=True).encode()
+    _write(os.path.join(destination, MANIFEST), manifest)
+    logging.info("%d assets are built in '%s'", len(assets), destination)
+    return assets
+
+
+def load_assets(destination: str) -> Dict[str, str]:
+    """ :return manifest of built assets (empty if they aren't built) """
+    try:
+        with open(os.path.join(destination, MANIFEST)) as fin:
+            return json.load(fin)
+    except (OSError, ValueError):
+        return {}
+
+
+def find_asset(path: str,
+               accept_encoding: str or None) -> Tuple[str, str or None]:
+    """
+        Selects precompressed variant of built asset.
+
+        :param accept_encoding: Accept-Encoding header of request
+        :return path of file and its content encoding (None if it isn't
+            compressed)
+    """
+    accepted, refused = set(), set()
+    for value, quality in parse_accept(accept_encoding or ""):
+        (accepted if quality > 0 else refused).add(value)
+    for encoding, ext in ENCODINGS.items():
+        # NOTE '*' doesn't include encodings refused explicitly (q=0)
+        if encoding in refused:
+            continue
+        if (encoding in accepted or "*" in accepted) and \
+                os.path.exists(path + ext):
+            return path + ext, encoding
+    return path, None
@@ -0,0 +1,111 @@
+""" Caching of generated projects. """
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, NoReturn
+
+from engine import __version__
+from engine.constants import DEFAULT_PROJECT_NAME, FUNCTIONS
+from engine.utils.prepare import get_digest, get_static_digest
+
+
+def _enabled(items: Dict[str, Any] or Iterable[str] or None) -> list:
+    """ Sorted unique names of enabled items (dict values or list) """
+    if isinstance(items, dict):
+        items = (key for key, value in items.items() if value)
+    return sorted(set(items or ()))
+
+
+@lru_cache(maxsize=None)
+def get_engine_digest() -> str:
+    """
+        Digest of engine version and static files (boards configs, mips
+        sources and templates), they are read once per process
+    """
+    return get_digest(f"{__version__}:{get_static_digest()}")
+
+
+def get_fingerprint(board: str,
+                    project_name: str = None,
+                    mips_type: str = None,
+                    flt: Dict[str, bool] or Iterable[str] = None,
+                    conf: dict = None,
+                    func: Dict[str, bool] or Iterable[str] = None,
+                    **kwargs) -> str:
+    """
+        Canonical digest of project configuration.
+
+        Doesn't depend on items order and on values equal to defaults,
+        takes the same parameters as GenericBoard.setup. Depends on engine
+        version and static files, so projects saved by previous versions
+        (e.g. in artifact store) aren't reused.
+    """
+    canonical = {
+        'engine': get_engine_digest(),
+        'board': board.lower(),
+        'name': project_name or DEFAULT_PROJECT_NAME,
+        'mips': mips_type or None,
+        'conf': _enabled(flt),
+        'func': [f for f in _enabled(func) if f in FUNCTIONS.ITEMS],
+        'params': {key: value for key, value in (conf or {}).items()
+                   if value is not None}
+    }
+    canonical.update({key: value for key, value in kwargs.items()
+                      if value is not None})
+    return get_digest(json.dumps(canonical, sort_keys=True, default=str))
+
+
+class ArchiveCache(object):
+    """ Thread-safe LRU cache of generated archives limited by total size """
+
+    def __init__(self, max_bytes: int = 64 << 20) -> NoReturn:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        """ :return cached value or None """
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key: str, value: Any, size: int) -> NoReturn:
+        """ Caches value (evicts least recently used ones if needed) """
+        if size > self.max_bytes:
+            logging.debug("Skip caching '%s' of %d bytes", key, size)
+            return
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                logging.debug("Evict '%s' from archive cache", evicted)
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'items': len(self._items),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,70 @@
+""" Coalescing of identical concurrent calls. """
+
+import logging
+import threading
+from typing import Any, Callable, NoReturn, Tuple
+
+
+class _Call(object):
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self) -> NoReturn:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """
+        Runs only one call per key at a time in current process,
+        concurrent callers with the same key wait for its result.
+    """
+
+    def __init__(self) -> NoReturn:
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0  # number of calls which reused other's result
+
+    def do(self,
+           key: str,
+           func: Callable,
+           *args, **kwargs) -> Tuple[Any, bool]:
+        """
+            :return result of func and whether it was shared
+                (func was called by other caller)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            logging.debug("Wait for in-flight call '%s'", key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                logging.debug("Result of '%s' shared with %d callers",
+                              key, call.waiters)
+        return call.result, False
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,200 @@
+""" Import of vendor Quartus settings (.qsf) into board static files. """
+
+import logging
+import mmap
+import os
+import re
+import sys
+from argparse import ArgumentParser, Namespace
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from engine.utils.prepare import Loader
+
+
+ASSIGNMENT = re.compile(
+    rb"^[ \t]*set_(location|instance|global)_assignment[ \t]+([^\r\n]*)",
+    re.MULTILINE
+)
+TOKEN = re.compile(r'"[^"]*"|\S+')
+
+# project specific assignments, which are generated by templates
+PROJECT_ASSIGNMENTS = {
+    "bdf_file", "qip_file", "sdc_file", "search_path", "top_level_entity",
+    "verilog_file", "vhdl_file", "systemverilog_file", "qsys_file",
+    "project_creation_time_date", "project_output_directory"
+}
+# mapping of global assignments to board config keys
+GLOBAL_FIELDS = {
+    "family": "family",
+    "device": "device",
+    "original_quartus_version": "original_quartus_version",
+    "last_quartus_version": "last_quartus_version"
+}
+INPUT_PREFIXES = ("KEY", "SW", "BTN", "BUTTON", "CLK", "CLOCK", "RESET")
+OUTPUT_PREFIXES = ("LED", "HEX", "VGA", "SEG", "DIG")
+BUS = re.compile(r"^(.+?)\[(\d+)\]$")
+
+
+def scan_qsf(path: str) -> Iterable[Tuple[str, List[str]]]:
+    """
+        Scan memory mapped .qsf file for assignments.
+
+        Yields (kind, tokens) pairs, where kind is one of 'location',
+        'instance' or 'global' and tokens are assignment arguments.
+        Lines are matched on mapped bytes, so only assignment lines
+        are decoded.
+    """
+    if not os.path.getsize(path):
+        return
+    with open(path, "rb") as fin, \
+            mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        for match in ASSIGNMENT.finditer(content):
+            line = match.group(2).decode("utf-8", errors="replace")
+            yield match.group(1).decode(), TOKEN.findall(line.split("#")[0])
+
+
+def get_options(tokens: List[str]) -> Tuple[Dict[str, str], List[str]]:
+    """ Splits tokens to '-option value' pairs and positional args """
+    options, args = {}, []
+    tokens = iter(tokens)
+    for token in tokens:
+        if token.startswith("-") and len(token) > 1:
+            options[token[1:]] = next(tokens, "")
+        else:
+            args.append(token)
+    return options, args
+
+
+def unquote(value: str) -> str:
+    return value[1:-1] if value[:1] == value[-1:] == "\"" else value
+
+
+def get_part_name(signal: str) -> str:
+    """ E.g. 'SDRAM_DQ[15]' -> 'SDRAM', 'CLOCK2_50' -> 'CLOCK' """
+    name = signal.split("[")[0].split("_")[0]
+    return name.rstrip("0123456789") or name
+
+
+def get_direction(part_name: str) -> str:
+    if part_name.startswith(INPUT_PREFIXES):
+        return "input"
+    if part_name.startswith(OUTPUT_PREFIXES):
+        return "output"
+    return "inout"
+
+
+def get_ports(part_name: str, signals: Iterable[str]) -> List[list]:
+    """ Returns verilog ports (buses are merged) for part signals """
+    ports = OrderedDict()
+    for signal in signals:
+        match = BUS.match(signal)
+        name, index = (match.group(1), int(match.group(2))) if match \
+            else (signal, None)
+        ports.setdefault(name, []).append(index)
+
+    direction = get_direction(part_name)
+    result = []
+    for name, indexes in ports.items():
+        rank = ""
+        if None not in indexes:
+            rank = f"[{max(indexes)}:{min(indexes)}]"
+        result.append([direction, rank, name])
+    return result
+
+
+def import_qsf(path: str) -> dict:
+    """ Converts .qsf file to board config (see GenericBoard.reset) """
+    logging.debug("Import '%s'", path)
+    qsf = {'global_assignments': OrderedDict()}
+    parts = OrderedDict()
+    signals = OrderedDict()  # signal -> part name
+
+    def get_part(signal: str) -> dict:
+        if signal not in signals:
+            signals[signal] = get_part_name(signal)
+        return parts.setdefault(signals[signal], {
+            'instance': [],
+            'location': []
+        })
+
+    for kind, tokens in scan_qsf(path):
+        options, args = get_options(tokens)
+        if "section_id" in options:
+            continue  # partitions and other project specific sections
+        if kind == "location" and args and options.get("to"):
+            signal = unquote(options['to'])
+            get_part(signal)['location'].append([args[0], signal])
+        elif kind == "instance" and args and options.get("to"):
+            signal = unquote(options['to'])
+            get_part(signal)['instance'].append(
+                [options.get("name", ""), unquote(args[0]), signal]
+            )
+        elif kind == "global" and args and options.get("name"):
+            name = options['name'].lower()
+            if name in GLOBAL_FIELDS:
+                qsf[GLOBAL_FIELDS[name]] = unquote(args[0])
+            elif name not in PROJECT_ASSIGNMENTS:
+                qsf['global_assignments'][name] = args[0]
+
+    assignments = OrderedDict()
+    for signal, part_name in signals.items():
+        assignments.setdefault(part_name, []).append(signal)
+
+    quartus_version = qsf.get("last_quartus_version") or \
+        qsf.get("original_quartus_version", "")
+    qsf.setdefault("original_quartus_version", quartus_version)
+    qsf.setdefault("last_quartus_version", quartus_version)
+    qsf['global_assignments'] = dict(qsf['global_assignments'])
+    qsf['user_assignments'] = {
+        name: {key: val for key, val in part.items() if val}
+        for name, part in parts.items()
+    }
+    logging.info("%d signals in %d parts imported from '%s'",
+                 len(signals), len(parts), path)
+    return {
+        'qpf': {'quartus_version': quartus_version},
+        'qsf': qsf,
+        'sdc': {'create_clock': [], 'create_generated_clock': []},
+        'v': {
+            'assignments': {name: get_ports(name, part_signals)
+                            for name, part_signals in assignments.items()},
+            'func': {}
+        }
+    }
+
+
+def qsf_to_static(from_path: str, to_path: str = None) -> str:
+    """
+        Saves board config imported from .qsf file as static file.
+
+        :return path to static file
+    """
+    if to_path is None:
+        to_path = os.path.splitext(from_path)[0] + ".yml"
+    fmt = to_path.split(".")[-1].lower()
+    if fmt not in Loader.DUMPERS:
+        logging.debug("Assume 'yml' format for '%s'", to_path)
+        fmt = "yml"
+
+    content = import_qsf(from_path)
+    logging.debug("Save imported config to '%s'", to_path)
+    with open(to_path, ("w" if fmt != "bin" else "wb")) as fout:
+        Loader.DUMPERS[fmt](content, fout)
+    logging.info("Imported config saved to '%s'", to_path)
+    return to_path
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Import .qsf file as board config")
+    parser.add_argument('qsf', type=str, help="path to vendor .qsf file")
+    parser.add_argument('--output', '-o', type=str, default=None,
+                        help="path to board config (yml, json or bin)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s\t%(levelname)s\t%(message)s")
+    args = parse_argv()
+    sys.exit(0 if qsf_to_static(args.qsf, args.output) else 1)
@@ -0,0 +1,350 @@
+""" Local persistent queue of background jobs. """
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generator, Iterable, NoReturn
+
+from engine.exceptions import QueueFull
+
+
+class JobQueue(object):
+    """
+        Queue of jobs kept in SQLite database, so it's shared between
+        server processes and survives restarts (no external broker).
+
+        Jobs are executed by pool of worker threads of each process
+        which started queue. Handler is called with job parameters and
+        progress callback, its result should be json serializable.
+        Running jobs are renewed by heartbeat of their process, jobs
+        without heartbeat for lease seconds are requeued. Finished jobs
+        are removed after ttl or if there are more than max_jobs of them.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    FINISHED = (DONE, FAILED)
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, state TEXT, params TEXT, result TEXT, "
+        "error TEXT, pid INTEGER, created REAL, updated REAL)",
+        "CREATE TABLE IF NOT EXISTS events ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, job TEXT, data TEXT)",
+        "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)",
+        "CREATE INDEX IF NOT EXISTS events_job ON events (job, seq)"
+    )
+
+    def __init__(self,
+                 path: str,
+                 handler: Callable[[Any, Callable], Any],
+                 workers: int = 2,
+                 ttl: float = 24 * 3600,
+                 max_jobs: int = 1000,
+                 poll_interval: float = 0.5,
+                 lease: float = 30) -> NoReturn:
+        """
+            :param path: database file
+            :param handler: function(params, progress) of job, where
+                progress(stage, **info) reports job stage
+            :param workers: number of worker threads
+            :param ttl: lifetime (seconds) of finished jobs
+            :param max_jobs: max number of kept jobs
+            :param poll_interval: period of checking jobs submitted
+                by other processes
+            :param lease: time (seconds) after the last heartbeat of
+                running job, when its process is considered dead
+        """
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._threads = []
+        self._running = set()  # jobs of this process
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._changed = threading.Condition()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self, immediate: bool = False) -> Generator:
+        """
+            Yields connection in transaction (one per operation)
+
+            :param immediate: lock database for writes at the beginning
+                of transaction, so read before write doesn't race with
+                other processes
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                if immediate:
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            conn.close()
+
+    def _notify(self) -> NoReturn:
+        with self._changed:
+            self._changed.notify_all()
+
+    def _wait(self, timeout: float) -> NoReturn:
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def start(self) -> object:
+        """ Starts workers and heartbeat, requeues jobs of dead processes """
+        with self._lock:
+            if self._threads:
+                return self
+            self.recover()
+            self._stop.clear()
+            targets = [(self._work, f"job-worker-{i}")
+                       for i in range(self.workers)]
+            for target, name in targets + [(self._heartbeat, "job-heartbeat")]:
+                thread = threading.Thread(target=target, daemon=True,
+                                          name=name)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = None) -> NoReturn:
+        self._stop.set()
+        self._notify()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def recover(self) -> int:
+        """
+            Requeues running jobs without heartbeat for lease seconds.
+
+            NOTE pid of process isn't checked, it may be reused or belong
+            to other host (container) sharing database
+
+            :return number of requeued jobs
+        """
+        with self._connect() as conn:
+            lost = [row[0] for row in conn.execute(
+                "SELECT id FROM jobs WHERE state = ? AND updated < ?",
+                (self.RUNNING, time.time() - self.lease)
+            )]
+            for job in lost:
+                logging.warning("Requeue lost job '%s'", job)
+                conn.execute(
+                    "UPDATE jobs SET state = ?, pid = NULL WHERE id = ?",
+                    (self.QUEUED, job)
+                )
+                self._add_event(conn, job, self.QUEUED)
+        self._notify()
+        return len(lost)
+
+    def submit(self, params: Any) -> str:
+        """
+            Adds job to queue.
+
+            :param params: json serializable parameters for handler
+            :return job id
+        """
+        self.purge()
+        job = uuid.uuid4().hex
+        now = time.time()
+        with self._connect(immediate=True) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            if count >= self.max_jobs:
+                raise QueueFull(self.max_jobs)
+            conn.execute(
+                "INSERT INTO jobs VALUES (?, ?, ?, NULL, NULL, NULL, ?, ?)",
+                (job, self.QUEUED, json.dumps(params), now, now)
+            )
+            # NOTE in the same transaction, so it precedes worker's events
+            self._add_event(conn, job, self.QUEUED)
+        logging.debug("Job '%s' is queued", job)
+        self._notify()
+        return job
+
+    @staticmethod
+    def _add_event(conn: sqlite3.Connection,
+                   job: str,
+                   stage: str,
+                   **info) -> NoReturn:
+        data = dict(info, stage=stage, time=time.time())
+        conn.execute("INSERT INTO events (job, data) VALUES (?, ?)",
+                     (job, json.dumps(data)))
+
+    def _event(self, job: str, stage: str, **info) -> NoReturn:
+        with self._connect() as conn:
+            self._add_event(conn, job, stage, **info)
+        self._notify()
+
+    def _claim(self) -> tuple or None:
+        """ :return id and params of the oldest queued job """
+        with self._connect(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT id, params FROM jobs WHERE state = ? "
+                "ORDER BY created LIMIT 1", (self.QUEUED,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET state = ?, pid = ?, updated = ? "
+                    "WHERE id = ?",
+                    (self.RUNNING, os.getpid(), time.time(), row[0])
+                )
+                self._add_event(conn, row[0], self.RUNNING)
+        return row
+
+    def _work(self) -> NoReturn:
+        while not self._stop.is_set():
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                logging.warning("Can't claim job:\n%s", e)
+                claimed = None
+            if claimed is None:
+                self._wait(self.poll_interval)
+                continue
+            self._run(claimed[0], json.loads(claimed[1]))
+
+    def _heartbeat(self) -> NoReturn:
+        """ Renews running jobs of process, requeues lost ones """
+        while not self._stop.wait(self.lease / 3):
+            with self._lock:
+                running = list(self._running)
+            try:
+                with self._connect() as conn:
+                    conn.executemany(
+                        "UPDATE jobs SET updated = ? "
+                        "WHERE id = ? AND state = ?",
+                        ((time.time(), job, self.RUNNING) for job in running)
+                    )
+                self.recover()
+            except sqlite3.Error as e:
+                logging.warning("Can't renew jobs:\n%s", e)
+
+    def _run(self, job: str, params: Any) -> NoReturn:
+        logging.debug("Job '%s' is started", job)
+        result, error, state = None, None, self.DONE
+        with self._lock:
+            self._running.add(job)
+        try:
+            result = self.handler(
+                params, lambda stage, **info: self._event(job, stage, **info)
+            )
+        except BaseException as e:
+            logging.error("Job '%s' failed with exception: %s", job, e)
+            error, state = str(e) or type(e).__name__, self.FAILED
+        finally:
+            with self._lock:
+                self._running.discard(job)
+
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, "
+                "updated = ? WHERE id = ?",
+                (state, json.dumps(result), error, time.time(), job)
+            )
+            self._add_event(conn, job, state)
+        self._notify()
+
+    def get(self, job: str) -> Dict[str, Any] or None:
+        """ :return job state, result or error and timestamps """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT state, result, error, created, updated "
+                "FROM jobs WHERE id = ?", (job,)
+            ).fetchone()
+            stage = conn.execute(
+                "SELECT data FROM events WHERE job = ? "
+                "ORDER BY seq DESC LIMIT 1", (job,)
+            ).fetchone()
+        if row is None:
+            return None
+        state, result, error, created, updated = row
+        return {
+            'id': job,
+            'state': state,
+            'stage': json.loads(stage[0]) if stage else None,
+            'result': json.loads(result) if result else None,
+            'error': error,
+            'created': created,
+            'updated': updated
+        }
+
+    def events(self,
+               job: str,
+               timeout: float = None) -> Iterable[Dict[str, Any]]:
+        """
+            Yields job events (stages) until job is finished.
+
+            :param timeout: max time (seconds) of waiting
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        seq = 0
+        while True:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT seq, data FROM events WHERE job = ? AND seq > ? "
+                    "ORDER BY seq", (job, seq)
+                ).fetchall()
+            for seq, data in rows:
+                event = json.loads(data)
+                yield event
+                if event['stage'] in self.FINISHED:
+                    return
+            if not rows and self.get(job) is None:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            self._wait(self.poll_interval)
+
+    def purge(self) -> int:
+        """
+            Removes finished jobs, which are expired or exceed max_jobs
+            (the oldest ones).
+
+            :return number of removed jobs
+        """
+        placeholders = ", ".join("?" * len(self.FINISHED))
+        with self._connect() as conn:
+            expired = [row[0] for row in conn.execute(
+                f"SELECT id FROM jobs WHERE state IN ({placeholders}) "
+                "AND updated < ?", self.FINISHED + (time.time() - self.ttl,)
+            )]
+            count = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            excess = count - len(expired) - self.max_jobs + 1
+            if excess > 0:
+                expired.extend(row[0] for row in conn.execute(
+                    f"SELECT id FROM jobs WHERE state IN ({placeholders}) "
+                    "AND updated >= ? ORDER BY updated LIMIT ?",
+                    self.FINISHED + (time.time() - self.ttl, excess)
+                ))
+            conn.executemany("DELETE FROM jobs WHERE id = ?",
+                             ((job,) for job in expired))
+            conn.executemany("DELETE FROM events WHERE job = ?",
+                             ((job,) for job in expired))
+        if expired:
+            logging.debug("%d jobs are purged", len(expired))
+        return len(expired)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            counts = dict(conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall())
+        return {state: counts.get(state, 0) for state in
+                (self.QUEUED, self.RUNNING, self.DONE, self.FAILED)}
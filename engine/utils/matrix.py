@@ -0,0 +1,248 @@
+"""
+    Regression check of configuration matrix: generates combinations of
+    boards, SchoolMIPS versions and sets of functions in parallel and
+    compares digests of generated files with stored baseline.
+
+    Usage: python -m engine.utils.matrix [--sample N --seed S] [--update]
+"""
+
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from collections import Counter, namedtuple
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, NoReturn, Tuple
+
+from engine.batch import run_pool
+from engine.boards import Board
+from engine.constants import BOARDS, FUNCTIONS, MIPS
+from engine.delta import diff_digests
+
+
+PROJECT_NAME = "matrix"
+# NOTE fixed date, so generated files don't depend on time of run
+DATE = datetime(2000, 1, 1)
+
+OK = "ok"
+CHANGED = "changed"
+NEW = "new"
+FAILED = "failed"
+MISSING = "missing"  # in baseline, but not in matrix
+
+DIGEST_SIZE = 16  # hex digits of files' digests kept in baseline
+
+# result of combination check: status, files' digests (None if it
+# failed), diff with baseline (None if it isn't changed), duration of
+# generation (seconds) and error message
+MatrixResult = namedtuple("MatrixResult", ("key", "status", "digests",
+                                           "diff", "duration", "error"))
+
+
+def get_key(config: Dict[str, Any]) -> str:
+    """ Returns name of combination, e.g. 'de1soc/simple/Seven+Uart8' """
+    return "/".join((config['board'], config.get("mips") or "-",
+                     "+".join(config.get("func") or ()) or "-"))
+
+
+def get_combinations(boards: Iterable[str] = BOARDS,
+                     mips: Iterable[str or None] = None,
+                     functions: Iterable[str] = None,
+                     max_functions: int = None) -> Iterator[Dict[str, Any]]:
+    """
+        Yields configs (API client format) of all combinations of
+        boards, mips versions (including no mips) and subsets of
+        functions (up to max_functions in subset).
+    """
+    mips = (None,) + MIPS.VERSIONS if mips is None else tuple(mips)
+    functions = sorted(FUNCTIONS.ITEMS if functions is None else functions)
+    if max_functions is None:
+        max_functions = len(functions)
+    subsets = [list(subset) for size in range(max_functions + 1)
+               for subset in itertools.combinations(functions, size)]
+    for board, mips_type, func in itertools.product(boards, mips, subsets):
+        yield {'board': board, 'name': PROJECT_NAME, 'mips': mips_type,
+               'func': func}
+
+
+def sample(configs: Iterable[Dict[str, Any]],
+           count: int,
+           seed: int = None) -> List[Dict[str, Any]]:
+    """ Returns reproducible random sample of configs (in their order) """
+    configs = list(configs)
+    if count >= len(configs):
+        return configs
+    indexes = random.Random(seed).sample(range(len(configs)), count)
+    return [configs[index] for index in sorted(indexes)]
+
+
+def generate_digests(index: int,
+                     config: Dict[str, Any]) -> Tuple[str, Any, float, str]:
+    """
+        Generates combination (pool function).
+
+        :return key, files' digests, duration and error message
+    """
+    start = time.perf_counter()
+    try:
+        board = Board(config['board']).setup(
+            project_name=config['name'],
+            mips_type=config['mips'],
+            func={name: True for name in config['func']}
+        ).generate(date_t=DATE)
+        digests = {filename: digest[:DIGEST_SIZE]
+                   for filename, digest in board.digests.items()}
+        return get_key(config), digests, time.perf_counter() - start, None
+    except BaseException as e:
+        return (get_key(config), None, time.perf_counter() - start,
+                str(e) or type(e).__name__)
+
+
+def check(configs: Iterable[Dict[str, Any]],
+          baseline: Dict[str, Dict[str, str]],
+          workers: int = None) -> Iterator[MatrixResult]:
+    """ Yields results of combinations compared with baseline """
+    for key, digests, duration, error in run_pool(
+            generate_digests, configs, workers, ordered=False):
+        if error is not None:
+            yield MatrixResult(key, FAILED, None, None, duration, error)
+        elif key not in baseline:
+            yield MatrixResult(key, NEW, digests, None, duration, None)
+        elif baseline[key] != digests:
+            yield MatrixResult(key, CHANGED, digests,
+                               diff_digests(baseline[key], digests),
+                               duration, None)
+        else:
+            yield MatrixResult(key, OK, digests, None, duration, None)
+
+
+def find_missing(baseline: Dict[str, Dict[str, str]]) -> List[MatrixResult]:
+    """
+        Returns results of baseline combinations, which aren't in full
+        matrix anymore (e.g. board or function is removed), so they
+        can't be checked
+    """
+    keys = {get_key(config) for config in get_combinations()}
+    return [MatrixResult(key, MISSING, None, None, 0.0,
+                         "Combination isn't in matrix")
+            for key in sorted(set(baseline) - keys)]
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, str]]:
+    """ :return files' digests by combinations (empty if there is none) """
+    if not os.path.exists(path):
+        logging.warning("Baseline '%s' isn't found", path)
+        return {}
+    with open(path) as fin:
+        return json.load(fin)['combinations']
+
+
+def save_baseline(path: str,
+                  results: Iterable[MatrixResult],
+                  baseline: Dict[str, Dict[str, str]] = None) -> NoReturn:
+    """
+        Saves digests of succeeded results (updates given baseline),
+        missing combinations are removed
+    """
+    combinations = dict(baseline or {})
+    for result in results:
+        if result.status == MISSING:
+            combinations.pop(result.key, None)
+        elif result.status != FAILED:
+            combinations[result.key] = result.digests
+    with open(path, "w") as fout:
+        json.dump({'date': DATE.isoformat(), 'combinations': combinations},
+                  fout, indent=1, sort_keys=True)
+    logging.info("%d combinations saved to '%s'", len(combinations), path)
+
+
+def report(results: List[MatrixResult],
+           duration: float,
+           slowest: int = 10) -> str:
+    """ Returns text report: differences, failures and timings """
+    lines = []
+    for result in sorted(results, key=lambda result: result.key):
+        if result.status == CHANGED:
+            lines.append(f"CHANGED {result.key}")
+            lines.extend(f"    {kind} {name}"
+                         for kind, names in result.diff.items()
+                         for name in names)
+        elif result.status == FAILED:
+            lines.append(f"FAILED  {result.key}: {result.error}")
+        elif result.status == MISSING:
+            lines.append(f"MISSING {result.key}")
+
+    generated = [result for result in results if result.status != MISSING]
+    if generated and slowest:
+        lines.append("Slowest combinations:")
+        by_duration = sorted(generated, key=lambda result: -result.duration)
+        lines.extend(f"    {result.duration * 1000:>8.2f} ms  {result.key}"
+                     for result in by_duration[:slowest])
+    durations = sorted(result.duration for result in generated) or [0]
+    counts = Counter(result.status for result in results)
+    lines.append(
+        f"{len(generated)} combinations in {duration:.2f} s "
+        f"(median {durations[len(durations) // 2] * 1000:.2f} ms): " +
+        ", ".join(f"{counts[status]} {status}"
+                  for status in (OK, CHANGED, NEW, FAILED, MISSING))
+    )
+    return "\n".join(lines)
+
+
+def parse_argv() -> Namespace:
+    parser = ArgumentParser(description="Regression check of configuration "
+                                        "matrix against baseline")
+    parser.add_argument('--baseline', '-b', type=str,
+                        default="matrix-baseline.json",
+                        help="file with digests of generated files")
+    parser.add_argument('--update', '-u', action="store_true",
+                        help="save results to baseline (required if "
+                             "there is no baseline)")
+    parser.add_argument('--boards', type=str, nargs="+", default=BOARDS,
+                        choices=BOARDS)
+    parser.add_argument('--max-functions', type=int, default=None,
+                        help="max number of functions in combination")
+    parser.add_argument('--sample', '-n', type=int, default=None,
+                        help="check random sample of combinations")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of random sample")
+    parser.add_argument('--workers', '-w', type=int, default=None)
+    parser.add_argument('--report', '-r', type=str, default=None,
+                        help="save results as json")
+    return parser.parse_args()
+
+
+def main(args: Namespace) -> int:
+    configs = get_combinations(args.boards, max_functions=args.max_functions)
+    if args.sample is not None:
+        configs = sample(configs, args.sample, args.seed)
+    if not args.update and not os.path.exists(args.baseline):
+        logging.error("Baseline '%s' isn't found, it's created by --update",
+                      args.baseline)
+        return 2
+    baseline = load_baseline(args.baseline)
+
+    start = time.perf_counter()
+    results = list(check(configs, baseline, args.workers))
+    results.extend(find_missing(baseline))
+    print(report(results, time.perf_counter() - start))
+
+    if args.report is not None:
+        with open(args.report, "w") as fout:
+            json.dump([result._asdict() for result in results], fout,
+                      indent=1)
+    if args.update:
+        save_baseline(args.baseline, results, baseline)
+        return 0
+    return int(any(result.status in (CHANGED, FAILED, MISSING)
+                   for result in results))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s\t%(levelname)s\t%(message)s")
+    sys.exit(main(parse_argv()))
@@ -0,0 +1,393 @@
+"""
+    Metrics registry (counters, gauges, histograms) in Prometheus text
+    exposition format, without external services and dependencies.
+
+    If registry has path (directory shared by workers of server, e.g.
+    gunicorn ones), every process saves its values there, and exposition
+    aggregates all of them: counters and histograms are summed over all
+    processes (including finished ones), gauges - over running ones.
+    The directory should be emptied before server start.
+"""
+
+import atexit
+import glob
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, NoReturn, Tuple
+
+from engine.utils import trace
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+# bytes
+SIZE_BUCKETS = tuple(1 << power for power in range(10, 26, 2))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self,
+                 registry: object,
+                 name: str,
+                 documentation: str,
+                 labels: Iterable[str] = ()) -> NoReturn:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._registry = registry
+        self._values = {}  # by tuples of labels' values
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if labels.keys() != set(self.labels):
+            raise ValueError(f"Expected labels {self.labels} of "
+                             f"'{self.name}', got {tuple(labels)}")
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        """ :return copy of values by labels' values """
+        with self._registry.lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> NoReturn:
+        key = self._key(labels)
+        self._registry.touch()
+        with self._registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """ Gauge, its value may be read by function on exposition """
+
+    kind = "gauge"
+
+    def __init__(self, *args, function: Callable[[], float] = None,
+                 **kwargs) -> NoReturn:
+        super(Gauge, self).__init__(*args, **kwargs)
+        self.function = function
+
+    def set(self, value: float, **labels) -> NoReturn:
+        key = self._key(labels)
+        self._registry.touch()
+        with self._registry.lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> NoReturn:
+        key = self._key(labels)
+        self._registry.touch()
+        with self._registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> NoReturn:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        if self.function is not None:
+            return {(): self.function()}
+        return super(Gauge, self).samples()
+
+
+class Histogram(_Metric):
+    """ Histogram, values are [counts by buckets, sum, count] """
+
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS,
+                 **kwargs) -> NoReturn:
+        super(Histogram, self).__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> NoReturn:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)  # NOTE bucket is 'le'
+        self._registry.touch()
+        with self._registry.lock:
+            counts, total, count = self._values.get(key) or \
+                ([0] * (len(self.buckets) + 1), 0, 0)
+            counts[index] += 1
+            self._values[key] = [counts, total + value, count + 1]
+
+    def samples(self) -> Dict[Tuple[str, ...], Any]:
+        with self._registry.lock:
+            return {key: [list(counts), total, count]
+                    for key, (counts, total, count) in self._values.items()}
+
+
+class Registry(object):
+    """
+        Collection of metrics of process.
+
+        :param name: prefix of files in shared directory (so one
+            directory may be used by several applications)
+        :param path: directory shared by processes (None for single one)
+        :param flush_interval: seconds between saving of changed values
+    """
+
+    def __init__(self,
+                 name: str = "metrics",
+                 path: str = None,
+                 flush_interval: float = 1.0) -> NoReturn:
+        self.name = name
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._flusher_pid = None  # NOTE flusher isn't inherited by fork
+        self._flushed = None
+        self._closed = threading.Event()
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            atexit.register(self._try_flush)
+
+    def _add(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str,
+                labels: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(self, name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str,
+              labels: Iterable[str] = (),
+              function: Callable[[], float] = None) -> Gauge:
+        return self._add(Gauge(self, name, documentation, labels,
+                               function=function))
+
+    def histogram(self, name: str, documentation: str,
+                  labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, documentation, labels,
+                                   buckets=buckets))
+
+    def touch(self) -> NoReturn:
+        """
+            Starts saving of values in current process (if registry is
+            shared), must be called before values are changed
+        """
+        if self.path is None or self._flusher_pid == os.getpid():
+            return
+        with self.lock:
+            if self._flusher_pid == os.getpid():
+                return
+            if self._flusher_pid is not None:
+                # NOTE forked process, values are counted by parent
+                for metric in self._metrics.values():
+                    metric._values.clear()
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, daemon=True,
+                         name="metrics-flusher").start()
+
+    def _flush_periodically(self) -> NoReturn:
+        pid = os.getpid()
+        while not self._closed.wait(self.flush_interval) and \
+                self._flusher_pid == pid:
+            self._try_flush()
+
+    def close(self) -> NoReturn:
+        """
+            Saves values of current process and stops saving of them
+            (e.g. before shared directory is removed), registry isn't
+            shared after that
+        """
+        if self.path is None:
+            return
+        self._try_flush()
+        atexit.unregister(self._try_flush)
+        with self.lock:
+            self.path = None
+            self._flusher_pid = None
+        self._closed.set()
+
+    def _try_flush(self) -> NoReturn:
+        try:
+            self.flush()
+        except OSError as e:
+            logging.warning("Metrics aren't saved: %s", e)
+
+    def _get_filename(self, path: str) -> str:
+        return os.path.join(path, f"{self.name}-{os.getpid()}.json")
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """ :return metrics of current process as json serializable dict """
+        return {
+            name: {
+                'type': metric.kind,
+                'help': metric.documentation,
+                'labels': list(metric.labels),
+                'buckets': list(getattr(metric, "buckets", ())),
+                'samples': [[list(key), value]
+                            for key, value in metric.samples().items()]
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def flush(self) -> NoReturn:
+        """ Saves values of current process (if they are changed) """
+        path = self.path  # NOTE registry may be closed concurrently
+        if path is None or self._flusher_pid != os.getpid():
+            return
+        snapshot = {'pid': os.getpid(), 'metrics': self.snapshot()}
+        if snapshot == self._flushed:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix=".tmp")
+        with os.fdopen(fd, "w") as fout:
+            json.dump(snapshot, fout)
+        os.replace(tmp_path, self._get_filename(path))
+        self._flushed = snapshot
+
+    def _load_snapshots(self) -> List[Dict[str, Any]]:
+        """ :return saved snapshots of other processes and current one """
+        own = {'pid': os.getpid(), 'metrics': self.snapshot()}
+        path = self.path
+        if path is None:
+            return [own]
+        snapshots = [own]
+        for filename in glob.glob(os.path.join(path, f"{self.name}-*.json")):
+            if filename == self._get_filename(path):
+                continue
+            try:
+                with open(filename) as fin:
+                    snapshots.append(json.load(fin))
+            except (OSError, ValueError) as e:
+                logging.warning("Metrics '%s' aren't loaded: %s", filename, e)
+        return snapshots
+
+    def collect(self) -> Dict[str, Dict[str, Any]]:
+        """ :return metrics aggregated over processes (like snapshot) """
+        collected = {}
+        for snapshot in self._load_snapshots():
+            alive = _is_alive(snapshot['pid'])
+            for name, metric in snapshot['metrics'].items():
+                if metric['type'] == "gauge" and not alive:
+                    continue
+                samples = collected.setdefault(
+                    name, dict(metric, samples={})
+                )['samples']
+                for key, value in metric['samples']:
+                    key = tuple(key)
+                    samples[key] = _add_values(samples.get(key), value)
+        return collected
+
+    def expose(self) -> str:
+        """ :return metrics in Prometheus text format """
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {_escape(metric['help'], False)}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labels = metric['labels']
+            for key, value in sorted(metric['samples'].items()):
+                if metric['type'] != "histogram":
+                    lines.append(_format_sample(name, labels, key, value))
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(
+                        metric['buckets'] + [math.inf], counts):
+                    cumulative += bucket_count
+                    lines.append(_format_sample(
+                        f"{name}_bucket", labels + ["le"],
+                        key + (_format_value(bound),), cumulative
+                    ))
+                lines.append(_format_sample(f"{name}_sum", labels, key,
+                                            total))
+                lines.append(_format_sample(f"{name}_count", labels, key,
+                                            count))
+        return "\n".join(lines) + "\n"
+
+
+def _add_values(left: Any, right: Any) -> Any:
+    """ Sums values of samples (histograms are lists) """
+    if left is None:
+        return right
+    if isinstance(left, list):
+        return [[a + b for a, b in zip(left[0], right[0])],
+                left[1] + right[1], left[2] + right[2]]
+    return left + right
+
+
+def _escape(value: str, quoted: bool = True) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace("\"", "\\\"") if quoted else value
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value)
+
+
+def _format_sample(name: str,
+                   labels: List[str],
+                   key: Tuple[str, ...],
+                   value: float) -> str:
+    if not labels:
+        return f"{name} {_format_value(value)}"
+    pairs = ",".join(f"{label}=\"{_escape(label_value)}\""
+                     for label, label_value in zip(labels, key))
+    return f"{name}{{{pairs}}} {_format_value(value)}"
+
+
+def _is_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # process of other user
+        return True
+    return True
+
+
+class GenerationMetrics(object):
+    """
+        Metrics of generation stages fed by engine tracing (collector
+        of engine.utils.trace spans): durations, bytes and cache hits
+        by stages, sizes of archives
+    """
+
+    def __init__(self, registry: Registry, prefix: str = "sysgen") -> NoReturn:
+        self.stage_duration = registry.histogram(
+            f"{prefix}_stage_duration_seconds",
+            "Duration of generation stages", ("stage",)
+        )
+        self.stage_bytes = registry.counter(
+            f"{prefix}_stage_bytes_total",
+            "Bytes loaded or produced by generation stages", ("stage",)
+        )
+        self.stage_cache = registry.counter(
+            f"{prefix}_stage_cache_total",
+            "Cache lookups of generation stages", ("stage", "result")
+        )
+        self.archive_size = registry.histogram(
+            f"{prefix}_archive_size_bytes",
+            "Size of generated archives", buckets=SIZE_BUCKETS
+        )
+
+    def __call__(self, span: trace.Span) -> NoReturn:
+        self.stage_duration.observe(span.duration, stage=span.name)
+        size = span.attrs.get("bytes")
+        if size:
+            self.stage_bytes.inc(size, stage=span.name)
+            if span.name == "archive":
+                self.archive_size.observe(size)
+        if "cache_hit" in span.attrs:
+            self.stage_cache.inc(
+                stage=span.name,
+                result="hit" if span.attrs['cache_hit'] else "miss"
+            )
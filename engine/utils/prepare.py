@@ -1,20 +1,27 @@
 """ Additional methods for preparing engine workflow. """
 
+import hashlib
 import io
 import json
 import logging
 import os
+import pickle
 import shutil
+import stat
 import tarfile
+import tempfile
+import threading
 import zipfile
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import reduce
-from typing import Any, Iterable, NoReturn
+from typing import Any, Dict, Iterable, NoReturn, Tuple
 
 import dill
 import yaml
 
 from engine.constants import PATHS, PROJECT_NAME_PATTERN
+from engine.utils import trace
 
 
 class Archiver(object):
@@ -48,67 +55,142 @@ class Archiver(object):
         logging.warning("Wrong method specified: '%s'", method)
         return -3
 
+    # files larger than this are streamed by writer instead of read-ahead
+    READ_AHEAD_LIMIT = 1 << 20
+
+    @staticmethod
+    def _walk(*paths: Iterable[str]) -> Iterable[Tuple[str, str]]:
+        """
+            Walk over paths with os.scandir (parent dirs go first).
+
+            Yields (path, kind) pairs, where kind is one of
+            'missing', 'dir', 'link' (link to dir) or 'file'.
+        """
+        for path in paths:
+            if not os.path.lexists(path):
+                yield path, "missing"
+                continue
+            if os.path.islink(path) and os.path.isdir(path):
+                yield path, "link"
+                continue
+            if not os.path.isdir(path):
+                yield path, "file"
+                continue
+
+            yield path, "dir"
+            stack = [path]
+            while stack:
+                with os.scandir(stack.pop()) as entries:
+                    entries = sorted(entries, key=lambda x: x.name)
+                subdirs = []
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        yield entry.path, "dir"
+                    elif entry.is_symlink() and entry.is_dir():
+                        yield entry.path, "link"
+                    else:
+                        yield entry.path, "file"
+                stack.extend(reversed(subdirs))
+
+    @staticmethod
+    def _read_ahead(entries: Iterable[Tuple[str, str]],
+                    workers: int = 4,
+                    window: int = 64) -> Iterable[Tuple[str, str, Future]]:
+        """
+            Read files on thread pool keeping order of entries.
+
+            Yields (path, kind, future) where future result is file content
+            or None for large files (they should be streamed by consumer).
+            No more than window entries are read ahead.
+        """
+        def read(path: str) -> bytes or None:
+            with open(path, "rb") as fin:
+                if os.fstat(fin.fileno()).st_size > Archiver.READ_AHEAD_LIMIT:
+                    return None
+                return fin.read()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            queue = deque()
+            for path, kind in entries:
+                future = executor.submit(read, path) if kind == "file" \
+                    else None
+                queue.append((path, kind, future))
+                if len(queue) >= window:
+                    yield queue.popleft()
+            while queue:
+                yield queue.popleft()
+
     @staticmethod
     def _to_zip(path: str,
                 *files: Iterable[str],
-                mode: int = zipfile.ZIP_STORED) -> int:
-        def add_to_archive(filename: str, archive: object) -> bool:
-            logging.debug("Add file '%s' to '%s'", filename, path)
-            try:
-                archive.write(filename)
-            except tarfile.TarError as exc:
-                logging.warning("'%s' wasn't added\n%s", filename, exc)
-                return True
-            return False
-
+                mode: int = zipfile.ZIP_STORED,
+                workers: int = 4) -> int:
         errors_count = 0
+        entries = Archiver._read_ahead(Archiver._walk(*files), workers)
         with zipfile.ZipFile(path, "w", compression=mode) as zf_out:
-            for filename in files:
-                if not os.path.exists(filename):
+            for filename, kind, content in entries:
+                if kind == "missing":
                     logging.debug("File isn't exists: '%s'", filename)
                     errors_count += 1
                     continue
-                if not os.path.isdir(filename):
-                    errors_count += add_to_archive(filename, zf_out)
-                    continue
-                for dirname, subdirs, files in os.walk(filename):
-                    logging.debug("Add dir '%s' to '%s'", dirname, path)
-                    try:
-                        zf_out.write(dirname)
-                        errors_count += reduce(
-                            lambda x, y: x + y,
-                            map(lambda x: add_to_archive(
-                                os.path.join(dirname, x), zf_out
-                            ), files)
-                        )
-                    # [minor] TODO use specific exception
-                    except BaseException as e:
-                        logging.warning("'%s' wasn't added:\n%s", filename, e)
-                        errors_count += 1
+                if kind == "link":
+                    continue  # os.walk doesn't follow links to dirs too
+                logging.debug("Add '%s' to '%s'", filename, path)
+                try:
+                    content = content and content.result()
+                    if content is None:
+                        zf_out.write(filename)
+                    else:
+                        zf_out.writestr(zipfile.ZipInfo.from_file(filename),
+                                        content, compress_type=mode)
+                except (OSError, zipfile.BadZipFile) as e:
+                    logging.warning("'%s' wasn't added\n%s", filename, e)
+                    errors_count += 1
         return errors_count
 
     @staticmethod
-    def _to_tar(path: str, *files: Iterable[str], mode: str = "w") -> int:
-        def add_to_archive(filename: str, archive: object) -> bool:
-            if not os.path.exists(filename):
-                logging.warning("File isn't exists: '%s'", filename)
-                return True
-            logging.debug("Add file '%s' to '%s'", filename, path)
-            try:
-                archive.add(filename)
-            except tarfile.TarError as e:
-                logging.debug("'%s' wasn't added:\n%s", filename, e)
-                return True
-            return False
-
-        added_count = 0
+    def _to_tar(path: str,
+                *files: Iterable[str],
+                mode: str = "w",
+                workers: int = 4) -> int:
+        errors_count = 0
+        entries = Archiver._read_ahead(Archiver._walk(*files), workers)
         with tarfile.open(path, mode) as tar_fout:
-            return reduce(lambda x, y: x + y,
-                          map(lambda x: add_to_archive(x, tar_fout), files))
+            for filename, kind, content in entries:
+                if kind == "missing":
+                    logging.warning("File isn't exists: '%s'", filename)
+                    errors_count += 1
+                    continue
+                logging.debug("Add '%s' to '%s'", filename, path)
+                try:
+                    tarinfo = tar_fout.gettarinfo(filename)
+                    if not tarinfo.isreg():
+                        tar_fout.addfile(tarinfo)
+                        continue
+                    content = content.result()
+                    if content is None:
+                        with open(filename, "rb") as fin:
+                            tar_fout.addfile(tarinfo, fin)
+                    else:
+                        tarinfo.size = len(content)
+                        tar_fout.addfile(tarinfo, io.BytesIO(content))
+                except (OSError, tarfile.TarError) as e:
+                    logging.debug("'%s' wasn't added:\n%s", filename, e)
+                    errors_count += 1
+        return errors_count
 
     @staticmethod
     def get_tar_io(files: dict) -> io.BytesIO:
         """ Returns tar file I/O """
+        with trace.span("archive", files=len(files)) as span:
+            tar_io = Archiver._get_tar_io(files)
+            if span:
+                span.set(bytes=tar_io.tell())
+            return tar_io
+
+    @staticmethod
+    def _get_tar_io(files: dict) -> io.BytesIO:
         logging.debug("Create tar I/O")
         with tarfile.open(fileobj=io.BytesIO(), mode="w") as tar_fout:
             for filename, file_line in files.items():
@@ -123,11 +205,9 @@ class Archiver(object):
                         continue
                     logging.debug("Add file '%s' to tar I/O", filename)
                     tarinfo = tarfile.TarInfo(filename)
-                    tarinfo.size = io.StringIO().write(file_line)
-                    tar_fout.addfile(
-                        tarinfo,
-                        fileobj=io.BytesIO(file_line.encode("utf-8"))
-                    )
+                    content = file_line.encode("utf-8")
+                    tarinfo.size = len(content)  # in bytes, not in chars
+                    tar_fout.addfile(tarinfo, fileobj=io.BytesIO(content))
                 except tarfile.TarError as e:
                     logging.warning("'%s' wasn't added:\n%s", filename, e)
             return tar_fout.fileobj
@@ -190,18 +270,116 @@ class Archiver(object):
 
         return Archiver._archive(*filenames, **params)
 
-    # [minor] TODO implement extraction
-    # NOTE this function signature refer to public method
-    #      but was hidden until method will be finished
     @staticmethod
-    def _extract(path: str, destination: str = ".", **kwargs) -> int:
+    def _iter_members(archive: io.IOBase) -> Iterable[tuple]:
+        """
+            Iterate over archive members in stored order.
+
+            Yields (name, kind, size, open_member) tuples, where kind is
+            one of 'file', 'dir' or 'other' (links, devices, etc.).
+            Member content should be read before next iteration.
+        """
+        if zipfile.is_zipfile(archive):
+            archive.seek(0)
+            with zipfile.ZipFile(archive) as zf_in:
+                for info in zf_in.infolist():
+                    kind = "file"
+                    if info.is_dir():
+                        kind = "dir"
+                    elif stat.S_ISLNK(info.external_attr >> 16):
+                        kind = "other"
+                    yield (info.filename, kind, info.file_size,
+                           lambda info=info: zf_in.open(info))
+            return
+
+        archive.seek(0)
+        with tarfile.open(fileobj=archive, mode="r|*") as tar_in:
+            for member in tar_in:
+                kind = "other"
+                if member.isfile():
+                    kind = "file"
+                elif member.isdir():
+                    kind = "dir"
+                yield (member.name, kind, member.size,
+                       lambda member=member: tar_in.extractfile(member))
+
+    @staticmethod
+    def _safe_path(root: str, name: str) -> str or None:
+        """ Returns member path inside root or None if it's outside """
+        if not name or os.path.isabs(name) or os.path.splitdrive(name)[0]:
+            return None
+        path = os.path.realpath(os.path.join(root, name))
+        if os.path.commonpath((root, path)) != root:
+            return None
+        return path
+
+    @staticmethod
+    def extract(source: str or io.IOBase,
+                destination: str = ".",
+                workers: int = 4,
+                chunk_size: int = 1 << 20) -> Dict[str, int]:
         """
-            Extracs files from archive.
+            Extracts files from tar (plain, gzip, bzip2, lzma) or zip archive.
 
-            :return number of extracted files.
+            Archive is read as a stream, small files are written
+            in parallel while larger than chunk_size are copied by chunks,
+            so no more than (2 * workers + 1) * chunk_size bytes are held
+            in memory. Members with absolute paths, paths outside
+            destination, links and special files are skipped.
+
+            :param source: path to archive or seekable file object
+            :return number of written bytes per extracted file
         """
-        method, compression = path.lower().split('.')[-2:]
-        raise NotImplementedError
+        if isinstance(source, str):
+            with open(source, "rb") as fin:
+                return Archiver.extract(fin, destination, workers, chunk_size)
+
+        root = os.path.realpath(destination)
+        os.makedirs(root, exist_ok=True)
+        stats = {}
+        futures = {}
+        slots = threading.BoundedSemaphore(2 * workers)
+
+        def write(path: str, data: bytes) -> int:
+            try:
+                with open(path, "wb") as fout:
+                    return fout.write(data)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for name, kind, size, open_member in \
+                        Archiver._iter_members(source):
+                    path = Archiver._safe_path(root, name)
+                    if path is None or kind == "other":
+                        logging.warning("Skip unsafe member '%s'", name)
+                        continue
+                    if kind == "dir":
+                        os.makedirs(path, exist_ok=True)
+                        continue
+
+                    logging.debug("Extract '%s' to '%s'", name, path)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open_member() as member:
+                        if size > chunk_size:
+                            with open(path, "wb") as fout:
+                                shutil.copyfileobj(member, fout, chunk_size)
+                            stats[name] = size
+                            continue
+                        data = member.read()
+                    slots.acquire()
+                    futures[name] = executor.submit(write, path, data)
+            except (tarfile.TarError, zipfile.BadZipFile, OSError) as e:
+                logging.warning("Archive wasn't fully extracted:\n%s", e)
+
+        for name, future in futures.items():
+            try:
+                stats[name] = future.result()
+            except OSError as e:
+                logging.warning("'%s' wasn't extracted:\n%s", name, e)
+        logging.info("%d files extracted to '%s'", len(stats), destination)
+        return stats
 
 
 class Loader(object):
@@ -218,6 +396,8 @@ class Loader(object):
         json=json.dump,
         bin=dill.dump
     )
+    _configs = {}  # parsed configs by path: (mtime, size, pickled content)
+    _configs_lock = threading.Lock()
 
     @staticmethod
     def load(filepath: str,
@@ -243,12 +423,40 @@ class Loader(object):
                         break
 
         logging.debug("Loading '%s' content", filepath)
-        with open(filepath, "rb", **kwargs) as fin:
+        with trace.span("load", path=filepath) as span, \
+                open(filepath, "rb", **kwargs) as fin:
+            if span:
+                span.set(bytes=os.fstat(fin.fileno()).st_size)
             if fmt is None:
                 logging.debug("Read %s as plain text", filepath)
                 return fin.read()  # read plain text
             return Loader.LOADERS[fmt](fin, **(loader_params or {}))
 
+    @staticmethod
+    def load_config(filepath: str) -> Any:
+        """
+            Loads parsed config (e.g. board's yml), parsed content is
+            cached until file is changed and every call returns its copy
+            (so it may be modified by caller)
+        """
+        try:
+            file_stat = os.stat(filepath)
+        except OSError:  # path without extension, format will be detected
+            return Loader.load(filepath)
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+        with trace.span("load_config", path=filepath) as span:
+            with Loader._configs_lock:
+                cached = Loader._configs.get(filepath)
+            cache_hit = cached is not None and cached[0] == version
+            if not cache_hit:
+                cached = (version, pickle.dumps(Loader.load(filepath),
+                                                pickle.HIGHEST_PROTOCOL))
+                with Loader._configs_lock:
+                    Loader._configs[filepath] = cached
+            if span:
+                span.set(bytes=file_stat.st_size, cache_hit=cache_hit)
+            return pickle.loads(cached[1])
+
     @staticmethod
     def load_static(path: str,
                     path_to_static: str = None,
@@ -335,3 +543,138 @@ def create_dirs(*paths: Iterable[str], rewrite: bool = False) -> int:
 
 def validate_project_name(name: str) -> bool:
     return PROJECT_NAME_PATTERN.match(name)
+
+
+def get_digest(content: str or bytes, encoding: str = "utf-8") -> str:
+    """ Returns hex digest of file content """
+    if isinstance(content, str):
+        content = content.encode(encoding)
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_project_digest(digests: Dict[str, str]) -> str:
+    """ Returns digest of project by digests of its files """
+    return get_digest(json.dumps(digests, sort_keys=True))
+
+
+def get_static_digest(*paths: Iterable[str]) -> str:
+    """
+        Returns digest of static files (boards configs, mips sources
+        and templates by default), which define generated projects.
+    """
+    digests = {}
+    for root in paths or (PATHS.STATIC, PATHS.TEMPL):
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                with open(path, "rb") as fin:
+                    name = os.path.relpath(path, os.path.dirname(root))
+                    digests[name] = get_digest(fin.read())
+    return get_project_digest(digests)
+
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    """
+        Loads manifest of previously dumped project.
+
+        :return mapping of file names to their 'digest', 'size'
+            and 'mtime_ns' or empty dict if manifest isn't found.
+    """
+    try:
+        with open(path, "r") as fin:
+            return json.load(fin).get("files", {})
+    except (OSError, ValueError, AttributeError) as e:
+        logging.debug("Can't load manifest '%s':\n%s", path, e)
+    return {}
+
+
+def save_manifest(path: str, files: Dict[str, dict]) -> NoReturn:
+    """ Atomically saves manifest of dumped project """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    with os.fdopen(fd, "w") as fout:
+        json.dump({'files': files}, fout, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+    logging.debug("Manifest saved to '%s'", path)
+
+
+def stat_record(path: str, digest: str) -> dict:
+    """ Returns manifest record for existing file """
+    file_stat = os.stat(path)
+    return {
+        'digest': digest,
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns
+    }
+
+
+def is_file_actual(path: str, digest: str, record: dict = None) -> bool:
+    """
+        Checks whether file content has specified digest.
+
+        File isn't read if its manifest record matches file stats.
+    """
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return False
+    if record and file_stat.st_size == record.get("size") and \
+            file_stat.st_mtime_ns == record.get("mtime_ns"):
+        return record.get("digest") == digest
+    with open(path, "rb") as fin:
+        return get_digest(fin.read()) == digest
+
+
+def cache_static(content: bytes,
+                 digest: str,
+                 cache_dir: str = PATHS.CACHE) -> str:
+    """ Puts static content to local asset cache, returns cached path """
+    dirname = os.path.join(cache_dir, digest[:2])
+    path = os.path.join(dirname, digest)
+    # NOTE hard linked copy might be edited in place, so verify content
+    if is_file_actual(path, digest):
+        return path
+
+    logging.debug("Add '%s' to asset cache", digest)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname)
+    with os.fdopen(fd, "wb") as fout:
+        fout.write(content)
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, path)
+    return path
+
+
+def link_file(source: str, destination: str, hardlink: bool = False) -> str:
+    """
+        Places copy of source file to destination.
+
+        Uses hard link (if allowed), in-kernel copy (reflink on
+        supported file systems) or plain copy as the last resort.
+
+        :return used method
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)  # never write through shared inode
+
+    if hardlink:
+        try:
+            os.link(source, destination)
+            return "link"
+        except OSError as e:
+            logging.debug("Can't link '%s':\n%s", destination, e)
+
+    with open(source, "rb") as fin, open(destination, "wb") as fout:
+        size = os.fstat(fin.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(fin.fileno(), fout.fileno(), size)
+                if not copied:
+                    break
+                size -= copied
+        except (AttributeError, OSError) as e:
+            logging.debug("Fallback to plain copy for '%s':\n%s",
+                          destination, e)
+            shutil.copyfileobj(fin, fout)
+            return "copy"
+    return "copy_file_range"
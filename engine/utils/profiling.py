@@ -0,0 +1,225 @@
+"""
+    On-demand profiling by sampling of stacks: background thread takes
+    stack of profiled thread every interval, so several requests may be
+    profiled at once and requests without profiling aren't slowed down.
+    Profiles are saved as collapsed stacks ('caller;function count'
+    lines, input of flamegraph.pl, speedscope or inferno) with json
+    metadata in directory shared by workers.
+
+    Usage:
+        profiler = Profiler(path)
+        with profiler.profile(board="de1soc") as sampler:
+            Board("de1soc").setup("lab1").generate()
+        profiler.list()  # [{'id': sampler.profile_id, 'samples': ...}]
+"""
+
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from types import FrameType
+from typing import Any, Dict, Iterator, List, NoReturn
+
+from engine.constants import PATHS
+
+
+# NOTE id starts with time, so names of files are sorted by time
+PROFILE_ID_PATTERN = re.compile(r"^\d{8}T\d{6}\.\d{6}-\d+-[0-9a-f]{8}$")
+STACKS_EXT = ".collapsed"
+META_EXT = ".json"
+
+# longest first, so paths are shortened by the closest root
+_ROOTS = sorted({os.path.abspath(path) for path in sys.path + [PATHS.BASE]
+                 if path}, key=len, reverse=True)
+
+
+@lru_cache(maxsize=4096)
+def _short_path(filename: str) -> str:
+    for root in _ROOTS:
+        if filename.startswith(root + os.sep):
+            return filename[len(root) + 1:]
+    return filename
+
+
+def collapse(frame: FrameType) -> str:
+    """ :return stack of frame as 'root;...;function (file:line)' """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} "
+                     f"({_short_path(code.co_filename)}:{code.co_firstlineno})"
+                     .replace(";", ":"))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Sampler(object):
+    """
+        Samples stack of thread (current one by default) every interval
+        seconds until it's stopped, stacks are counted by collapsed ones
+    """
+
+    def __init__(self,
+                 thread_id: int = None,
+                 interval: float = 0.002) -> NoReturn:
+        self.thread_id = thread_id if thread_id is not None else \
+            threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.started = None  # unix time
+        self.duration = None
+        self.profile_id = None  # set when profile is saved
+        self._start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+    def start(self) -> object:
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="profile-sampler")
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        if self.duration is None:
+            self._stop.set()
+            self._thread.join()
+            self.duration = time.perf_counter() - self._start
+        return self.stacks
+
+    def _run(self) -> NoReturn:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:  # NOTE thread is finished
+                return
+            self.stacks[collapse(frame)] += 1
+            del frame
+
+
+class Profiler(object):
+    """
+        Profiles code on demand and keeps recent profiles in directory.
+
+        :param path: directory of profiles (may be shared by processes)
+        :param sample_rate: fraction of requests profiled without token
+        :param token: secret, which enables profiling of request and
+            access to profiles (disabled if it's None)
+        :param interval: seconds between samples of stack
+        :param max_profiles: number of kept profiles, older are removed
+    """
+
+    def __init__(self,
+                 path: str = PATHS.PROFILES,
+                 sample_rate: float = 0.0,
+                 token: str = None,
+                 interval: float = 0.002,
+                 max_profiles: int = 100) -> NoReturn:
+        self.path = path
+        self.sample_rate = sample_rate
+        self.token = token
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self._random = random.Random()
+        os.makedirs(path, exist_ok=True)
+
+    def is_authorized(self, token: str or None) -> bool:
+        if not self.token or not token:
+            return False
+        return hmac.compare_digest(token.encode(), self.token.encode())
+
+    def is_sampled(self) -> bool:
+        return self.sample_rate > 0 and \
+            self._random.random() < self.sample_rate
+
+    def start(self) -> Sampler:
+        """ Starts sampling of current thread """
+        return Sampler(interval=self.interval).start()
+
+    def save(self, sampler: Sampler, **meta) -> str:
+        """ Saves stopped sampler with metadata, :return id of profile """
+        started = datetime.fromtimestamp(sampler.started, timezone.utc)
+        profile_id = f"{started:%Y%m%dT%H%M%S.%f}-{os.getpid()}-" \
+                     f"{uuid.uuid4().hex[:8]}"
+        self._write(f"{profile_id}{STACKS_EXT}",
+                    "".join(f"{stack} {count}\n" for stack, count
+                            in sampler.stacks.most_common()))
+        # NOTE metadata is written last, profile is listed when it's ready
+        self._write(f"{profile_id}{META_EXT}", json.dumps(dict(
+            meta,
+            id=profile_id,
+            date=started.isoformat(timespec="milliseconds"),
+            duration=sampler.duration,
+            samples=sampler.samples,
+            interval=sampler.interval
+        )))
+        sampler.profile_id = profile_id
+        self._prune()
+        return profile_id
+
+    @contextmanager
+    def profile(self, **meta) -> Iterator[Sampler]:
+        """ Profiles code inside of context, saves profile on exit """
+        sampler = self.start()
+        try:
+            yield sampler
+        finally:
+            sampler.stop()
+            self.save(sampler, **meta)
+
+    def _write(self, filename: str, content: str) -> NoReturn:
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as fout:
+            fout.write(content)
+        os.replace(tmp_path, os.path.join(self.path, filename))
+
+    def _profile_ids(self) -> List[str]:
+        """ :return ids of saved profiles, oldest first """
+        return sorted(name[:-len(META_EXT)] for name in os.listdir(self.path)
+                      if name.endswith(META_EXT))
+
+    def _prune(self) -> NoReturn:
+        ids = self._profile_ids()
+        for profile_id in ids[:max(len(ids) - self.max_profiles, 0)]:
+            for ext in (META_EXT, STACKS_EXT):
+                try:
+                    os.remove(os.path.join(self.path, f"{profile_id}{ext}"))
+                except FileNotFoundError:  # NOTE removed by other process
+                    pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        """ :return metadata of saved profiles, newest first """
+        profiles = []
+        for profile_id in reversed(self._profile_ids()):
+            try:
+                with open(os.path.join(self.path,
+                                       f"{profile_id}{META_EXT}")) as fin:
+                    profiles.append(json.load(fin))
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError) as e:
+                logging.warning("Profile '%s' isn't loaded: %s",
+                                profile_id, e)
+        return profiles
+
+    def get_path(self, profile_id: str) -> str or None:
+        """ :return path of collapsed stacks of profile (if it exists) """
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.path, f"{profile_id}{STACKS_EXT}")
+        return path if os.path.exists(path) else None
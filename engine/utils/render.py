@@ -1,6 +1,7 @@
 """ Rendering interface """
 
 import logging
+import os
 from datetime import datetime
 from functools import wraps
 from typing import Any, Callable
@@ -9,6 +10,7 @@ from jinja2 import Environment, FileSystemLoader, select_autoescape
 from jinja2.environment import Environment, Template
 
 from engine.constants import PATHS
+from engine.utils import trace
 from engine.utils.misc import none_safe, quote
 
 
@@ -23,6 +25,12 @@ ENV = Environment(
 )
 
 
+def get_template(name: str) -> Template:
+    """ Loads template (it's compiled only on first load) """
+    with trace.span("template", template=name):
+        return ENV.get_template(name)
+
+
 def load_template(path: str, file_type: str = None) -> Callable:
     """
         Load template and pass it as named argument 'template' to function
@@ -37,7 +45,7 @@ def load_template(path: str, file_type: str = None) -> Callable:
             logging.debug("Loading template '%s'...", path)
             return func(
                 *args,
-                template=ENV.get_template(path),
+                template=get_template(path),
                 file_type=file_type or func.__name__,
                 **kwargs
             )
@@ -51,7 +59,11 @@ class Render(object):
     @staticmethod
     def _render(template: Template, **kwargs) -> str:
         logging.debug("Rendering '%s' template...", template.filename)
-        return "\n".join(template.generate(**kwargs))
+        with trace.span("render", template=template.name) as span:
+            rendered = "\n".join(template.generate(**kwargs))
+            if span:
+                span.set(bytes=len(rendered.encode("utf-8")))
+            return rendered
 
     @staticmethod
     def format_date(date_t: datetime = None,
@@ -61,7 +73,14 @@ class Render(object):
             Return date in Quartus compatible format
 
             E.g. "12:40:01 DECEMBER 27,2017"
+
+            Uses SOURCE_DATE_EPOCH environment variable (if it's set)
+            as default date to make generated projects reproducible.
         """
+        if date_t is None and os.environ.get("SOURCE_DATE_EPOCH"):
+            date_t = datetime.utcfromtimestamp(
+                int(os.environ['SOURCE_DATE_EPOCH'])
+            )
         if date_t is None:
             date_t = datetime.utcnow()
         date_f = "{:%H:%M:%S %B %d,%Y}"
@@ -77,15 +96,16 @@ class Render(object):
             quartus_version: str,
             meta_info: dict = None,
             revisions: dict = None,
+            date_t: datetime = None,
             **kwargs) -> str:
         """ Template rendering interface for .qpf files """
-        meta_info = meta_info or {}
-        meta_info.update({
-            'date': Render.format_date(quoted=False, sep=True),
-            'quartus_version': quartus_version
-        })
-        revisions = revisions or {}
-        revisions.update({'project_revision': project_name})
+        # NOTE new dicts, arguments are shared with caller
+        meta_info = dict(
+            meta_info or {},
+            date=Render.format_date(date_t, quoted=False, sep=True),
+            quartus_version=quartus_version
+        )
+        revisions = dict(revisions or {}, project_revision=project_name)
         return Render._render(
             project_name=project_name,
             meta_info=meta_info,
@@ -105,12 +125,13 @@ class Render(object):
             user_assignments: dict = None,
             global_assignments: dict = None,
             mips: dict = None,
+            date_t: datetime = None,
             **kwargs) -> str:
         """ Template rendering interface for .qsf files """
-        global_assignments = global_assignments or {}
         project_output_directory = project_output_directory or "project_output"
+        global_assignments = dict(global_assignments or {})  # NOTE copy
         global_assignments.update({
-            'project_creation_time_date': Render.format_date().upper(),
+            'project_creation_time_date': Render.format_date(date_t).upper(),
             'family': quote(family),
             'device': device,
             'original_quartus_version': quote(original_quartus_version),
@@ -173,7 +194,7 @@ class Render(object):
         """ Template rendering interface for additional functions """
         name = (name + "." + fmt) if fmt else name
         return none_safe()(Render._render)(
-            template=ENV.get_template(name),
+            template=get_template(name),
             clock_rate=clock_rate or clock_freq,
             clock_freq=clock_rate or clock_freq,
             delay=delay,
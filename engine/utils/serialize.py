@@ -0,0 +1,124 @@
+""" Serialization of generated files for API responses. """
+
+import fnmatch
+import json
+import zlib
+from typing import Dict, Iterable, List, Tuple
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+MSGPACK = "application/msgpack"
+
+
+def get_formats() -> List[str]:
+    """ Supported media types (the first one is default) """
+    return [JSON, NDJSON] + ([MSGPACK] if msgpack is not None else [])
+
+
+def get_encodings() -> List[str]:
+    """ Supported content encodings in order of preference """
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def parse_accept(header: str) -> List[Tuple[str, float]]:
+    """ Returns values of Accept-like header ordered by quality """
+    values = []
+    for item in header.split(","):
+        value, *params = (part.strip() for part in item.split(";"))
+        if not value:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, number = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        values.append((value.lower(), quality))
+    return sorted(values, key=lambda value: -value[1])
+
+
+def best_match(header: str or None, offers: List[str]) -> str or None:
+    """
+        Returns the most preferred offer for Accept-like header
+        (the first offer if header is empty) or None if nothing fits.
+    """
+    if not header:
+        return offers[0]
+    for value, quality in parse_accept(header):
+        if quality <= 0:
+            continue
+        for offer in offers:
+            if value in (offer, "*", "*/*") or \
+                    value.endswith("/*") and offer.startswith(value[:-1]):
+                return offer
+    return None
+
+
+def get_encoding(header: str or None) -> str or None:
+    """ Returns content encoding for Accept-Encoding or None (identity) """
+    encoding = best_match(header or "identity",
+                          ["identity"] + get_encodings())
+    return None if encoding == "identity" else encoding
+
+
+def select_files(files: Dict[str, str],
+                 fields: str or None) -> Dict[str, str]:
+    """
+        Returns files selected by comma separated names or shell
+        patterns (e.g. "*.qsf,mips/*"), all files if fields are empty.
+    """
+    patterns = [field.strip() for field in (fields or "").split(",")
+                if field.strip()]
+    if not patterns:
+        return files
+    return {name: content for name, content in files.items()
+            if any(fnmatch.fnmatchcase(name, pattern)
+                   for pattern in patterns)}
+
+
+def serialize(files: Dict[str, str], media_type: str) -> Iterable[bytes]:
+    """
+        Yields serialized files: json object, NDJSON lines
+        ({"name": ..., "content": ...} per file) or MessagePack map.
+    """
+    if media_type == NDJSON:
+        for name, content in files.items():
+            yield json.dumps({'name': name, 'content': content},
+                             separators=(",", ":")).encode() + b"\n"
+    elif media_type == MSGPACK:
+        yield msgpack.packb(files, use_bin_type=True)
+    else:
+        yield json.dumps(files, separators=(",", ":")).encode()
+
+
+def compress(chunks: Iterable[bytes],
+             encoding: str or None) -> Iterable[bytes]:
+    """ Yields chunks compressed on the fly (as is if encoding is None) """
+    if encoding is None:
+        yield from chunks
+        return
+
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compress_chunk, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        chunk = compress_chunk(chunk)
+        if chunk:
+            yield chunk
+    yield finish()
@@ -0,0 +1,231 @@
+""" Content-addressed on-disk store of generated artifacts. """
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Generator, NoReturn, Tuple
+
+from engine.constants import PATHS
+from engine.utils.prepare import get_digest
+
+try:
+    import fcntl
+except ImportError:  # not a POSIX system
+    fcntl = None
+
+
+class ArtifactStore(object):
+    """
+        Store of generated archives shared between processes.
+
+        Objects are saved atomically by their content digest, index
+        (sizes, access times, metadata and keys aliases) is kept
+        in SQLite database, so store survives restarts.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS artifacts ("
+        "digest TEXT PRIMARY KEY, size INTEGER, meta TEXT, "
+        "created REAL, accessed REAL)",
+        "CREATE TABLE IF NOT EXISTS aliases ("
+        "key TEXT PRIMARY KEY, digest TEXT)",
+        "CREATE INDEX IF NOT EXISTS artifacts_accessed "
+        "ON artifacts (accessed)"
+    )
+
+    def __init__(self,
+                 root: str = PATHS.STORE,
+                 max_bytes: int = 1 << 30,
+                 ttl: float = 7 * 24 * 3600) -> NoReturn:
+        """
+            :param root: store folder
+            :param max_bytes: max total size of stored objects
+            :param ttl: lifetime (seconds) of not accessed objects
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self._index = os.path.join(root, "index.sqlite")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    @contextmanager
+    def _connect(self) -> Generator:
+        """ Yields connection in transaction (one per operation) """
+        conn = sqlite3.connect(self._index, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def lock(self, key: str) -> Generator:
+        """
+            Exclusive lock for key shared between processes.
+
+            Keys are mapped to 256 lock files, so unrelated keys might
+            rarely wait for each other.
+        """
+        if fcntl is None:
+            logging.debug("Inter-process locks aren't supported")
+            yield
+            return
+        path = os.path.join(self.root, "locks", get_digest(key)[:2] + ".lock")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def path(self, digest: str) -> str:
+        """ Path of object (object might be missing) """
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, content: bytes, key: str = None, meta: dict = None) -> str:
+        """
+            Saves content to store.
+
+            :param key: alias (e.g. config fingerprint) to find object
+            :param meta: json serializable metadata
+            :return content digest
+        """
+        digest = get_digest(content)
+        path = self.path(digest)
+        if not os.path.exists(path):
+            logging.debug("Add '%s' to artifact store", digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+            with os.fdopen(fd, "wb") as fout:
+                fout.write(content)
+            os.replace(tmp_path, path)
+
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                (digest, len(content), json.dumps(meta or {}), now, now)
+            )
+            if key is not None:
+                conn.execute("INSERT OR REPLACE INTO aliases VALUES (?, ?)",
+                             (key, digest))
+        self.evict()
+        return digest
+
+    def lookup(self, key: str) -> str or None:
+        """ :return digest of object by its alias """
+        with self._connect() as conn:
+            row = conn.execute("SELECT digest FROM aliases WHERE key = ?",
+                               (key,)).fetchone()
+        return row[0] if row else None
+
+    def _access(self, query: str, param: str) -> Tuple[str, dict] or None:
+        """
+            Selects digest, metadata and access time of object by query
+            and updates access time (in one transaction).
+
+            :return digest and metadata or None if object isn't stored
+        """
+        with self._connect() as conn:
+            row = conn.execute(query, (param,)).fetchone()
+            if row is None or row[2] < time.time() - self.ttl:
+                return None
+            conn.execute("UPDATE artifacts SET accessed = ? WHERE digest = ?",
+                         (time.time(), row[0]))
+        return row[0], json.loads(row[1])
+
+    def _read(self, digest: str) -> bytes or None:
+        try:
+            with open(self.path(digest), "rb") as fin:
+                return fin.read()
+        except OSError as e:
+            logging.warning("Artifact '%s' is missed:\n%s", digest, e)
+            return None
+
+    def meta(self, digest: str) -> dict or None:
+        """ :return object metadata or None if object isn't stored """
+        found = self._access("SELECT digest, meta, accessed FROM artifacts "
+                             "WHERE digest = ?", digest)
+        return found and found[1]
+
+    def get(self, digest: str) -> bytes or None:
+        """ :return object content or None if object isn't stored """
+        return self.get_with_meta(digest)[0]
+
+    def get_with_meta(self,
+                      digest: str) -> Tuple[bytes or None, dict or None]:
+        """ :return object content and metadata (None if it isn't stored) """
+        meta = self.meta(digest)
+        content = self._read(digest) if meta is not None else None
+        return (content, meta) if content is not None else (None, None)
+
+    def get_by_key(self, key: str) -> Tuple[str, bytes, dict] or None:
+        """
+            Cheaper variant of lookup, meta and get calls (single read
+            of database).
+
+            :return digest, content and metadata of object by its alias
+                or None if object isn't stored
+        """
+        found = self._access(
+            "SELECT artifacts.digest, meta, accessed FROM aliases "
+            "JOIN artifacts ON artifacts.digest = aliases.digest "
+            "WHERE key = ?", key
+        )
+        content = found and self._read(found[0])
+        return (found[0], content, found[1]) if content is not None else None
+
+    def evict(self) -> int:
+        """
+            Removes expired and least recently used objects
+            to fit max_bytes limit.
+
+            :return number of removed objects
+        """
+        with self._connect() as conn:
+            expired = [row[0] for row in conn.execute(
+                "SELECT digest FROM artifacts WHERE accessed < ?",
+                (time.time() - self.ttl,)
+            )]
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM artifacts "
+                "WHERE accessed >= ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                for digest, size in conn.execute(
+                    "SELECT digest, size FROM artifacts WHERE accessed >= ? "
+                    "ORDER BY accessed", (time.time() - self.ttl,)
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    expired.append(digest)
+                    total -= size
+            conn.executemany("DELETE FROM artifacts WHERE digest = ?",
+                             ((digest,) for digest in expired))
+            conn.executemany("DELETE FROM aliases WHERE digest = ?",
+                             ((digest,) for digest in expired))
+
+        for digest in expired:
+            logging.debug("Evict '%s' from artifact store", digest)
+            try:
+                os.remove(self.path(digest))
+            except OSError as e:
+                logging.debug("Can't remove '%s':\n%s", digest, e)
+        return len(expired)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            items, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts"
+            ).fetchone()
+        return {'items': items, 'bytes': size, 'max_bytes': self.max_bytes}
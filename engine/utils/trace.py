@@ -0,0 +1,184 @@
+"""
+    Tracing of generation stages: named spans with durations, byte counts
+    and cache hits delivered to pluggable collectors.
+
+    Usage:
+        recorder = Recorder()
+        with collect(recorder):
+            Board("de1soc").setup("lab1").generate()
+        recorder.summary()  # {'render': {'count': 5, 'duration': ...}, ...}
+
+    Without collectors span() returns shared no-op span, so tracing costs
+    one context variable lookup per stage.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, NoReturn
+
+# NOTE collectors are called with finished span (children before parents)
+# in thread of traced code, they should be fast and thread-safe
+Collector = Callable[["Span"], Any]
+
+_collectors = ()  # process wide collectors
+_local_collectors = ContextVar("trace_collectors", default=())
+_current = ContextVar("trace_span", default=None)
+
+
+class Span(object):
+    """
+        Stage of generation: name (e.g. 'render'), attributes (e.g. file,
+        bytes, cache_hit), parent span, start (perf_counter) and duration
+        in seconds
+    """
+
+    __slots__ = ("name", "attrs", "parent", "start", "duration",
+                 "_collectors", "_token")
+
+    def __init__(self,
+                 name: str,
+                 attrs: Dict[str, Any],
+                 collectors: tuple) -> NoReturn:
+        self.name = name
+        self.attrs = attrs
+        self.parent = None
+        self.start = None
+        self.duration = None
+        self._collectors = collectors
+        self._token = None
+
+    def set(self, **attrs) -> NoReturn:
+        self.attrs.update(attrs)
+
+    @property
+    def full_name(self) -> str:
+        """ Names of parents and span, e.g. 'generate/file/render' """
+        span, names = self, []
+        while span is not None:
+            names.append(span.name)
+            span = span.parent
+        return "/".join(reversed(names))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self.attrs, name=self.name, full_name=self.full_name,
+                    duration=self.duration)
+
+    def __enter__(self) -> object:
+        self.parent = _current.get()
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: type, *args) -> bool:
+        self.duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:  # NOTE tracing doesn't break generation
+                logging.error("Trace collector failed with exception: %s", e)
+        return False
+
+    def __repr__(self) -> str:
+        return f"Span({self.full_name!r}, {self.duration}, {self.attrs})"
+
+
+class _NoSpan(object):
+    """ Span of disabled tracing (it's false, so attributes can be skipped) """
+
+    __slots__ = ()
+
+    def set(self, **attrs) -> NoReturn:
+        pass
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __enter__(self) -> object:
+        return self
+
+    def __exit__(self, *args) -> bool:
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name: str, **attrs) -> Span or _NoSpan:
+    """
+        Returns context manager of traced stage, attributes which are
+        expensive to compute should be set only if span is true:
+
+            with span("archive") as sp:
+                data = ...
+                if sp:
+                    sp.set(bytes=len(data))
+    """
+    local_collectors = _local_collectors.get()
+    if not (_collectors or local_collectors):
+        return NO_SPAN
+    return Span(name, attrs, _collectors + local_collectors)
+
+
+def is_enabled() -> bool:
+    return bool(_collectors or _local_collectors.get())
+
+
+def add_collector(collector: Collector) -> NoReturn:
+    """ Adds collector for spans of all threads """
+    global _collectors
+    _collectors = _collectors + (collector,)
+
+
+def remove_collector(collector: Collector) -> NoReturn:
+    global _collectors
+    _collectors = tuple(c for c in _collectors if c is not collector)
+
+
+@contextmanager
+def collect(collector: Collector) -> Iterator[Collector]:
+    """
+        Delivers spans of current thread (or asyncio task) to collector
+        inside of context, e.g. to attribute latency of single request
+    """
+    token = _local_collectors.set(_local_collectors.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _local_collectors.reset(token)
+
+
+class Recorder(object):
+    """ Collector which keeps finished spans """
+
+    def __init__(self) -> NoReturn:
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span) -> NoReturn:
+        with self._lock:
+            self.spans.append(span)
+
+    def find(self, name: str) -> List[Span]:
+        return [span for span in self.spans if span.name == name]
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+            :return count, total duration (seconds), bytes and cache hits
+                of spans by names
+        """
+        summary = {}
+        for span in self.spans:
+            stats = summary.setdefault(span.name, {
+                'count': 0, 'duration': 0.0, 'bytes': 0, 'hits': 0
+            })
+            stats['count'] += 1
+            stats['duration'] += span.duration
+            stats['bytes'] += span.attrs.get("bytes") or 0
+            stats['hits'] += bool(span.attrs.get("cache_hit"))
+        return summary
@@ -0,0 +1,157 @@
+import time
+from typing import Callable, Iterable, NoReturn
+
+from flask import (Flask, Response, abort, current_app, g, jsonify,
+                   make_response, request, send_file, url_for)
+
+from engine import Admission
+from engine.utils import trace
+from engine.utils.metrics import CONTENT_TYPE, GenerationMetrics, Registry
+from engine.utils.profiling import STACKS_EXT, Profiler
+
+
+def get_route() -> str:
+    """ :return route pattern of request (not path, to limit label values) """
+    return request.url_rule.rule if request.url_rule else "unknown"
+
+
+def init_metrics(app: Flask,
+                 name: str,
+                 admission: Admission) -> Registry:
+    """
+        Creates registry of metrics of Flask client (shared by workers
+        through METRICS_PATH): duration of requests, generations and
+        stages of engine. Adds /metrics route and hooks of requests.
+
+        :param name: name of client, prefix of files of registry
+        :param admission: admission control of generations
+    """
+    registry = Registry(name, app.config['METRICS_PATH'])
+    request_duration = registry.histogram(
+        "sysgen_http_request_duration_seconds",
+        "Duration of requests (until response is started)",
+        ("route", "method", "status")
+    )
+    registry.gauge("sysgen_generations_in_flight", "Running generations",
+                   function=lambda: admission.active)
+    registry.gauge("sysgen_generations_queued", "Generations waiting for slot",
+                   function=lambda: admission.waiting)
+    trace.add_collector(GenerationMetrics(registry))
+
+    def metrics_exposition() -> Response:
+        """ Metrics of all workers in Prometheus text format """
+        response = make_response(registry.expose())
+        response.headers['Content-Type'] = CONTENT_TYPE
+        return response
+
+    def start_request_timer() -> NoReturn:
+        g.request_start = time.perf_counter()
+
+    def observe_request(response: Response) -> Response:
+        start = g.pop("request_start", None)
+        if start is not None:
+            request_duration.observe(time.perf_counter() - start,
+                                     route=get_route(),
+                                     method=request.method,
+                                     status=response.status_code)
+        return response
+
+    app.add_url_rule("/metrics", view_func=metrics_exposition)
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+    return registry
+
+
+def is_generated(response: Response) -> bool:
+    return response.headers.get("X-Cache") == "MISS"
+
+
+def init_profiling(app: Flask,
+                   name: str,
+                   endpoints: Iterable[str],
+                   generated: Callable[[Response], bool] = is_generated
+                   ) -> Profiler:
+    """
+        Adds on-demand profiling to Flask client: requests with token in
+        X-Profile header and sampled requests of endpoints (saved only if
+        project is generated). Adds /profiles routes, profiler is kept
+        in app.extensions['profiler'].
+
+        :param name: name of client saved in metadata of profiles
+        :param endpoints: endpoints sampled with PROFILE_SAMPLE_RATE
+        :param generated: checks that response of sampled request is
+            generated (X-Cache is 'MISS' by default)
+    """
+    app.extensions['profiler'] = Profiler(
+        app.config['PROFILE_PATH'],
+        sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+        token=app.config['PROFILE_TOKEN'],
+        interval=app.config['PROFILE_INTERVAL'],
+        max_profiles=app.config['PROFILE_MAX']
+    )
+    endpoints = frozenset(endpoints)
+
+    def get_authorized_profiler() -> Profiler:
+        profiler = current_app.extensions['profiler']
+        if not profiler.is_authorized(request.headers.get("X-Profile")):
+            abort(403)
+        return profiler
+
+    def profiles() -> Response:
+        """ Recent profiles of all workers (newest first) """
+        return jsonify([dict(meta, url=url_for("profile",
+                                               profile_id=meta['id']))
+                        for meta in get_authorized_profiler().list()])
+
+    def profile(profile_id: str) -> Response:
+        """ Collapsed stacks of profile (input of flame graph tools) """
+        path = get_authorized_profiler().get_path(profile_id)
+        if path is None:
+            abort(404)
+        # NOTE name of attachment is set without send_file arguments,
+        # which differ in Flask versions
+        response = send_file(path, mimetype="text/plain")
+        response.headers['Content-Disposition'] = \
+            f"attachment; filename={profile_id}{STACKS_EXT}"
+        return response
+
+    def start_profiling() -> NoReturn:
+        if request.endpoint in ("profiles", "profile"):
+            return
+        profiler = current_app.extensions['profiler']
+        if profiler.is_authorized(request.headers.get("X-Profile")):
+            g.profile_requested = True
+        elif request.endpoint not in endpoints or not profiler.is_sampled():
+            return
+        g.profile_sampler = profiler.start()
+
+    def save_profile(response: Response) -> Response:
+        """ Saves requested profile or sampled one of generated project """
+        sampler = g.pop("profile_sampler", None)
+        if sampler is None:
+            return response
+        sampler.stop()
+        if g.pop("profile_requested", False) or generated(response):
+            response.headers['X-Profile'] = \
+                current_app.extensions['profiler'].save(
+                    sampler,
+                    app=name,
+                    route=get_route(),
+                    method=request.method,
+                    path=request.full_path.rstrip("?"),
+                    status=response.status_code,
+                    cache=response.headers.get("X-Cache")
+                )
+        return response
+
+    def stop_profiling(error: Exception = None) -> NoReturn:
+        sampler = g.pop("profile_sampler", None)
+        if sampler is not None:  # NOTE response wasn't finalized
+            sampler.stop()
+
+    app.add_url_rule("/profiles", view_func=profiles)
+    app.add_url_rule("/profiles/<profile_id>", view_func=profile)
+    app.before_request(start_profiling)
+    app.after_request(save_profile)
+    app.teardown_request(stop_profiling)
+    return app.extensions['profiler']
@@ -0,0 +1,69 @@
+import io
+import os
+import tarfile
+from typing import NoReturn
+
+from engine.batch import generate, generate_many, get_setup_params
+from engine.boards import Board
+from engine.constants import MIPS
+from tests import use_test_dir
+
+
+CONFIGS = [
+    {'board': "de1soc", 'name': "first", 'mips': MIPS.VERSIONS[0]},
+    {'board': "marsohod3", 'name': "second", 'func': ["Seven"]},
+    {'board': "unknown", 'name': "third"},
+    {'board': "marsohod2", 'name': "fourth", 'conf': ["LED"]}
+]
+
+
+def test_generate(monkeypatch: object) -> NoReturn:
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "0")
+    result = generate(1, CONFIGS[1])
+    board = Board("marsohod3").setup(**get_setup_params(CONFIGS[1]))
+    assert result.error is None and result.project_name == "second"
+    assert result.files == board.generate().configs
+    assert result.digest == board.digest
+
+    result = generate(2, CONFIGS[2])
+    assert result.error and result.digest is None
+
+
+def test_generate_many(monkeypatch: object) -> NoReturn:
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "0")
+    expected = [generate(i, config) for i, config in enumerate(CONFIGS)]
+    for workers in (1, 2):
+        results = list(generate_many(iter(CONFIGS), workers=workers))
+        assert results == expected
+
+    results = generate_many(CONFIGS, workers=2, ordered=False)
+    assert sorted(results) == expected
+
+    with use_test_dir() as test_dir:
+        results = list(generate_many(CONFIGS, workers=2, path=test_dir))
+        assert all(result.files is None for result in results)
+        assert sorted(os.listdir(test_dir)) == ["first", "fourth", "second"]
+        for filename in expected[0].files:
+            assert os.path.exists(os.path.join(test_dir, "first", filename))
+
+    archive = io.BytesIO()
+    results = list(generate_many(CONFIGS, workers=2, archive=archive))
+    assert [result.error is None for result in results] == \
+        [True, True, False, True]
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tar_in:
+        names = tar_in.getnames()
+        assert tar_in.extractfile("second/second.qsf").read().decode() == \
+            expected[1].files["second.qsf"]
+    assert len(names) == sum(len(result.files) for result in expected
+                             if result.error is None)
+
+    # projects with the same name aren't saved over each other
+    duplicates = CONFIGS + [{'board': "marsohod3", 'name': "first"}]
+    with use_test_dir() as test_dir:
+        results = list(generate_many(duplicates, workers=2, path=test_dir))
+        assert results[-1].error == "Duplicate project name 'first'"
+        assert os.path.exists(os.path.join(test_dir, "first", "first.qsf"))
+    results = list(generate_many(duplicates, workers=2, archive=io.BytesIO()))
+    assert results[-1].error and results[-1].digest is None
+    assert list(generate_many(duplicates, workers=1))[-1].error is None
@@ -2,12 +2,16 @@
 
 import io
 import os
-from typing import NoReturn
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, NoReturn
 
 import pytest
 
 from engine.boards import Board, GenericBoard
-from engine.constants import BOARDS
+from engine.constants import BOARDS, DESTINATIONS, MIPS
+from engine.utils.prepare import Archiver
 from tests import TEST_DIR, use_test_dir
 from tests.engine import MOCK_CONFIG
 
@@ -87,6 +91,16 @@ class TestGenericBoard(object):
         check_generated(self.board.generate(self.p_name))
         check_generated(self.board.setup().generate())
 
+    def test_render_file(self) -> NoReturn:
+        date_t = datetime(2020, 1, 1)
+        self.board.generate(func={'Seven': True}, mips_type=MIPS.VERSIONS[0],
+                            date_t=date_t)
+        assert self.board.filenames == tuple(self.board.configs)
+        for filename, content in self.board.configs.items():
+            assert self.board.render_file(filename, date_t) == content
+        with pytest.raises(KeyError):
+            self.board.render_file("unknown.v")
+
     def test_dump(self) -> NoReturn:
         with pytest.raises(AttributeError):
             self.board.dump()
@@ -96,6 +110,65 @@ class TestGenericBoard(object):
             for filename in self.board.configs:
                 assert os.path.exists(os.path.join(self.res_path, filename))
 
+    def test_dump_incremental(self) -> NoReturn:
+        def stat_files() -> dict:
+            return {filename: (stat.st_ino, stat.st_mtime_ns)
+                    for filename, stat in
+                    ((filename, os.stat(os.path.join(self.res_path, filename)))
+                     for filename in self.board.configs)}
+
+        date_t = datetime(2020, 1, 1)  # NOTE so content isn't changed
+        with use_test_dir():
+            self.board.generate(mips_type=MIPS.VERSIONS[0], date_t=date_t)
+            self.board.dump(self.res_path, incremental=True, hardlink=True)
+            manifest = os.path.join(self.res_path, DESTINATIONS.MANIFEST)
+            assert os.path.exists(manifest), "manifest isn't saved"
+            for filename in self.board.configs:
+                assert os.path.exists(os.path.join(self.res_path, filename))
+            statics = set(self.board._statics) & set(self.board.configs)
+            assert statics
+            for filename in statics:
+                assert os.stat(os.path.join(self.res_path, filename)
+                               ).st_nlink > 1, "static isn't linked to cache"
+
+            stats = stat_files()
+            self.board.generate(mips_type=MIPS.VERSIONS[0], date_t=date_t)
+            self.board.dump(self.res_path, incremental=True, hardlink=True)
+            assert stat_files() == stats, "unchanged files are rewritten"
+
+            mips_file = next(filter(
+                lambda x: x.startswith(DESTINATIONS.MIPS),
+                self.board.configs
+            ))
+            license_path = os.path.join(self.res_path, "LICENSE")
+            with open(license_path, "w") as fout:
+                fout.write("changed")
+
+            self.board.generate(func={'Seven': True}, mips_type=None)
+            self.board.dump(self.res_path, incremental=True)
+            with open(license_path, "r") as fin:
+                assert fin.read() == self.board.configs['LICENSE']
+            assert not os.path.exists(
+                os.path.join(self.res_path, mips_file)
+            ), "outdated file isn't removed"
+            assert os.path.exists(os.path.join(
+                self.res_path, GenericBoard.func_path("Seven") + ".v"
+            ))
+
+            self.board.generate(mips_type=MIPS.VERSIONS[0])
+            self.board.dump(self.res_path, incremental=True)
+            assert os.path.exists(os.path.join(self.res_path, mips_file))
+
+    def test_extract_archive(self) -> NoReturn:
+        self.board.generate(func={'Uart8': True}, mips_type=MIPS.VERSIONS[0])
+        with use_test_dir():
+            stats = Archiver.extract(self.board.as_archive, self.res_path,
+                                     chunk_size=1024)
+            assert set(stats) == set(self.board.configs)
+            for filename, content in self.board.configs.items():
+                with open(os.path.join(self.res_path, filename)) as fin:
+                    assert fin.read() == content
+
     def test_archive(self) -> NoReturn:
         with pytest.raises(AttributeError):
             self.board.archive()
@@ -112,3 +185,39 @@ class TestBoard(object):
         assert board.__slots__
         with pytest.raises(ValueError):
             Board(BOARDS[0] * 2)  # there is no such board
+
+    def test_threads(self) -> NoReturn:
+        # NOTE generations in threads shouldn't affect each other
+        date_t = datetime(2020, 1, 1)
+        configs = [(BOARDS[i % len(BOARDS)], f"proj_{i}",
+                    MIPS.VERSIONS[i % len(MIPS.VERSIONS)] if i % 3 else None,
+                    {'Seven': True} if i % 2 else {'Uart8': True})
+                   for i in range(16)]
+
+        def generate(config: tuple) -> Dict[str, str]:
+            board, name, mips_type, func = config
+            return Board(board).generate(name, date_t=date_t, func=func,
+                                         mips_type=mips_type).configs
+
+        expected = [generate(config) for config in configs]
+        # .qsf file contains date of project creation
+        shared = Board(BOARDS[0]).setup(configs[0][1], func=configs[0][3])
+        filename = configs[0][1] + ".qsf"
+        dates = [datetime(2020, 1, day) for day in range(1, 5)]
+        shared_expected = [shared.render_file(filename, date)
+                           for date in dates]
+
+        def render_shared(index: int) -> bool:
+            return (shared.render_file(filename, dates[index % len(dates)])
+                    == shared_expected[index % len(dates)])
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # NOTE to switch threads more often
+        try:
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(generate, configs * 8))
+                shared_results = list(executor.map(render_shared, range(2000)))
+        finally:
+            sys.setswitchinterval(interval)
+        assert results == expected * 8
+        assert all(shared_results)
@@ -0,0 +1,63 @@
+import io
+import json
+import tarfile
+from datetime import datetime
+from typing import NoReturn
+
+import pytest
+
+from engine.boards import Board
+from engine.constants import BOARDS, DESTINATIONS, MIPS
+from engine.delta import (MANIFESTS, Manifests, delta_archive, diff_digests,
+                          generate_delta)
+from engine.exceptions import UnknownDigest
+
+
+def read_delta(archive: io.BytesIO) -> dict:
+    archive.seek(0)
+    with tarfile.open(fileobj=archive) as tar_in:
+        names = set(tar_in.getnames())
+        manifest = json.load(tar_in.extractfile(DESTINATIONS.DELTA))
+    names.remove(DESTINATIONS.DELTA)
+    assert names == set(manifest['added'] + manifest['changed'])
+    return manifest
+
+
+def test_diff_digests() -> NoReturn:
+    diff = diff_digests({'a': "1", 'b': "2", 'c': "3"},
+                        {'a': "1", 'b': "0", 'd': "4"})
+    assert diff == {'added': ["d"], 'changed': ["b"], 'removed': ["c"]}
+
+
+def test_manifests() -> NoReturn:
+    manifests = Manifests(max_items=2)
+    digests = [manifests.add({'file': str(i)}) for i in range(3)]
+    with pytest.raises(UnknownDigest):
+        manifests.get(digests[0])
+    assert manifests.get(digests[2]) == {'file': "2"}
+
+
+def test_delta_archive() -> NoReturn:
+    date_t = datetime(2020, 1, 1)
+    board = Board(BOARDS[0]).setup().generate(date_t=date_t)
+    previous = dict(board.digests)
+    assert read_delta(delta_archive(board, previous))['changed'] == []
+
+    board.generate(func={'Uart8': True}, mips_type=MIPS.VERSIONS[0],
+                   date_t=date_t)
+    manifest = read_delta(delta_archive(board, previous))
+    assert "functions/Uart8.v" in manifest['added']
+    assert f"{board.project_name}.qsf" in manifest['changed']
+    assert f"{board.project_name}.qpf" not in manifest['changed']
+    assert manifest['digest'] == board.digest
+
+
+def test_generate_delta() -> NoReturn:
+    config = {'func': {'Seven': True}}
+    manifest = read_delta(generate_delta(BOARDS[0], config, previous={}))
+    assert manifest['added'] == ["functions/Seven.v"]
+    assert not manifest['removed']
+
+    manifest = read_delta(generate_delta(BOARDS[0], {}, manifest['digest']))
+    assert manifest['removed'] == ["functions/Seven.v"]
+    assert MANIFESTS.get(manifest['digest']) == manifest['files']
@@ -1,16 +1,41 @@
+import asyncio
+import copy
+import glob
+import io
 import json
 import os
 import re
 import shutil
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+from argparse import Namespace
 from datetime import datetime
 from typing import Any, Dict, Iterable, NoReturn
 
 import pytest
 
-from engine.constants import PATHS
+from engine import artifacts
+from engine.boards import GenericBoard
+from engine.constants import BOARDS, FUNCTIONS, MIPS, PATHS
+from engine.delta import Manifests
+from engine.exceptions import Overloaded, QueueFull
+from engine.utils import cache, matrix, metrics, profiling, trace
+from engine.utils.admission import Admission
+from engine.utils.assets import build_assets, find_asset, load_assets
+from engine.utils.cache import ArchiveCache, get_fingerprint
+from engine.utils.coalesce import SingleFlight
+from engine.utils.importer import import_qsf, qsf_to_static
+from engine.utils.jobs import JobQueue
 from engine.utils.misc import none_safe, quote
-from engine.utils.prepare import Archiver, Loader, convert, create_dirs
+from engine.utils.prepare import (Archiver, Loader, convert, create_dirs,
+                                  get_digest, get_static_digest)
 from engine.utils.render import ENV, Render, load_template
+from engine.utils.serialize import (JSON, NDJSON, best_match, compress,
+                                    get_encoding, select_files, serialize)
+from engine.utils.store import ArtifactStore
 from tests import (TEST_DIR, free_test_dir, logging, remove_test_dir,
                    use_test_dir)
 from tests.engine import (MOCK_CONFIG, MOCK_DIR, MOCK_TEMPL_NAME,
@@ -83,6 +108,28 @@ class TestArchiver:
         assert not Archiver._to_tar(self.arch_name, *self.files), "no errors"
         assert os.path.exists(self.arch_name), "archive isn't exist"
 
+    def test_archive_tree(self) -> NoReturn:
+        tree = os.path.join(self.tmp_dir, "tree")
+        for dirname in ("x", "x/y", "z"):
+            os.makedirs(os.path.join(tree, dirname))
+            for i in range(5):
+                with open(os.path.join(tree, dirname, str(i)), "w") as fout:
+                    fout.write(dirname * (i + 1))
+        with tarfile.open(self.arch_name + ".ref", "w") as tar_fout:
+            tar_fout.add(tree)
+        with tarfile.open(self.arch_name + ".ref") as tar_in:
+            expected = sorted(tar_in.getnames())
+
+        missing = os.path.join(self.tmp_dir, "missing")
+        assert Archiver._to_tar(self.arch_name, tree, missing, workers=2) == 1
+        with tarfile.open(self.arch_name) as tar_in:
+            assert sorted(tar_in.getnames()) == expected
+            assert tar_in.extractfile(expected[-1]).read() == b"zzzzz"
+        assert Archiver._to_zip(self.arch_name, tree, missing, workers=2) == 1
+        with zipfile.ZipFile(self.arch_name) as zf_in:
+            names = sorted(name.rstrip("/") for name in zf_in.namelist())
+            assert names == expected
+
     def test__archive(self) -> NoReturn:
         assert Archiver._archive(
             *self.files,
@@ -142,6 +189,32 @@ class TestArchiver:
         assert not Archiver.archive(tar_name, *self.files, rewrite=True)
         assert Archiver.archive(tar_name, *self.files, rewrite=False) < 0
 
+    def test_extract(self) -> NoReturn:
+        extract_dir = os.path.join(self.tmp_dir, "extracted")
+        for ext in (".tar", ".tar.gz", ".tar.bz2", ".tar.xz", ".zip"):
+            arch_name = self.arch_name + ext
+            assert not Archiver.archive(arch_name, *self.files)
+            stats = Archiver.extract(arch_name, extract_dir, workers=2)
+            assert len(stats) == len(self.files), "not all files extracted"
+            for filename in self.files:
+                assert os.path.exists(extract_dir + filename)
+            shutil.rmtree(extract_dir)
+
+    def test_extract_unsafe(self) -> NoReturn:
+        arch_io = io.BytesIO()
+        with tarfile.open(fileobj=arch_io, mode="w") as tar_fout:
+            for name in ("../evil", "/abs", "ok/../../evil", "ok/file"):
+                tar_fout.addfile(tarfile.TarInfo(name), io.BytesIO())
+            link = tarfile.TarInfo("ok/link")
+            link.type = tarfile.SYMTYPE
+            link.linkname = "/etc/passwd"
+            tar_fout.addfile(link)
+        extract_dir = os.path.join(self.tmp_dir, "extracted")
+        stats = Archiver.extract(arch_io, extract_dir)
+        assert list(stats) == ["ok/file"], "unsafe member extracted"
+        assert not os.path.exists(os.path.join(self.tmp_dir, "evil"))
+        assert not os.path.lexists(os.path.join(extract_dir, "ok/link"))
+
 
 def test_convert() -> NoReturn:
     kwargs = {
@@ -162,6 +235,572 @@ def test_convert() -> NoReturn:
             assert not os.path.exists(filename), "file wasn't removed"
 
 
+def test_import_qsf() -> NoReturn:
+    qsf_files = glob.glob(os.path.join(PATHS.BASE, "docs", "pin_assignments",
+                                       "*", "*.qsf"))
+    assert qsf_files, "no vendor files found"
+    with use_test_dir() as test_dir:
+        for qsf_file in qsf_files:
+            config = import_qsf(qsf_file)
+            _test_static_content(dict(config, func={}))
+            assert config['qsf']['family'] and config['qsf']['device']
+            assert config['qsf']['user_assignments']
+            assert config['v']['assignments'].keys() == \
+                config['qsf']['user_assignments'].keys()
+
+            path = qsf_to_static(qsf_file, os.path.join(test_dir, "b.yml"))
+            board = GenericBoard(path).generate()
+            assert board.configs and board.params
+
+        path = os.path.join(test_dir, "board.qsf")
+        with open(path, "w") as fout:
+            fout.write("# set_location_assignment PIN_0 -to SKIPPED\n"
+                       "set_location_assignment PIN_1 -to \"LED[1]\"\n"
+                       "  set_location_assignment PIN_2 -to LED[0]\n"
+                       "set_instance_assignment -name IO_STANDARD "
+                       "\"3.3-V LVTTL\" -to KEY0\n"
+                       "set_global_assignment -name TOP_LEVEL_ENTITY top\n"
+                       "set_global_assignment -name FAMILY \"MAX 10\"\n")
+        config = import_qsf(path)
+        assert config['qsf']['family'] == "MAX 10"
+        assert not config['qsf']['global_assignments']
+        assert config['qsf']['user_assignments']['LED']['location'] == \
+            [["PIN_1", "LED[1]"], ["PIN_2", "LED[0]"]]
+        assert config['qsf']['user_assignments']['KEY']['instance'] == \
+            [["IO_STANDARD", "3.3-V LVTTL", "KEY0"]]
+        assert config['v']['assignments']['LED'] == \
+            [["output", "[1:0]", "LED"]]
+
+
+def test_get_static_digest() -> NoReturn:
+    assert get_static_digest() == get_static_digest(PATHS.STATIC, PATHS.TEMPL)
+    with use_test_dir() as test_dir:
+        static_dir = os.path.join(test_dir, "static")
+        os.makedirs(os.path.join(static_dir, "nested"))
+        with open(os.path.join(static_dir, "nested", "a.yml"), "w") as fout:
+            fout.write("a")
+        digest = get_static_digest(static_dir)
+        assert digest != get_static_digest()
+
+        # digest depends on content and relative paths only
+        moved_dir = shutil.copytree(static_dir,
+                                    os.path.join(test_dir, "other", "static"))
+        assert get_static_digest(moved_dir) == digest
+        with open(os.path.join(moved_dir, "nested", "a.yml"), "w") as fout:
+            fout.write("b")
+        assert get_static_digest(moved_dir) != digest
+
+
+def test_build_assets() -> NoReturn:
+    with use_test_dir() as test_dir:
+        sources = {}
+        for name, content in (("css/main.css", "a {background: "
+                                               "url('../img/a.svg?v=1')}"),
+                              ("img/a.svg", "<svg>" + " " * 1024 + "</svg>"),
+                              ("img/b.woff2", "font")):
+            sources[name] = os.path.join(test_dir, "src", name)
+            os.makedirs(os.path.dirname(sources[name]), exist_ok=True)
+            with open(sources[name], "w") as fout:
+                fout.write(content)
+
+        destination = os.path.join(test_dir, "assets")
+        assets = build_assets(sources, destination)
+        assert load_assets(destination) == assets
+        assert set(assets) == set(sources)
+        assert re.fullmatch(r"img/a\.[0-9a-f]{16}\.svg", assets['img/a.svg'])
+        with open(os.path.join(destination, assets['css/main.css'])) as fin:
+            assert f"url('../{assets['img/a.svg']}?v=1')" in fin.read()
+
+        path = os.path.join(destination, assets['img/a.svg'])
+        assert find_asset(path, "gzip, deflate") == (path + ".gz", "gzip")
+        assert find_asset(path, "gzip;q=0") == (path, None)
+        assert find_asset(path, "br;q=0, *") == (path + ".gz", "gzip")
+        assert find_asset(path, "gzip;q=0, br;q=0, *") == (path, None)
+        assert find_asset(path, None) == (path, None)
+        with open(path + ".gz", "rb") as fin:
+            assert zlib.decompress(fin.read(), 16 + zlib.MAX_WBITS) == \
+                b"<svg>" + b" " * 1024 + b"</svg>"
+        path = os.path.join(destination, assets['img/b.woff2'])
+        assert find_asset(path, "gzip") == (path, None)  # not compressible
+
+        # the same content isn't rebuilt, changed one gets new name
+        mtime = os.stat(path).st_mtime_ns
+        with open(sources['img/a.svg'], "w") as fout:
+            fout.write("<svg/>")
+        rebuilt = build_assets(sources, destination)
+        assert os.stat(path).st_mtime_ns == mtime
+        assert rebuilt['img/a.svg'] != assets['img/a.svg']
+        assert rebuilt['css/main.css'] != assets['css/main.css']
+        assert load_assets(os.path.join(test_dir, "unknown")) == {}
+
+
+def test_matrix() -> NoReturn:
+    configs = list(matrix.get_combinations())
+    assert len(configs) == \
+        len(BOARDS) * (len(MIPS.VERSIONS) + 1) * 2 ** len(FUNCTIONS.ITEMS)
+    assert len({matrix.get_key(config) for config in configs}) == len(configs)
+    assert len(list(matrix.get_combinations(max_functions=1))) == \
+        len(BOARDS) * (len(MIPS.VERSIONS) + 1) * (len(FUNCTIONS.ITEMS) + 1)
+    configs = matrix.sample(configs, 6, seed=1)
+    assert configs == matrix.sample(matrix.get_combinations(), 6, seed=1)
+    configs.append({'board': "unknown", 'name': "matrix", 'mips': None,
+                    'func': []})
+
+    with use_test_dir() as test_dir:
+        path = os.path.join(test_dir, "baseline.json")
+        results = list(matrix.check(configs, matrix.load_baseline(path), 1))
+        assert [result.status for result in results].count(matrix.NEW) == 6
+        assert results[-1].status == matrix.FAILED and results[-1].error
+        matrix.save_baseline(path, results)
+
+        baseline = matrix.load_baseline(path)
+        assert len(baseline) == 6
+        key = matrix.get_key(configs[0])
+        filename = f"{matrix.PROJECT_NAME}.qsf"
+        baseline[key][filename] = "0" * matrix.DIGEST_SIZE
+        results = list(matrix.check(configs[:-1], baseline, 2))
+        assert sorted(result.status for result in results) == \
+            [matrix.CHANGED] + [matrix.OK] * 5
+        changed = next(result for result in results
+                       if result.status == matrix.CHANGED)
+        assert changed.key == key
+        assert changed.diff == {'added': [], 'changed': [filename],
+                                'removed': []}
+        assert f"CHANGED {key}" in matrix.report(results, 1.0)
+
+        # combinations, which aren't in matrix, are reported and removed
+        baseline["unknown/-/-"] = {}
+        missing = matrix.find_missing(baseline)
+        assert [(result.key, result.status) for result in missing] == \
+            [("unknown/-/-", matrix.MISSING)]
+        assert "MISSING unknown/-/-" in matrix.report(results + missing, 1.0)
+        matrix.save_baseline(path, missing, baseline)
+        assert "unknown/-/-" not in matrix.load_baseline(path)
+
+        # baseline is required unless it's created
+        args = Namespace(baseline=os.path.join(test_dir, "created.json"),
+                         update=False, boards=["de1soc"], max_functions=0,
+                         sample=None, seed=0, workers=1, report=None)
+        assert matrix.main(args) == 2
+        assert matrix.main(Namespace(**dict(vars(args), update=True))) == 0
+        assert matrix.main(args) == 0
+
+
+def test_trace(monkeypatch: Any) -> NoReturn:
+    monkeypatch.setattr(trace, "_collectors", ())  # e.g. clients' metrics
+    assert not trace.span("generate") and not trace.is_enabled()
+    recorder = trace.Recorder()
+    with trace.collect(recorder):
+        assert trace.is_enabled()
+        board = GenericBoard(MOCK_CONFIG).setup(
+            "trace", func={'Seven': True}
+        ).generate()
+        board.as_archive
+    assert not trace.is_enabled()
+
+    files = recorder.find("file")
+    assert [span.attrs['file'] for span in files] == list(board.configs)
+    for span in files:
+        assert span.full_name == "generate/file"
+        assert span.attrs['bytes'] == \
+            len(board.configs[span.attrs['file']].encode("utf-8"))
+        assert span.duration >= 0
+    renders = recorder.find("render")
+    assert {span.attrs['template'] for span in renders} >= \
+        {"v.jinja", "qsf.jinja", "functions/Seven.v.jinja"}
+    assert recorder.find("load_config")[0].attrs['path'] == MOCK_CONFIG
+    assert recorder.find("archive")[0].attrs['bytes'] == \
+        len(board.as_archive.getvalue())
+    summary = recorder.summary()
+    assert summary['generate']['count'] == 1
+    assert summary['reset']['count'] == 2  # by __init__ and setup
+    assert summary['load_config']['hits'] >= 1  # second load is cached
+
+    def failing(span: trace.Span) -> NoReturn:
+        raise ValueError(span.name)
+
+    trace.add_collector(failing)
+    try:
+        assert trace.is_enabled()
+        with pytest.raises(KeyError), trace.collect(recorder):
+            with trace.span("stage") as span:  # collector doesn't break it
+                raise KeyError()
+    finally:
+        trace.remove_collector(failing)
+    assert not trace.is_enabled()
+    assert recorder.spans[-1] is span and span.attrs['error'] == "KeyError"
+
+
+def test_metrics() -> NoReturn:
+    with use_test_dir() as test_dir:
+        registry = metrics.Registry("test", os.path.join(test_dir, "metrics"))
+        requests = registry.counter("requests_total", "Requests", ("route",))
+        duration = registry.histogram("duration_seconds", "Duration",
+                                      buckets=(0.1, 1))
+        in_flight = registry.gauge("in_flight", "In flight")
+        requests.inc(route="/a")
+        duration.observe(0.5)
+        in_flight.set(2)
+        with pytest.raises(ValueError):
+            requests.inc(path="/a")
+        with trace.collect(metrics.GenerationMetrics(registry)):
+            Archiver.get_tar_io({'a.v': "a"})
+
+        pid = os.fork()
+        if pid == 0:  # worker process
+            requests.inc(2, route="/a\"")
+            in_flight.set(5)
+            registry.flush()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        text = registry.expose()
+        registry.close()  # NOTE before directory is removed
+        assert 'requests_total{route="/a"} 1' in registry.expose()
+        assert 'requests_total{route="/a\\""} 2' not in registry.expose()
+
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="/a"} 1' in text  # not inherited by worker
+    assert 'requests_total{route="/a\\""} 2' in text
+    assert "in_flight 2" in text.splitlines()  # worker is finished
+    for line in ('duration_seconds_bucket{le="0.1"} 0',
+                 'duration_seconds_bucket{le="1"} 1',
+                 'duration_seconds_bucket{le="+Inf"} 1',
+                 "duration_seconds_sum 0.5", "duration_seconds_count 1",
+                 "sysgen_archive_size_bytes_count 1",
+                 'sysgen_stage_duration_seconds_count{stage="archive"} 1'):
+        assert line in text.splitlines()
+
+
+def test_profiling() -> NoReturn:
+    def busy(duration: float) -> NoReturn:
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            GenericBoard(MOCK_CONFIG).setup("profile").generate()
+
+    with use_test_dir() as test_dir:
+        profiler = profiling.Profiler(os.path.join(test_dir, "profiles"),
+                                      token="secret", interval=0.0005,
+                                      max_profiles=2)
+        for board in ("a", "b", "c"):
+            with profiler.profile(board=board) as sampler:
+                busy(0.1)
+        profiles = profiler.list()
+        with open(profiler.get_path(sampler.profile_id)) as fin:
+            lines = fin.read().splitlines()
+        assert profiler.get_path("../../etc/passwd") is None
+        assert profiler.get_path(profiles[0]['id'].replace("-", "-9", 1)) \
+            is None
+
+    assert [profile['board'] for profile in profiles] == ["c", "b"]
+    assert profiles[0]['id'] == sampler.profile_id
+    assert profiles[0]['samples'] == sampler.samples > 0
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == \
+        sampler.samples
+    assert any(";busy (tests/engine/test_utils.py:" in line and
+               " (engine/boards.py:" in line for line in lines)
+    assert profiler.is_authorized("secret")
+    assert not profiler.is_authorized("wrong")
+    assert not profiler.is_authorized(None)
+    assert not profiler.is_sampled()  # NOTE sample rate is 0
+
+
+def test_best_match() -> NoReturn:
+    offers = [JSON, NDJSON]
+    assert best_match(None, offers) == JSON
+    assert best_match(f"{NDJSON}", offers) == NDJSON
+    assert best_match(f"text/html, {JSON};q=0.5, */*;q=0.1", offers) == JSON
+    assert best_match("application/*", offers) == JSON
+    assert best_match(f"{JSON};q=0, */*", offers) == JSON
+    assert best_match("text/html", offers) is None
+    assert get_encoding(None) is None
+    assert get_encoding("gzip;q=0.5, identity;q=0.1") == "gzip"
+    assert get_encoding("deflate") is None
+
+
+def test_serialize() -> NoReturn:
+    files = {'a.qsf': "qsf", 'mips/a.v': "v", 'mips/b.v': "\u00e9"}
+    assert select_files(files, None) == files
+    assert select_files(files, "a.qsf, mips/b*") == {
+        'a.qsf': "qsf", 'mips/b.v': "\u00e9"
+    }
+    assert select_files(files, "*.sdc") == {}
+
+    assert json.loads(b"".join(serialize(files, JSON))) == files
+    lines = list(serialize(files, NDJSON))
+    assert len(lines) == 3 and all(line.endswith(b"\n") for line in lines)
+    assert json.loads(lines[2]) == {'name': "mips/b.v", 'content': "\u00e9"}
+
+    chunks = [b"x" * 1000] * 100
+    assert b"".join(compress(iter(chunks), None)) == b"".join(chunks)
+    compressed = b"".join(compress(iter(chunks), "gzip"))
+    assert len(compressed) < 1000
+    assert zlib.decompress(compressed, 16 + zlib.MAX_WBITS) == \
+        b"".join(chunks)
+
+
+def test_get_fingerprint(monkeypatch: Any) -> NoReturn:
+    fingerprint = get_fingerprint("marsohod2", flt={'key': True, 'led': True},
+                                  func=["Seven", "Uart8"], conf={'delay': 1})
+    assert fingerprint == get_fingerprint(
+        "Marsohod2", project_name=None, mips_type="",
+        flt={'led': True, 'key': True, 'sdram': False},
+        func={'Uart8': True, 'Seven': True}, conf={'delay': 1, 'width': None}
+    ), "fingerprint depends on order or defaults"
+    assert fingerprint != get_fingerprint("marsohod2", flt={'key': True},
+                                          func=["Seven", "Uart8"],
+                                          conf={'delay': 1})
+    assert fingerprint != get_fingerprint("marsohod2", mips_type="simple",
+                                          flt={'key': True, 'led': True},
+                                          func=["Seven", "Uart8"],
+                                          conf={'delay': 1})
+    # NOTE projects of previous engine version or templates aren't reused
+    monkeypatch.setattr(cache, "get_engine_digest", lambda: "changed")
+    assert fingerprint != get_fingerprint("marsohod2",
+                                          flt={'key': True, 'led': True},
+                                          func=["Seven", "Uart8"],
+                                          conf={'delay': 1})
+
+
+def test_archive_cache() -> NoReturn:
+    cache = ArchiveCache(max_bytes=10)
+    assert cache.get("a") is None
+    cache.put("a", b"aaaa", size=4)
+    cache.put("b", b"bbbb", size=4)
+    assert cache.get("a") == b"aaaa"
+    cache.put("c", b"cccc", size=4)  # evicts least recently used 'b'
+    cache.put("d", b"d" * 11, size=11)  # too large to be cached
+    assert cache.get("b") is None and cache.get("d") is None
+    assert cache.get("c") == b"cccc"
+    assert cache.stats == {'hits': 2, 'misses': 3, 'items': 2, 'bytes': 8,
+                           'max_bytes': 10}
+
+
+def test_artifact_store() -> NoReturn:
+    with use_test_dir() as test_dir:
+        store = ArtifactStore(os.path.join(test_dir, "store"), max_bytes=10)
+        digest = store.put(b"aaaa", key="a", meta={'filename': "a.tar"})
+        assert store.lookup("a") == digest and store.lookup("b") is None
+        assert store.get(digest) == b"aaaa"
+        assert store.meta(digest) == {'filename': "a.tar"}
+        assert os.path.exists(store.path(digest))
+
+        # NOTE hit by alias reads index in one transaction
+        connect, connections = store._connect, []
+        store._connect = lambda: connections.append(1) or connect()
+        assert store.get_by_key("a") == (digest, b"aaaa",
+                                         {'filename': "a.tar"})
+        assert len(connections) == 1
+        assert store.get_with_meta(digest) == (b"aaaa", {'filename': "a.tar"})
+        assert len(connections) == 2
+        assert store.get_by_key("b") is None
+        assert store.get_with_meta("b" * 64) == (None, None)
+        del store._connect
+
+        # other process shares the same index
+        other = ArtifactStore(store.root, max_bytes=10)
+        other.put(b"bbbb", key="b")
+        store.get(digest)  # 'a' is used more recently than 'b'
+        other.put(b"cccc", key="c")
+        assert other.lookup("b") is None, "least recently used isn't evicted"
+        assert store.get(digest) == b"aaaa"
+        assert store.stats == {'items': 2, 'bytes': 8, 'max_bytes': 10}
+
+        store.ttl = -1  # everything is expired
+        assert store.get(digest) is None
+        assert store.evict() == 2
+        assert not os.path.exists(store.path(digest))
+
+        with store.lock("a"), store.lock("b"):
+            assert os.listdir(os.path.join(store.root, "locks"))
+
+
+def test_load_or_generate(monkeypatch: Any) -> NoReturn:
+    manifests = Manifests()
+    monkeypatch.setattr(artifacts, "MANIFESTS", manifests)
+    params = {'project_name': "stored", 'mips_type': MIPS.VERSIONS[0]}
+    fingerprint = get_fingerprint("de1soc", **params)
+    stages = []
+    with use_test_dir() as test_dir:
+        store = ArtifactStore(os.path.join(test_dir, "store"))
+        generated, status = artifacts.load_or_generate(
+            store, fingerprint, "de1soc", params, stages.append
+        )
+        assert status == "MISS"
+        assert manifests.get(generated['digest']) == generated['files']
+
+        # NOTE other process (or restarted one) registers stored files too
+        monkeypatch.setattr(artifacts, "MANIFESTS", Manifests())
+        stored, status = artifacts.load_or_generate(
+            store, fingerprint, "de1soc", params, stages.append
+        )
+        assert status == "STORE"
+        assert artifacts.MANIFESTS.get(stored['digest']) == stored['files']
+
+    assert stages == ["load", "render", "archive"]
+    assert stored == generated
+    assert stored['filename'] == "stored.tar"
+    assert stored['artifact'] == get_digest(stored['content'])
+
+
+def test_job_queue() -> NoReturn:
+    def handler(params: dict, progress: Any) -> int:
+        progress("load", item=0)
+        progress("render", item=0)
+        return 1 // params['value']
+
+    with use_test_dir() as test_dir:
+        path = os.path.join(test_dir, "jobs.sqlite")
+        queue = JobQueue(path, handler, max_jobs=3, poll_interval=0.01)
+        job = queue.submit({'value': 1})
+        assert queue.get(job)['state'] == JobQueue.QUEUED
+        queue.start()
+        stages = [event['stage'] for event in queue.events(job, timeout=10)]
+        assert stages == ["queued", "running", "load", "render", "done"]
+        assert queue.get(job)['result'] == 1
+
+        failed = queue.submit({'value': 0})
+        assert list(queue.events(failed, timeout=10))[-1]['stage'] == "failed"
+        assert "division" in queue.get(failed)['error']
+        assert queue.get("unknown") is None
+        assert not list(queue.events("unknown"))
+        queue.stop()
+
+        # the oldest finished jobs are purged to fit limit
+        queue.submit({'value': 1})
+        assert queue.get(job) is not None
+        queue.submit({'value': 1})
+        assert queue.get(job) is None and queue.get(failed) is not None
+        queue.submit({'value': 1})
+        with pytest.raises(QueueFull):
+            queue.submit({'value': 1})
+        assert queue.stats == {'queued': 3, 'running': 0, 'done': 0,
+                               'failed': 0}
+
+        # jobs without heartbeat are requeued and finished jobs expire
+        other = JobQueue(path, handler, ttl=-1, poll_interval=0.01)
+        with other._connect() as conn:
+            conn.execute("UPDATE jobs SET state = 'running', pid = 1, "
+                         "updated = ?", (time.time(),))
+        assert other.recover() == 0
+        with other._connect() as conn:
+            conn.execute("UPDATE jobs SET updated = ?",
+                         (time.time() - other.lease - 1,))
+        assert other.recover() == 3
+        other.start()
+        while other.stats['done'] < 3:
+            time.sleep(0.01)
+        other.stop()
+        assert other.purge() == 3
+
+        # NOTE concurrent processes check limit under write lock
+        results = []
+
+        def submit() -> NoReturn:
+            try:
+                results.append(JobQueue(path, handler, max_jobs=3)
+                               .submit({'value': 1}))
+            except QueueFull as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=submit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len([job for job in results if isinstance(job, str)]) == 3
+        assert len(results) == 8, "submit is failed by locked database"
+
+
+def test_admission() -> NoReturn:
+    admission = Admission(1, queue_size=1, timeout=5)
+    entered, release = threading.Event(), threading.Event()
+    results = []
+
+    def call() -> NoReturn:
+        try:
+            with admission.admit():
+                entered.set()
+                release.wait()
+            results.append(True)
+        except Overloaded as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(2)]
+    threads[0].start()
+    entered.wait()
+    threads[1].start()
+    while admission.waiting < 1:
+        time.sleep(0.001)
+
+    # queue is full, so call is rejected immediately
+    with pytest.raises(Overloaded) as error:
+        with admission.admit():
+            pass
+    assert error.value.retry_after >= 1
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [True, True]
+    assert admission.stats['admitted'] == 2
+    assert admission.stats['rejected'] == 1
+
+    # waiting is limited by timeout
+    admission.timeout = 0.01
+    with admission.admit():
+        with pytest.raises(Overloaded):
+            with admission.admit():
+                pass
+
+    async def call_async() -> NoReturn:
+        async with admission.admit_async():
+            assert admission.active == 1
+            with pytest.raises(Overloaded):
+                async with admission.admit_async():
+                    pass
+
+    asyncio.run(call_async())
+    assert admission.stats['active'] == 0
+    assert admission.stats['rejected'] == 3
+
+
+def test_single_flight() -> NoReturn:
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def func(value: int) -> int:
+        calls.append(value)
+        started.set()
+        release.wait()
+        return value
+
+    def call() -> NoReturn:
+        results.append(flight.do("key", func, len(results)))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=call) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while flight.shared < 4:
+        threading.Event().wait(0.001)
+    assert flight.in_flight == 1
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert calls == [0], "function is called several times"
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert {result for result, _ in results} == {0}
+    assert flight.in_flight == 0
+
+    # errors are raised for all callers, keys aren't kept after calls
+    with pytest.raises(ValueError):
+        flight.do("key", int, "not a number")
+    assert flight.do("key", int, "1") == (1, False)
+
+
 class TestLoader:
     def setup_class(self) -> NoReturn:
         self.path = MOCK_DIR
@@ -174,6 +813,15 @@ class TestLoader:
                     Loader.load(self.fullpath)):
             _test_static_content(res)
 
+    def test_load_config(self) -> NoReturn:
+        res = Loader.load_config(self.fullpath)
+        _test_static_content(res)
+        res.clear()  # returned copy may be modified
+        _test_static_content(Loader.load_config(self.fullpath))
+        _test_static_content(Loader.load_config(
+            os.path.join(self.path, self.filename)
+        ))
+
     def test_load_static(self) -> NoReturn:
         params = {'encoding': None}
         for res in (Loader.load_static(self.fullpath, **params),
@@ -245,6 +893,10 @@ class TestRender:
         assert f_date.count(" ") == 2
         assert fs_date.count(" ") == 3
 
+    def test_format_date_reproducible(self, monkeypatch: object) -> NoReturn:
+        monkeypatch.setenv("SOURCE_DATE_EPOCH", "0")
+        assert Render.format_date(quoted=False) == "00:00:00 January 01,1970"
+
     def test_qpf(self) -> NoReturn:
         params = self.make_params("qpf")
         self._check_rendered(Render.qpf(**params), params)
@@ -253,6 +905,14 @@ class TestRender:
         params = self.make_params("qsf")
         self._check_rendered(Render.qsf(**params), params)
 
+    def test_params_unchanged(self) -> NoReturn:
+        # NOTE params are shared by concurrent generations
+        for filetype, render in (("qpf", Render.qpf), ("qsf", Render.qsf)):
+            params = self.make_params(filetype)
+            expected = copy.deepcopy(params)
+            render(**params)
+            assert params == expected, f"{filetype} params are changed"
+
     def test_sdc(self) -> NoReturn:
         params = self.make_params("sdc")
         res = Render.sdc(**params)
@@ -0,0 +1,158 @@
+""" Tests of batch mode of CLI client """
+
+import io
+import json
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+from argparse import Namespace
+from typing import Any, NoReturn
+
+import pytest
+
+import cli_client
+from engine.daemon import Daemon, ping, request
+from tests import use_test_dir
+
+
+LINES = [
+    {'board': "de1soc", 'name': "first", 'mips': "simple"},
+    "not json",
+    {'board': "marsohod3", 'name': "second", 'func': ["Seven"]},
+    {'board': "unknown"},
+    {'board': "de1soc", 'name': "third", 'key': 1}
+]
+
+
+def _batch_args(batch: str, **kwargs) -> Namespace:
+    return Namespace(**dict(dict(batch=batch, path=None, archive=False,
+                                 daemon=False, workers=1, status=None),
+                            **kwargs))
+
+
+def test_read_batch() -> NoReturn:
+    lines = []
+    content = "\n".join(line if isinstance(line, str) else json.dumps(line)
+                        for line in LINES[:3]) + "\n\n"
+    configs = list(cli_client.read_batch(io.StringIO(content), lines))
+    assert configs[0] == LINES[0] and configs[2] == LINES[2]
+    assert configs[1].index == 1 and "Invalid json" in configs[1].error
+    assert lines == [1, 2, 3]
+    for data in LINES[3:]:
+        assert cli_client.validate_batch_config(data)
+
+
+def test_run_batch(capsys: Any) -> NoReturn:
+    with use_test_dir() as test_dir:
+        path = os.path.join(test_dir, "batch.jsonl")
+        with open(path, "w") as fout:
+            for line in LINES:
+                fout.write((line if isinstance(line, str)
+                            else json.dumps(line)) + "\n")
+
+        archive = os.path.join(test_dir, "projects.tar")
+        result = cli_client.main(_batch_args(path, path=archive,
+                                             archive=True, workers=2))
+        assert result == cli_client.ReturnCode.GENERATION_ERROR
+        statuses = sorted((json.loads(line) for line in
+                           capsys.readouterr().err.splitlines()),
+                          key=lambda status: status['line'])
+        assert [status['status'] for status in statuses] == \
+            ["done", "failed", "done", "failed", "failed"]
+        assert statuses[2]['name'] == "second" and statuses[2]['digest']
+        with tarfile.open(archive) as tar_in:
+            names = tar_in.getnames()
+        assert "first/first.qsf" in names and "second/second.qsf" in names
+
+        tree = os.path.join(test_dir, "tree")
+        with open(path) as fin:
+            sys.stdin, stdin = fin, sys.stdin
+            try:
+                cli_client.main(_batch_args("-", path=tree))
+            finally:
+                sys.stdin = stdin
+        assert sorted(os.listdir(tree)) == ["first", "second"]
+
+
+def test_batch_status() -> NoReturn:
+    with use_test_dir() as test_dir:
+        # NOTE invalid line doesn't take default name of unnamed config
+        process = subprocess.run(
+            [sys.executable, cli_client.__file__, "--batch", "-",
+             "--path", test_dir, "--workers", "2"],
+            input='garbage\n{"board": "de1soc"}\n', capture_output=True,
+            text=True, cwd=test_dir
+        )
+        statuses = sorted((json.loads(line) for line in
+                           process.stderr.splitlines()),  # only statuses
+                          key=lambda status: status['line'])
+        assert process.returncode == \
+            cli_client.ReturnCode.GENERATION_ERROR.value
+        assert [status['status'] for status in statuses] == \
+            ["failed", "done"]
+        assert "Invalid json" in statuses[0]['error']
+        assert os.path.exists(os.path.join(test_dir, "MyFpgaProject"))
+
+        path = os.path.join(test_dir, "status.jsonl")
+        with open(os.path.join(test_dir, "batch.jsonl"), "w") as fout:
+            fout.write('{"board": "de1soc", "name": "x y"}\n')
+        result = cli_client.main(_batch_args(
+            os.path.join(test_dir, "batch.jsonl"), status=path,
+            path=os.path.join(test_dir, "tree")
+        ))
+        assert result == cli_client.ReturnCode.GENERATION_ERROR
+        with open(path) as fin:
+            assert json.loads(fin.read())['status'] == "failed"
+
+
+def test_daemon() -> NoReturn:
+    with use_test_dir() as test_dir:
+        path = os.path.join(test_dir, "daemon.sock")
+        args = Namespace(board="de1soc", name="forwarded", mips="simple",
+                         config=None, path=None, archive=False,
+                         socket=path, local=False, batch=None, daemon=False)
+        config = cli_client.Config(None, args.name, args.mips)
+        assert not ping(path)
+        assert cli_client.forward_request(args, config) is None
+
+        handled = []
+
+        def handler(data: dict) -> dict:
+            handled.append(data)
+            return cli_client.handle_request(data)
+
+        daemon = Daemon(handler, path)
+        thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+        thread.start()
+        try:
+            assert ping(path)
+            with pytest.raises(RuntimeError):
+                Daemon(cli_client.handle_request, path)
+
+            cwd = os.getcwd()
+            os.chdir(test_dir)
+            try:
+                assert cli_client.main(args) == cli_client.ReturnCode.OK
+                args.name = "1bad"
+                assert cli_client.main(args) == \
+                    cli_client.ReturnCode.INVALID_PROJECT_NAME
+                assert len(handled) == 2
+                # NOTE running daemon is skipped
+                args.name, args.local = "local", True
+                assert cli_client.main(args) == cli_client.ReturnCode.OK
+                assert len(handled) == 2
+            finally:
+                os.chdir(cwd)
+            assert os.path.exists(os.path.join(test_dir, "forwarded",
+                                               "forwarded.qsf"))
+            assert os.path.exists(os.path.join(test_dir, "local",
+                                               "local.qsf"))
+            response = request({'board': "de1soc"}, path)  # without cwd
+            assert response['error']
+            assert response['code'] == "UNKNOWN_ERROR"
+        finally:
+            daemon.shutdown()
+            daemon.server_close()
+        assert not os.path.exists(path)
@@ -0,0 +1,362 @@
+""" Compatibility tests of synchronous (Flask) and ASGI API clients """
+
+import gzip
+import io
+import json
+import os
+import tarfile
+import uuid
+from typing import Any, Generator, NoReturn
+
+import pytest
+from starlette.testclient import TestClient
+
+import api_client
+import asgi_client
+from engine import BOARDS, MIPS, Admission, ArtifactStore, JobQueue
+from engine.utils import serialize
+from engine.utils.profiling import Profiler
+from tests import TEST_DIR, logging, use_test_dir
+
+
+class ThreadConfig(asgi_client.AppConfig):
+    GENERATION_EXECUTOR = "thread"
+    GENERATION_WORKERS = 2
+    STREAM_CHUNK_SIZE = 1024
+
+
+class ProcessConfig(ThreadConfig):
+    GENERATION_EXECUTOR = "process"
+
+
+class Client(object):
+    """ Common interface of Flask and Starlette test clients """
+
+    def __init__(self, client: Any, **kwargs) -> NoReturn:
+        self.client = client
+        self.kwargs = kwargs
+
+    def get(self, url: str, **kwargs) -> Any:
+        return self.client.get(url, **self.kwargs, **kwargs)
+
+    def post(self, url: str, **kwargs) -> Any:
+        return self.client.post(url, **self.kwargs, **kwargs)
+
+    @staticmethod
+    def content(response: Any) -> bytes:
+        """ Returns decoded body (httpx decodes it automatically) """
+        if not hasattr(response, "get_data"):
+            return response.content
+        content = response.get_data()
+        encoding = response.headers.get("Content-Encoding")
+        if encoding == "gzip":
+            return gzip.decompress(content)
+        if encoding == "br":
+            return serialize.brotli.decompress(content)
+        return content
+
+    @staticmethod
+    def json(response: Any) -> Any:
+        if hasattr(response, "get_json"):
+            return response.get_json()
+        return response.json()
+
+
+@pytest.fixture(params=["flask", "asgi", "asgi-process"])
+def client(request: Any, monkeypatch: Any) -> Generator:
+    # NOTE environment and patched modules are inherited by forked workers
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "0")
+    api_client.archive_cache.clear()
+    with use_test_dir():
+        store = ArtifactStore(os.path.join(TEST_DIR, "store"))
+        queue = JobQueue(os.path.join(TEST_DIR, "jobs.sqlite"),
+                         api_client.run_job, poll_interval=0.01)
+        for module in (api_client, asgi_client):
+            monkeypatch.setattr(module, "artifact_store", store)
+            monkeypatch.setattr(module, "job_queue", queue)
+        try:
+            yield from _client(request.param)
+        finally:
+            queue.stop()
+
+
+def _client(kind: str) -> Generator:
+    if kind == "flask":
+        # NOTE https is required to avoid redirect of SSLify
+        yield Client(api_client.app.test_client(),
+                     base_url="https://localhost")
+        return
+    config = ThreadConfig if kind == "asgi" else ProcessConfig
+    with TestClient(asgi_client.create_app(config)) as test_client:
+        yield Client(test_client)
+
+
+def _members(content: bytes) -> list:
+    with tarfile.open(fileobj=io.BytesIO(content)) as archive:
+        return archive.getnames()
+
+
+def test_metadata(client: Client) -> NoReturn:
+    assert client.json(client.get("/boards")) == {
+        'supported boards': list(BOARDS)
+    }
+    assert client.json(client.get("/mips")) == {
+        'supported mips types': list(MIPS.VERSIONS)
+    }
+    response = client.get("/functions")
+    assert set(client.json(response)) == {"supported functions",
+                                          "configurations"}
+
+    response = client.get(f"/board/{BOARDS[0]}")
+    assert response.status_code == 200
+    assert client.json(response)['board'] == BOARDS[0]
+    etag = response.headers['ETag']
+    assert "max-age" in response.headers['Cache-Control']
+    response = client.get(f"/board/{BOARDS[0]}",
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304 and not client.content(response)
+
+    response = client.get("/board/unknown")
+    assert response.status_code == 405
+    assert client.json(response)['name'] == "UNSUPPORTED_BOARD"
+
+
+def test_errors(client: Client) -> NoReturn:
+    for url, name in (("/generate", "INVALID_CONFIG"),
+                      ("/generate?board=de1soc&key=1", "INVALID_CONFIG"),
+                      ("/generate?board=de1soc&name=1-bad",
+                       "INVALID_PROJECT_NAME"),
+                      (f"/artifact/{'0' * 64}", "UNKNOWN_DIGEST")):
+        response = client.get(url)
+        assert response.status_code == 405, url
+        assert client.json(response)['name'] == name, url
+
+    response = client.post("/delta", json={'board': "de1soc"})
+    assert client.json(response)['name'] == "INVALID_CONFIG"
+    response = client.post("/delta", json={'board': "de1soc",
+                                           'previous': "0" * 64})
+    assert client.json(response)['name'] == "UNKNOWN_DIGEST"
+
+    response = client.get("/unknown")
+    assert response.status_code == 404
+    assert client.json(response)['name'] == "Not Found"
+    response = client.post("/boards")
+    assert response.status_code == 405
+    assert client.json(response)['name'] == "Method Not Allowed"
+
+
+def test_generate(client: Client) -> NoReturn:
+    url = "/generate?board=marsohod3&name=compat"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == "MISS"
+    assert response.headers['Content-Disposition'] == \
+        "attachment; filename=compat.tar"
+    content = client.content(response)
+    assert "compat.qpf" in _members(content)
+    digest = response.headers['X-Project-Digest']
+    assert not response.headers['ETag'].startswith("W/")  # reproducible
+
+    response = client.get(url, headers={'If-None-Match':
+                                        response.headers['ETag']})
+    assert response.status_code == 304 and not client.content(response)
+
+    response = client.get(url)
+    assert response.headers['X-Cache'] == "HIT"
+    assert client.content(response) == content
+
+    response = client.get(f"/artifact/{response.headers['X-Artifact-Digest']}")
+    assert client.content(response) == content
+    assert "immutable" in response.headers['Cache-Control']
+
+    response = client.post(url)
+    assert response.headers['X-Project-Digest'] == digest
+    assert "compat.qpf" in client.json(response)
+
+    response = client.post("/delta", json={'board': "marsohod3",
+                                           'name': "compat",
+                                           'previous': digest})
+    assert response.status_code == 200
+    assert _members(client.content(response)) == ["DELTA.json"]
+
+    stats = client.json(client.get("/cache"))
+    assert stats['hits'] >= 1 and "shared" in stats and "store" in stats
+
+
+def test_jobs(client: Client) -> NoReturn:
+    response = client.post("/jobs", json=[{'board': "de1soc", 'key': 1}])
+    assert response.status_code == 405
+    assert client.json(response)['name'] == "INVALID_CONFIG"
+    response = client.get(f"/jobs/{'0' * 32}")
+    assert client.json(response)['name'] == "UNKNOWN_JOB"
+
+    response = client.post("/jobs", json=[{'board': "marsohod3",
+                                           'name': "first"},
+                                          {'board': "marsohod3",
+                                           'name': "second",
+                                           'mips': MIPS.VERSIONS[0]}])
+    assert response.status_code == 202
+    job = client.json(response)
+    assert response.headers['Location'] == job['url']
+
+    response = client.get(job['events'])
+    assert response.headers['Content-Type'].startswith("text/event-stream")
+    events = [line.split(": ", 1)[1] for line in
+              client.content(response).decode().splitlines()
+              if line.startswith("event: ")]
+    assert events[-1] == "done"
+    assert events[events.index("running"):] == \
+        ["running"] + ["load", "render", "archive"] * 2 + ["done"]
+
+    status = client.json(client.get(job['url']))
+    assert status['state'] == "done" and status['error'] is None
+    assert [item['filename'] for item in status['result']] == \
+        ["first.tar", "second.tar"]
+    response = client.get(status['result'][1]['url'])
+    assert "second.qpf" in _members(client.content(response))
+    # jobs share archive cache with requests
+    response = client.get("/generate?board=marsohod3&name=first")
+    assert response.headers['X-Cache'] == "HIT"
+
+
+def test_overloaded(client: Client, monkeypatch: Any) -> NoReturn:
+    rejecting = Admission(0, name="generations")
+    monkeypatch.setattr(api_client, "generation_admission", rejecting)
+    app = getattr(client.client, "app", None)
+    if hasattr(app, "state"):
+        monkeypatch.setattr(app.state, "generation_admission", rejecting)
+
+    for response in (client.get("/generate?board=de1soc"),
+                     client.post("/generate?board=de1soc")):
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert client.json(response)['name'] == "OVERLOADED"
+    assert rejecting.rejected == 2
+    assert client.get("/boards").status_code == 200
+
+
+def test_delta_of_archive(client: Client) -> NoReturn:
+    # NOTE archive may be generated by worker process, new name is used,
+    # so digest isn't registered by previous tests in this process
+    name = f"delta_{uuid.uuid4().hex}"
+    response = client.get(f"/generate?board=de1soc&name={name}")
+    assert response.headers['X-Cache'] == "MISS"
+    response = client.post("/delta", json={
+        'board': "de1soc",
+        'name': name,
+        'func': ["Seven"],
+        'previous': response.headers['X-Project-Digest']
+    })
+    assert response.status_code == 200
+    assert "functions/Seven.v" in _members(client.content(response))
+
+
+def test_weak_etag(client: Client, monkeypatch: Any) -> NoReturn:
+    monkeypatch.delenv("SOURCE_DATE_EPOCH")
+    url = "/generate?board=marsohod3&name=weak"
+    etag = client.get(url).headers['ETag']
+    assert etag.startswith('W/"')  # NOTE archive depends on generation date
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and response.headers['ETag'] == etag
+
+
+def test_generate_formats(client: Client) -> NoReturn:
+    url = "/generate?board=marsohod3&name=compat"
+    files = client.json(client.post(url))
+
+    response = client.post(url + "&fields=*.qsf,*.qpf",
+                           headers={'Accept': serialize.NDJSON,
+                                    'Accept-Encoding': "gzip"})
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith(serialize.NDJSON)
+    assert response.headers['Content-Encoding'] == "gzip"
+    lines = [json.loads(line) for line in
+             client.content(response).decode().splitlines()]
+    assert {line['name']: line['content'] for line in lines} == \
+        {name: files[name] for name in ("compat.qsf", "compat.qpf")}
+
+    response = client.get(url + "&fields=*.qsf")
+    assert client.json(response)['name'] == "INVALID_CONFIG"
+    response = client.post(url, headers={'Accept': "text/html"})
+    assert client.json(response)['name'] == "UNSUPPORTED_FORMAT"
+
+    if serialize.msgpack is not None:
+        response = client.post(url + "&fields=*.v",
+                               headers={'Accept': serialize.MSGPACK})
+        unpacked = serialize.msgpack.unpackb(client.content(response))
+        assert unpacked and unpacked == {
+            name: content for name, content in files.items()
+            if name.endswith(".v")
+        }
+    if serialize.brotli is not None:
+        response = client.post(url, headers={'Accept-Encoding': "br, gzip"})
+        assert response.headers['Content-Encoding'] == "br"
+        assert json.loads(client.content(response)) == files
+
+
+def test_metrics(monkeypatch: Any) -> NoReturn:
+    api_client.archive_cache.clear()
+    with use_test_dir():
+        monkeypatch.setattr(api_client, "artifact_store",
+                            ArtifactStore(os.path.join(TEST_DIR, "store")))
+        client = Client(api_client.app.test_client(),
+                        base_url="https://localhost")
+        for _ in range(2):
+            assert client.get("/generate?board=de1soc&name=metrics"
+                              ).status_code == 200
+        client.get("/generate?board=de1soc&unknown=1")
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith("text/plain")
+    lines = response.get_data(as_text=True).splitlines()
+    assert "# TYPE sysgen_http_request_duration_seconds histogram" in lines
+    for prefix in ('sysgen_http_request_duration_seconds_count{'
+                   'route="/generate",method="GET",status="200"}',
+                   'sysgen_archive_requests_total{cache="MISS"}',
+                   'sysgen_archive_requests_total{cache="HIT"}',
+                   'sysgen_errors_total{code="INVALID_CONFIG"}',
+                   'sysgen_stage_duration_seconds_count{stage="render"}',
+                   'sysgen_stage_cache_total{stage="load_config",',
+                   "sysgen_archive_size_bytes_count",
+                   "sysgen_generations_in_flight 0"):
+        assert any(line.startswith(prefix) for line in lines), prefix
+
+
+def test_profiles(monkeypatch: Any) -> NoReturn:
+    api_client.archive_cache.clear()
+    with use_test_dir():
+        monkeypatch.setattr(api_client, "artifact_store",
+                            ArtifactStore(os.path.join(TEST_DIR, "store")))
+        monkeypatch.setitem(api_client.app.extensions, "profiler", Profiler(
+            os.path.join(TEST_DIR, "profiles"), sample_rate=1.0,
+            token="secret", interval=0.0005
+        ))
+        client = Client(api_client.app.test_client(),
+                        base_url="https://localhost")
+        token = {'X-Profile': "secret"}
+        sampled = [client.get("/generate?board=de1soc&name=profile")
+                   for _ in range(2)]  # generated and cached
+        requested = client.get("/boards", headers=token)
+        assert client.get("/metrics").headers.get("X-Profile") is None
+        assert client.get("/profiles").status_code == 403
+        assert client.get("/profiles", headers={'X-Profile': "x"}
+                          ).status_code == 403
+        profiles = client.json(client.get("/profiles", headers=token))
+        stacks = client.get(profiles[-1]['url'], headers=token)
+        assert client.get(profiles[-1]['url']).status_code == 403
+        assert client.get("/profiles/unknown", headers=token
+                          ).status_code == 404
+
+    assert sampled[0].headers['X-Cache'] == "MISS"
+    assert sampled[1].headers.get("X-Profile") is None
+    assert [profile['id'] for profile in profiles] == [
+        requested.headers['X-Profile'], sampled[0].headers['X-Profile']
+    ]
+    assert profiles[0]['route'] == "/boards"
+    assert profiles[-1]['path'] == "/generate?board=de1soc&name=profile"
+    assert profiles[-1]['cache'] == "MISS"
+    assert stacks.status_code == 200
+    assert stacks.headers['Content-Disposition'] == \
+        f"attachment; filename={profiles[-1]['id']}.collapsed"
+    assert ";generate (api_client.py:" in stacks.get_data(as_text=True)
@@ -0,0 +1,120 @@
+""" Tests of routes of web client """
+
+import gzip
+import os
+import re
+from typing import Any, Generator, NoReturn
+
+import pytest
+
+import web_client
+from engine import ArtifactStore
+from engine.utils.profiling import Profiler
+from tests import TEST_DIR, use_test_dir
+
+
+@pytest.fixture
+def client(monkeypatch: Any) -> Generator:
+    monkeypatch.setenv("SOURCE_DATE_EPOCH", "0")
+    web_client.preview_cache.clear()
+    with use_test_dir():
+        monkeypatch.setattr(web_client, "artifact_store",
+                            ArtifactStore(TEST_DIR))
+        test_client = web_client.app.test_client()
+        # NOTE https (behind proxy) is required to avoid redirect of SSLify
+        test_client.environ_base['HTTP_X_FORWARDED_PROTO'] = "https"
+        yield test_client
+
+
+def _urls(page: str) -> list:
+    return re.findall(r'(?:src|href)="([^"]+)"', page)
+
+
+def test_page_assets(client: Any) -> NoReturn:
+    assets = web_client.app.extensions['assets']
+    urls = _urls(client.get("/?board=de1soc").get_data(as_text=True))
+    for name in ("bootstrap/css/bootstrap.min.css", "bootstrap/jquery.min.js",
+                 "bootstrap/js/bootstrap.min.js", "board.svg"):
+        assert f"/assets/{assets[name]}" in urls
+
+
+def test_assets(client: Any) -> NoReturn:
+    url = f"/assets/{web_client.app.extensions['assets']['board.svg']}"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith("image/svg+xml")
+    assert "Content-Encoding" not in response.headers
+    assert "Accept-Encoding" in response.vary
+    assert "immutable" in response.headers['Cache-Control']
+    content = response.get_data()
+
+    response = client.get(url, headers={'Accept-Encoding': "gzip"})
+    assert response.headers['Content-Encoding'] == "gzip"
+    assert response.headers['Content-Type'].startswith("image/svg+xml")
+    assert "Accept-Encoding" in response.vary
+    assert gzip.decompress(response.get_data()) == content
+
+    response = client.get(url, headers={'Accept-Encoding': "gzip;q=0"})
+    assert "Content-Encoding" not in response.headers
+
+    assert client.get("/assets/board.svg").status_code == 404
+    assert client.get("/assets/unknown.js").status_code == 404
+
+
+def test_preview(client: Any) -> NoReturn:
+    url = "/preview?board=de1soc&name=preview&func=Seven"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == "MISS"
+    assert response.headers['Content-Type'] == "text/plain; charset=utf-8"
+    assert response.headers['Content-Disposition'] == \
+        "inline; filename=preview.qsf"
+    assert response.headers['Cache-Control'] == "no-cache"
+    assert "preview" in response.get_data(as_text=True)
+    etag = response.headers['ETag']
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['X-Cache'] == "HIT"
+
+    response = client.get(url + "&file=functions/Seven.v")
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == \
+        "inline; filename=Seven.v"
+
+    assert client.get(url + "&file=unknown.v").status_code == 404
+    assert client.get("/preview?board=unknown").status_code == 404
+    assert client.get("/preview?board=de1soc&name=1 2").status_code == 400
+
+
+def test_metrics(client: Any) -> NoReturn:
+    assert client.get("/preview?board=de1soc&name=metrics").status_code == 200
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith("text/plain")
+    lines = response.get_data(as_text=True).splitlines()
+    for prefix in ('sysgen_http_request_duration_seconds_count{'
+                   'route="/preview",method="GET",status="200"}',
+                   'sysgen_stage_duration_seconds_count{stage="render"}',
+                   "sysgen_generations_in_flight 0"):
+        assert any(line.startswith(prefix) for line in lines), prefix
+
+
+def test_profiles(client: Any, monkeypatch: Any) -> NoReturn:
+    monkeypatch.setitem(web_client.app.extensions, "profiler", Profiler(
+        os.path.join(TEST_DIR, "profiles"), token="secret", interval=0.0005
+    ))
+    token = {'X-Profile': "secret"}
+    response = client.get("/preview?board=de1soc&name=profile",
+                          headers=token)
+    assert client.get("/profiles").status_code == 403
+    profiles = client.get("/profiles", headers=token).get_json()
+    assert [profile['id'] for profile in profiles] == \
+        [response.headers['X-Profile']]
+    assert profiles[0]['app'] == "web-client"
+    assert profiles[0]['route'] == "/preview"
+
+    response = client.get(profiles[0]['url'], headers=token)
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == \
+        f"attachment; filename={profiles[0]['id']}.collapsed"
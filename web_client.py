@@ -1,19 +1,28 @@
 import io
 import logging
+import mimetypes
 import os
 from argparse import ArgumentParser, Namespace
 from typing import Any, Dict, Iterable, NoReturn, Tuple
 
-from flask import (Flask, Response, abort, flash, make_response, redirect,
-                   render_template, request, url_for)
+import flask_bootstrap
+from flask import (Flask, Response, abort, current_app, flash, jsonify,
+                   make_response, redirect, render_template, request,
+                   send_file, url_for)
 from flask_bootstrap import Bootstrap
 from flask_sslify import SSLify
 from flask_wtf import FlaskForm
 from wtforms import SelectField, SelectMultipleField, StringField, SubmitField
 from wtforms.validators import DataRequired, Optional, ValidationError
 
-from engine import BOARDS, FUNCTIONS, MIPS, Board
-from engine.utils.prepare import validate_project_name
+from engine import (BOARDS, FUNCTIONS, MIPS, Admission, ArchiveCache,
+                    ArtifactStore, Board, SingleFlight, get_fingerprint,
+                    load_or_generate)
+from engine.constants import PATHS
+from engine.exceptions import Overloaded
+from engine.utils.assets import build_assets, find_asset
+from engine.utils.prepare import get_digest, validate_project_name
+from flask_hooks import init_metrics, init_profiling
 
 
 logging.basicConfig(
@@ -28,6 +37,74 @@ logging.basicConfig(
 class AppConfig(object):
     SECRET_KEY = os.environ.get("SECRET_KEY") or "no-one-knows"
     SSL_REDIRECT = True  # NOTE not working in debug mode
+    ARCHIVE_CACHE_SIZE = int(os.environ.get("ARCHIVE_CACHE_SIZE") or 64 << 20)
+    ARTIFACT_STORE_PATH = os.environ.get("ARTIFACT_STORE_PATH") or PATHS.STORE
+    ARTIFACT_STORE_SIZE = int(os.environ.get("ARTIFACT_STORE_SIZE") or 1 << 30)
+    ARTIFACT_STORE_TTL = float(os.environ.get("ARTIFACT_STORE_TTL") or 86400)
+    STATIC_CACHE_CONTROL = os.environ.get("STATIC_CACHE_CONTROL") or \
+        "public, max-age=3600"
+    ARTIFACT_CACHE_CONTROL = os.environ.get("ARTIFACT_CACHE_CONTROL") or \
+        "public, max-age=31536000, immutable"
+    # admission control per process: concurrent and queued generations
+    GENERATION_LIMIT = int(os.environ.get("GENERATION_LIMIT") or
+                           os.cpu_count() or 1)
+    GENERATION_QUEUE = int(os.environ.get("GENERATION_QUEUE") or
+                           2 * GENERATION_LIMIT)
+    GENERATION_QUEUE_TIMEOUT = float(
+        os.environ.get("GENERATION_QUEUE_TIMEOUT") or 10
+    )
+    # fingerprinted assets (board picture and Bootstrap) built on start
+    ASSETS_PATH = os.environ.get("ASSETS_PATH") or PATHS.ASSETS
+    ASSETS_CACHE_CONTROL = os.environ.get("ASSETS_CACHE_CONTROL") or \
+        "public, max-age=31536000, immutable"
+    # NOTE files are sent by front server (e.g. nginx) if it's enabled,
+    # otherwise by WSGI server with sendfile(2) if it's supported
+    USE_X_SENDFILE = bool(os.environ.get("ASSETS_X_SENDFILE"))
+    BOOTSTRAP_SERVE_LOCAL = not os.environ.get("BOOTSTRAP_CDN")
+    PREVIEW_CACHE_SIZE = int(os.environ.get("PREVIEW_CACHE_SIZE") or 8 << 20)
+    PREVIEW_CACHE_CONTROL = os.environ.get("PREVIEW_CACHE_CONTROL") or \
+        "no-cache"
+    # NOTE directory shared by workers, should be emptied before start
+    METRICS_PATH = os.environ.get("METRICS_PATH") or None
+    # on-demand profiling: requests with 'X-Profile: <token>' header and
+    # sampled generations, token also gives access to /profiles
+    PROFILE_PATH = os.environ.get("PROFILE_PATH") or PATHS.PROFILES
+    PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE") or 0)
+    PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL") or 0.002)
+    PROFILE_MAX = int(os.environ.get("PROFILE_MAX") or 100)
+
+
+class AssetCDN(object):
+    """ Flask-Bootstrap CDN, which serves fingerprinted assets """
+
+    def __init__(self, prefix: str, fallback: Any) -> NoReturn:
+        self.prefix = prefix
+        self.fallback = fallback
+
+    def get_resource_url(self, filename: str) -> str:
+        if self.prefix + filename in current_app.extensions['assets']:
+            return get_asset_url(self.prefix + filename)
+        return self.fallback.get_resource_url(filename)
+
+
+def get_asset_sources(current_folder: str) -> Dict[str, str]:
+    """ :return paths of static files by asset names """
+    sources = {'board.svg': os.path.join(current_folder, "board.svg")}
+    bootstrap_static = os.path.join(
+        os.path.dirname(flask_bootstrap.__file__), "static"
+    )
+    for root, _, files in os.walk(bootstrap_static):
+        for filename in files:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, bootstrap_static).replace(os.sep, "/")
+            sources["bootstrap/" + name] = path
+    return sources
+
+
+def get_asset_url(name: str) -> str:
+    """ :return url of fingerprinted asset """
+    return url_for("asset", filename=current_app.extensions['assets'][name])
 
 
 def create_app(config: AppConfig, name: str = None) -> Flask:
@@ -42,6 +119,16 @@ def create_app(config: AppConfig, name: str = None) -> Flask:
     bootstrap = Bootstrap()
     bootstrap.init_app(app)
 
+    assets = build_assets(get_asset_sources(current_folder),
+                          app.config['ASSETS_PATH'])
+    app.extensions['assets'] = assets
+    app.jinja_env.globals['asset_url'] = get_asset_url
+    cdns = app.extensions['bootstrap']['cdns']
+    for name in ("bootstrap", "jquery"):  # local versions are used
+        cdns[name].primary = AssetCDN("bootstrap/", cdns[name].primary)
+    for name in ("html5shiv", "respond.js"):  # NOTE aren't shipped locally
+        cdns[name] = cdns[name].fallback
+
     if app.config['SSL_REDIRECT'] and not app.debug:
         sslify = SSLify(app)
 
@@ -49,6 +136,25 @@ def create_app(config: AppConfig, name: str = None) -> Flask:
 
 
 app = create_app(AppConfig, "web-client")
+archive_cache = ArchiveCache(app.config['ARCHIVE_CACHE_SIZE'])
+artifact_store = ArtifactStore(app.config['ARTIFACT_STORE_PATH'],
+                               max_bytes=app.config['ARTIFACT_STORE_SIZE'],
+                               ttl=app.config['ARTIFACT_STORE_TTL'])
+asset_files = frozenset(app.extensions['assets'].values())
+preview_cache = ArchiveCache(app.config['PREVIEW_CACHE_SIZE'])
+generation_flight = SingleFlight()
+generation_admission = Admission(
+    app.config['GENERATION_LIMIT'],
+    queue_size=app.config['GENERATION_QUEUE'],
+    timeout=app.config['GENERATION_QUEUE_TIMEOUT'],
+    name="generations"
+)
+metrics = init_metrics(app, "web-client", generation_admission)
+archive_requests = metrics.counter(
+    "sysgen_archive_requests_total",
+    "Archive requests by cache status (X-Cache)", ("cache",)
+)
+profiler = init_profiling(app, "web-client", ("index", "preview"))
 
 
 class BoardForm(FlaskForm):
@@ -114,14 +220,81 @@ class Config(object):
                 zip(items, (True for _ in range(len(items))))}
 
 
-def get_configured_board(config: Config) -> Board:
-    return Board(config.board).setup(
-        project_name=config.project_name,
-        mips_type=config.mips_type,
-        flt=config.configs,
-        conf=config.functions_params,
-        func=config.functions
-    ).generate()
+def get_setup_params(config: Config) -> dict:
+    return {
+        'project_name': config.project_name,
+        'mips_type': config.mips_type,
+        'flt': config.configs,
+        'conf': config.functions_params,
+        'func': config.functions
+    }
+
+
+def load_or_generate_archive(config: Config,
+                             fingerprint: str) -> Tuple[str, bytes, str]:
+    """ Loads archive from artifact store or generates it, caches it """
+    archive, status = load_or_generate(artifact_store, fingerprint,
+                                       config.board, get_setup_params(config))
+    filename, content = archive['filename'], archive['content']
+    archive_cache.put(fingerprint, (filename, content), size=len(content))
+    return filename, content, status
+
+
+def admit_generation(config: Config,
+                     fingerprint: str) -> Tuple[str, bytes, str]:
+    """ Loads or generates archive if it's admitted (or raises Overloaded) """
+    with generation_admission.admit():
+        return load_or_generate_archive(config, fingerprint)
+
+
+def get_configured_archive(config: Config) -> Tuple[str, bytes, str]:
+    """
+        Returns archive filename, content and where it was found:
+        'HIT' (memory cache), 'STORE' (artifact store),
+        'SHARED' (concurrent request result) or 'MISS' (generated)
+    """
+    fingerprint = get_fingerprint(config.board, **get_setup_params(config))
+    cached = archive_cache.get(fingerprint)
+    if cached is not None:
+        return cached + ("HIT",)
+
+    (filename, content, status), shared = generation_flight.do(
+        fingerprint, admit_generation, config, fingerprint
+    )
+    return filename, content, ("SHARED" if shared else status)
+
+
+def get_preview(config: Config, filename: str) -> Tuple[str, str, str]:
+    """
+        Renders single file of configured project (other files aren't
+        generated), rendered files are cached by project fingerprint.
+
+        :param filename: file name or extension of project file
+            (e.g. 'qsf' for '<project name>.qsf')
+        :return file name, content and cache status ('HIT' or 'MISS')
+    """
+    if "." not in filename and "/" not in filename:
+        filename = f"{config.project_name}.{filename}"
+    key = get_fingerprint(config.board, file=filename,
+                          **get_setup_params(config))
+    content = preview_cache.get(key)
+    if content is not None:
+        return filename, content, "HIT"
+
+    board = Board(config.board).setup(**get_setup_params(config))
+    content = board.render_file(filename)  # KeyError for unknown file
+    preview_cache.put(key, content, size=len(content))
+    return filename, content, "MISS"
+
+
+def make_conditional(response: Response,
+                     etag: str or None,
+                     cache_control: str) -> Response:
+    """ Sets ETag and Cache-Control, returns 304 if ETag matches """
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
 
 
 def send_archive(content: io.BytesIO, filename: str) -> Response:
@@ -143,12 +316,19 @@ def index() -> Response:
 
         if form.validate_on_submit():
             try:
-                board = get_configured_board(Config(board, form))
+                filename, content, status = get_configured_archive(
+                    Config(board, form)
+                )
+            except Overloaded:
+                raise
             except BaseException as e:
                 logging.error("Generation failed with exception: %s", e)
                 abort(500)
 
-            return send_archive(board.as_archive, f"{board.project_name}.tar")
+            response = send_archive(io.BytesIO(content), filename)
+            response.headers['X-Cache'] = status
+            archive_requests.inc(cache=status)
+            return response
     elif board:
         flash(f"No such board '{board}' supported")
         return redirect(url_for("index"))
@@ -161,15 +341,95 @@ def index() -> Response:
     )
 
 
+@app.route("/preview")
+def preview() -> Response:
+    """ Single project file for form state passed as query parameters """
+    board = request.args.get("board", "").lower()
+    if board not in BOARDS:
+        abort(404)
+    form = BoardForm(formdata=request.args, meta={'csrf': False})
+    form.conf.choices = [(v, v) for v in Board(board).params.keys()]
+    if not form.validate():
+        logging.debug("Invalid preview form: %s", form.errors)
+        abort(400)
+
+    try:
+        filename, content, status = get_preview(
+            Config(board, form), request.args.get("file", "qsf")
+        )
+    except KeyError:
+        abort(404)
+    response = make_response(content)
+    response.headers['Content-Type'] = "text/plain; charset=utf-8"
+    response.headers['Content-Disposition'] = \
+        f"inline; filename={os.path.basename(filename)}"
+    response.headers['X-Cache'] = status
+    return make_conditional(response, get_digest(content),
+                            app.config['PREVIEW_CACHE_CONTROL'])
+
+
+@app.route("/cache")
+def cache() -> Response:
+    return jsonify(dict(archive_cache.stats,
+                        preview=preview_cache.stats,
+                        shared=generation_flight.shared,
+                        store=artifact_store.stats,
+                        admission=generation_admission.stats))
+
+
+@app.route("/artifact/<digest>")
+def artifact(digest: str) -> Response:
+    if request.if_none_match.contains(digest) and \
+            artifact_store.meta(digest) is not None:
+        return make_conditional(make_response("", 304), digest,
+                                app.config['ARTIFACT_CACHE_CONTROL'])
+    content, meta = artifact_store.get_with_meta(digest)
+    if content is None:
+        abort(404)
+    response = send_archive(io.BytesIO(content),
+                            meta.get("filename") or f"{digest}.tar")
+    return make_conditional(response, digest,
+                            app.config['ARTIFACT_CACHE_CONTROL'])
+
+
+@app.route("/assets/<path:filename>")
+def asset(filename: str) -> Response:
+    """ Fingerprinted asset (precompressed one if it's accepted) """
+    if filename not in asset_files:
+        abort(404)
+    path, encoding = find_asset(
+        os.path.join(app.config['ASSETS_PATH'], filename),
+        request.headers.get("Accept-Encoding")
+    )
+    response = send_file(path, conditional=True, mimetype=(
+        mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    ))
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers['Cache-Control'] = app.config['ASSETS_CACHE_CONTROL']
+    return response
+
+
 @app.route("/img/board")
 def board_picture() -> Response:
-    return app.send_static_file("board.svg")
+    # NOTE ETag is set by send_static_file
+    return make_conditional(app.send_static_file("board.svg"), None,
+                            app.config['STATIC_CACHE_CONTROL'])
 
 
 def get_response_from_error(error: Exception) -> Tuple[Response, int]:
     return error.get_response(), error.code
 
 
+@app.errorhandler(Overloaded)
+def overloaded(error: Overloaded) -> Response:
+    response = make_response(f"{error}\n", 503)
+    response.headers['Content-Type'] = "text/plain"
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
 @app.errorhandler(401)
 def unauthorized(error: Exception) -> Tuple[Response, int]:
     return get_response_from_error(error)